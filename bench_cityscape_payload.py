@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+import pyarrow as pa
+
+from firehose_arrow import build_firehose_batch
+
+BATCH_SIZES = [1_000, 10_000, 50_000]
+BLOCKS_PER_BATCH = 10
+REPEATS = int(os.getenv("BENCH_REPEATS", 7))
+MAX_TRANSACTIONS_PER_EVENT = 500
+
+
+def _quantity(value: int) -> bytes:
+    return value.to_bytes((value.bit_length() + 7) // 8, "big") if value else b""
+
+
+def make_batch(num_transactions: int, seed: int = 42):
+    """Build the same synthetic batch as Python objects (get) and as Arrow tables (get_arrow)"""
+    rng = random.Random(seed)
+    first_block = 20_000_000
+    block_numbers = list(range(first_block, first_block + BLOCKS_PER_BATCH))
+    timestamps = [1_750_000_000 + i // 2 for i in range(BLOCKS_PER_BATCH)]
+
+    tx_blocks = sorted(rng.choice(block_numbers) for _ in range(num_transactions))
+    hashes = [rng.randbytes(32) for _ in range(num_transactions)]
+    values = [rng.choice([0, rng.randint(1, 10**16), rng.randint(10**17, 10**21)]) for _ in range(num_transactions)]
+    gas_used = [rng.randint(21_000, 500_000) for _ in range(num_transactions)]
+    gas_price = [rng.randint(50 * 10**9, 60 * 10**9) for _ in range(num_transactions)]
+
+    objects = SimpleNamespace(
+        blocks=[SimpleNamespace(number=n, timestamp=hex(ts)) for n, ts in zip(block_numbers, timestamps)],
+        transactions=[
+            SimpleNamespace(hash="0x" + h.hex(), value=hex(v), block_number=b, gas_used=hex(gu), gas_price=hex(gp))
+            for h, v, b, gu, gp in zip(hashes, values, tx_blocks, gas_used, gas_price)
+        ],
+    )
+    blocks_table = pa.table({
+        "number": pa.array(block_numbers, pa.uint64()),
+        "timestamp": pa.array([_quantity(ts) for ts in timestamps], pa.binary()),
+    })
+    transactions_table = pa.table({
+        "block_number": pa.array(tx_blocks, pa.uint64()),
+        "hash": pa.array(hashes, pa.binary()),
+        "value": pa.array([_quantity(v) for v in values], pa.binary()),
+        "gas_used": pa.array([_quantity(v) for v in gas_used], pa.binary()),
+        "gas_price": pa.array([_quantity(v) for v in gas_price], pa.binary()),
+    })
+    return objects, blocks_table, transactions_table
+
+
+def legacy_payload(data):
+    """The per-transaction Python loop the firehose used before the Arrow path"""
+    transactions_payload = [{"hash": tx.hash, "value": f"{(int(tx.value, 16) / 1e18):.4f}"} for tx in data.transactions]
+    latest_block = max(data.blocks, key=lambda b: b.number)
+    total_fees = sum((int(tx.gas_used, 16) * int(tx.gas_price, 16)) / 1e18 for tx in data.transactions if tx.gas_used and tx.gas_price)
+    return transactions_payload, latest_block, total_fees
+
+
+def arrow_payload(blocks, transactions):
+    return build_firehose_batch(blocks, transactions, MAX_TRANSACTIONS_PER_EVENT)
+
+
+def measure(fn, *args) -> float:
+    """Median CPU milliseconds per call"""
+    samples = []
+    for _ in range(REPEATS):
+        start = time.process_time()
+        fn(*args)
+        samples.append((time.process_time() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    print("🏙️  Cityscape payload build: per-batch CPU cost (median of %d runs)" % REPEATS)
+    print("=" * 72)
+    print(f"{'transactions':>12} | {'python loop (ms)':>16} | {'arrow path (ms)':>15} | {'speedup':>7}")
+    print("-" * 72)
+    for size in BATCH_SIZES:
+        objects, blocks, transactions = make_batch(size)
+
+        # Both paths must agree on the fee total before timing them
+        _, _, legacy_fees = legacy_payload(objects)
+        arrow_fees = arrow_payload(blocks, transactions).total_fees
+        assert abs(legacy_fees - arrow_fees) <= 1e-9 * max(1.0, legacy_fees), (legacy_fees, arrow_fees)
+
+        legacy_ms = measure(legacy_payload, objects)
+        arrow_ms = measure(arrow_payload, blocks, transactions)
+        print(f"{size:>12,} | {legacy_ms:>16.2f} | {arrow_ms:>15.2f} | {legacy_ms / max(arrow_ms, 1e-6):>6.1f}x")
+    print("=" * 72)
+    print(f"Arrow path materializes at most {MAX_TRANSACTIONS_PER_EVENT} transactions per event.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+SSE fan-out load test.
+
+Starts the real FastAPI app in a child process on the deterministic synthetic data source
+(DATA_SOURCE=synthetic, see data_sources.py), then opens N concurrent SSE clients (spread over several
+client processes) on /firehose-stream or /derby-stream and reports, per level:
+  - end-to-end latency, block production -> client receipt (firehose only)
+  - fan-out spread, first client -> every other client receiving the same event
+  - server CPU and RSS per subscriber (from /proc, so Linux only)
+  - upstream calls per second (from the app's own /metrics)
+
+Environment:
+  BENCH_LEVELS=100,1000,10000  BENCH_STREAMS=firehose,derby  BENCH_SECONDS=20
+  BENCH_CLIENT_PROCESSES=<cpus/2>  BENCH_TPS=1000
+"""
+
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+LEVELS = [int(level) for level in os.getenv("BENCH_LEVELS", "100,1000,10000").split(",")]
+STREAMS = os.getenv("BENCH_STREAMS", "firehose,derby").split(",")
+SECONDS = float(os.getenv("BENCH_SECONDS", 20))
+CLIENT_PROCESSES = int(os.getenv("BENCH_CLIENT_PROCESSES", max(1, (os.cpu_count() or 2) // 2)))
+STREAM_PATHS = {"firehose": "/firehose-stream", "derby": "/derby-stream"}
+
+HOST = "127.0.0.1"
+BLOCK_INTERVAL_SECONDS = 0.5
+TPS = float(os.getenv("BENCH_TPS", 1000))
+CONNECT_BATCH = 500
+READY_TIMEOUT_SECONDS = 60
+LATEST_BLOCK_MARKER = b'"latest_block": {"number": '
+
+
+# ==========================================================
+# === App server (child process)
+# ==========================================================
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def serve(port: int):
+    raise_fd_limit()
+    import uvicorn
+    import main_web_optimized
+    uvicorn.run(main_web_optimized.app, host=HOST, port=port, log_level="warning", backlog=16384)
+
+
+# ==========================================================
+# === Client processes
+# ==========================================================
+def event_key(stream: str, line: bytes):
+    """Firehose events are keyed by their latest block; derby payloads by content"""
+    if stream == "firehose":
+        start = line.find(LATEST_BLOCK_MARKER)
+        if start < 0:
+            return None
+        start += len(LATEST_BLOCK_MARKER)
+        return int(line[start:line.index(b",", start)])
+    return zlib.crc32(line)
+
+
+async def sse_client(port: int, stream: str, recording: dict, received: list, connected: list):
+    try:
+        reader, writer = await asyncio.open_connection(HOST, port, limit=1 << 24)
+    except OSError:
+        return
+    writer.write(f"GET {STREAM_PATHS[stream]} HTTP/1.1\r\nHost: {HOST}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        connected[0] += 1
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if recording["on"] and line.startswith(b"data: "):
+                received.append((event_key(stream, line), time.time()))
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_clients(port: int, stream: str, count: int):
+    """Open `count` clients, say "ready", record between "go" and stdin EOF, then dump JSON"""
+    raise_fd_limit()
+    recording = {"on": False}
+    per_client = [[] for _ in range(count)]
+    connected = [0]
+    tasks = []
+    for start in range(0, count, CONNECT_BATCH):
+        for i in range(start, min(count, start + CONNECT_BATCH)):
+            tasks.append(asyncio.create_task(sse_client(port, stream, recording, per_client[i], connected)))
+        await asyncio.sleep(0.05)
+    deadline = time.monotonic() + READY_TIMEOUT_SECONDS
+    while connected[0] < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    print(f"ready {connected[0]}", flush=True)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, sys.stdin.readline)
+    recording["on"] = True
+    await loop.run_in_executor(None, sys.stdin.readline)
+    recording["on"] = False
+    for task in tasks:
+        task.cancel()
+    received = [[(key, t) for key, t in events if key is not None] for events in per_client]
+    print(json.dumps({"connected": connected[0], "received": received}), flush=True)
+
+
+# ==========================================================
+# === Orchestration
+# ==========================================================
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def proc_cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def http_get(port: int, path: str) -> str:
+    with socket.create_connection((HOST, port), timeout=5) as s:
+        s.sendall(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode())
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    head, _, body = b"".join(chunks).partition(b"\r\n\r\n")
+    if b"Transfer-Encoding: chunked" in head:
+        decoded, rest = [], body
+        while rest:
+            size_line, _, rest = rest.partition(b"\r\n")
+            size = int(size_line, 16)
+            if size == 0:
+                break
+            decoded.append(rest[:size])
+            rest = rest[size + 2:]
+        body = b"".join(decoded)
+    return body.decode()
+
+
+def upstream_calls(port: int) -> float:
+    total = 0.0
+    for line in http_get(port, "/metrics").splitlines():
+        if line.startswith("monad_upstream_request_seconds_count"):
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return {p: float("nan") for p in points}
+    ordered = sorted(samples)
+    return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def run_level(stream: str, clients: int, genesis: float) -> dict:
+    port = free_port()
+    script = os.path.abspath(__file__)
+    env = dict(
+        os.environ, DATA_SOURCE="synthetic", SYNTHETIC_GENESIS=str(genesis), SYNTHETIC_TPS=str(TPS),
+        SYNTHETIC_BLOCK_INTERVAL_SECONDS=str(BLOCK_INTERVAL_SECONDS),
+        HISTORY_PATH=os.path.join(tempfile.mkdtemp(prefix="bench_sse_"), "history.bin"),
+        DERBY_VIEW_INTERVAL_SECONDS="0", SERVE_ROLE="standalone",
+    )
+    server_log_path = os.path.join(os.path.dirname(env["HISTORY_PATH"]), "server.log")
+    server_log = open(server_log_path, "w")
+    server = subprocess.Popen([sys.executable, script, "serve", str(port)], env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    workers = []
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                http_get(port, "/health")
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"Server did not start, see {server_log_path}")
+                time.sleep(0.2)
+        time.sleep(2 * BLOCK_INTERVAL_SECONDS)
+        rss_before = proc_rss_bytes(server.pid)
+
+        processes = min(CLIENT_PROCESSES, clients)
+        for i in range(processes):
+            share = clients // processes + (1 if i < clients % processes else 0)
+            workers.append(subprocess.Popen(
+                [sys.executable, script, "clients", str(port), stream, str(share)],
+                env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            ))
+        connected = sum(int(worker.stdout.readline().split()[1]) for worker in workers)
+
+        calls_before, cpu_before, wall_before = upstream_calls(port), proc_cpu_seconds(server.pid), time.monotonic()
+        for worker in workers:
+            worker.stdin.write("go\n"); worker.stdin.flush()
+        time.sleep(SECONDS)
+        rss_during = proc_rss_bytes(server.pid)
+        calls_after, cpu_after, wall_after = upstream_calls(port), proc_cpu_seconds(server.pid), time.monotonic()
+
+        received = []
+        for worker in workers:
+            worker.stdin.close()
+            received.extend(json.loads(worker.stdout.readline())["received"])
+    finally:
+        for worker in workers:
+            worker.kill()
+        server.terminate()
+        server.wait(10)
+        server_log.close()
+
+    # Fan-out spread is measured against the first receipt of each event by any client
+    first_seen = {}
+    for events in received:
+        for key, t in events:
+            first_seen[key] = min(t, first_seen.get(key, t))
+    spread = [(t - first_seen[key]) * 1000 for events in received for key, t in events]
+    end_to_end = []
+    if stream == "firehose":
+        end_to_end = [(t - (genesis + key * BLOCK_INTERVAL_SECONDS)) * 1000 for events in received for key, t in events]
+    wall = wall_after - wall_before
+    cpu_percent = 100 * (cpu_after - cpu_before) / wall
+    return {
+        "stream": stream,
+        "clients": clients,
+        "connected": connected,
+        "events_per_client": statistics.mean(len(events) for events in received) if received else 0,
+        "e2e_ms": percentiles(end_to_end),
+        "spread_ms": percentiles(spread),
+        "cpu_percent": cpu_percent,
+        "cpu_percent_per_1k": cpu_percent / max(connected, 1) * 1000,
+        "rss_mb": rss_during / 2**20,
+        "rss_kb_per_client": (rss_during - rss_before) / 1024 / max(connected, 1),
+        "upstream_calls_per_second": (calls_after - calls_before) / wall,
+    }
+
+
+def main():
+    print("📡 SSE fan-out: %ds per level, %g synthetic TPS, %d client processes, fd limit %d" % (SECONDS, TPS, CLIENT_PROCESSES, raise_fd_limit()))
+    header = (f"{'stream':>8} | {'clients':>7} | {'conn':>6} | {'ev/cl':>5} | {'e2e p50/p99 ms':>15} | {'spread p50/p99 ms':>17} | "
+              f"{'cpu %':>6} | {'cpu%/1k':>7} | {'rss MB':>6} | {'KB/cl':>6} | {'up/s':>5}")
+    print("=" * len(header))
+    print(header)
+    print("-" * len(header))
+    # Start the chain in the past so the initial lookback has blocks to read
+    genesis = time.time() - 1000 * BLOCK_INTERVAL_SECONDS
+    for stream in STREAMS:
+        for clients in LEVELS:
+            r = run_level(stream, clients, genesis)
+            e2e = f"{r['e2e_ms'][50]:.0f}/{r['e2e_ms'][99]:.0f}" if stream == "firehose" else "-"
+            spread = f"{r['spread_ms'][50]:.1f}/{r['spread_ms'][99]:.1f}"
+            print(f"{stream:>8} | {clients:>7,} | {r['connected']:>6,} | {r['events_per_client']:>5.1f} | {e2e:>15} | {spread:>17} | "
+                  f"{r['cpu_percent']:>6.1f} | {r['cpu_percent_per_1k']:>7.2f} | {r['rss_mb']:>6.0f} | {r['rss_kb_per_client']:>6.1f} | "
+                  f"{r['upstream_calls_per_second']:>5.2f}")
+    print("=" * len(header))
+    print("e2e: block production -> receipt. spread: first client -> each client, same event.")
+    print("Upstream calls/s should stay flat as clients grow; anything else is a fan-out regression.")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(int(sys.argv[2]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "clients":
+        asyncio.run(run_clients(int(sys.argv[2]), sys.argv[3], int(sys.argv[4])))
+    else:
+        main()
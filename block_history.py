@@ -0,0 +1,126 @@
+import math
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# One fixed-size little-endian record per block, appended in block order
+RECORD_DTYPE = np.dtype([
+    ("block_number", "<i8"),
+    ("timestamp", "<i8"),
+    ("tx_count", "<i8"),
+    ("fee_sum", "<f8"),
+    ("value_sum", "<f8"),
+])
+
+
+class BlockHistoryStore:
+    """
+    Append-only on-disk log of per-block firehose aggregates.
+    Records are written in block order, so timestamps are non-decreasing and a time range
+    is two binary searches over a read-only memory map; only the matching rows are read.
+    A torn record left by a crash is truncated on open.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._file = None
+        if read_only:
+            # A reader in another process; the writer owns truncation and appends
+            self.records = os.path.getsize(path) // RECORD_DTYPE.itemsize if os.path.exists(path) else 0
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "ab") as f:
+                size = f.tell()
+                if size % RECORD_DTYPE.itemsize:
+                    f.truncate(size - size % RECORD_DTYPE.itemsize)
+            self._file = open(path, "ab")
+            self.records = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        self._map: Optional[np.memmap] = None
+        self.last_block_number: Optional[int] = None
+        self.last_timestamp: Optional[int] = None
+        if self.records:
+            last = self._mapped()[-1]
+            self.last_block_number, self.last_timestamp = int(last["block_number"]), int(last["timestamp"])
+
+    def _mapped(self) -> np.ndarray:
+        """Read-only view over every complete record, remapped when the log has grown"""
+        if self.records == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        if self._map is None or len(self._map) != self.records:
+            self._map = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", shape=(self.records,))
+        return self._map
+
+    def append_batch(self, batch) -> np.ndarray:
+        """Append the blocks of a FirehoseBatch that are newer than the last stored block; returns the written records"""
+        if not len(batch):
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        keep = batch.block_numbers > (self.last_block_number if self.last_block_number is not None else -1)
+        if not keep.any():
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        records = np.zeros(int(keep.sum()), dtype=RECORD_DTYPE)
+        records["block_number"] = batch.block_numbers[keep]
+        # Clamp so the timestamp column stays sorted even if the chain reports a step back
+        records["timestamp"] = np.maximum.accumulate(np.maximum(batch.block_timestamps[keep], self.last_timestamp or 0))
+        records["tx_count"] = batch.block_tx_counts[keep]
+        records["fee_sum"] = batch.block_fees[keep]
+        records["value_sum"] = batch.block_values[keep]
+        self._file.write(records.tobytes())
+        self._file.flush()
+        self.records += len(records)
+        self.last_block_number = int(records["block_number"][-1])
+        self.last_timestamp = int(records["timestamp"][-1])
+        return records
+
+    def refresh(self) -> np.ndarray:
+        """Read-only stores: pick up records the writer appended since the last call and return them"""
+        if not self.read_only or not os.path.exists(self.path):
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        previous = self.records
+        # A partially written trailing record is ignored until it is complete
+        self.records = os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        if self.records <= previous:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        added = np.array(self._mapped()[previous:])
+        self.last_block_number = int(added["block_number"][-1])
+        self.last_timestamp = int(added["timestamp"][-1])
+        return added
+
+    def read_range(self, start: int, end: int) -> np.ndarray:
+        """Copy of the records with start <= timestamp < end"""
+        mapped = self._mapped()
+        timestamps = mapped["timestamp"]
+        lo, hi = np.searchsorted(timestamps, [start, end], side="left")
+        return np.array(mapped[lo:hi])
+
+    def iter_chunks(self, start: int = 0, chunk_records: int = 1_000_000):
+        """Records with timestamp >= start, in bounded chunks"""
+        mapped = self._mapped()
+        lo = int(np.searchsorted(mapped["timestamp"], start, side="left"))
+        for offset in range(lo, len(mapped), chunk_records):
+            yield np.array(mapped[offset:offset + chunk_records])
+
+    def aggregate(self, start: int, end: int, resolution: int) -> Dict[str, Any]:
+        """Dense per-bucket sums over [start, end); tps is the bucket's average rate"""
+        buckets = max(0, math.ceil((end - start) / resolution))
+        rows = self.read_range(start, end)
+        index = (rows["timestamp"] - start) // resolution
+        tx_count = np.bincount(index, weights=rows["tx_count"], minlength=buckets)
+        return {
+            "timestamp": (start + resolution * np.arange(buckets)).tolist(),
+            "blocks": np.bincount(index, minlength=buckets).tolist(),
+            "tx_count": tx_count.astype(np.int64).tolist(),
+            "fee_sum": np.bincount(index, weights=rows["fee_sum"], minlength=buckets).tolist(),
+            "value_sum": np.bincount(index, weights=rows["value_sum"], minlength=buckets).tolist(),
+            "tps": (tx_count / resolution).tolist(),
+        }
+
+    @property
+    def first_timestamp(self) -> Optional[int]:
+        return int(self._mapped()[0]["timestamp"]) if self.records else None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._map = None
@@ -0,0 +1,166 @@
+import asyncio
+import heapq
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+
+# Overflow policies for a subscriber whose queue is full
+DROP_OLDEST = "drop_oldest"  # keep the most recent `queue_size` events (firehose batches)
+COALESCE_LATEST = "latest"   # only the newest event matters (derby state snapshots)
+
+
+class Subscription:
+    """
+    One subscriber's bounded view of a broadcaster.
+    Holds references to the shared encoded events, never copies, so memory per
+    subscriber is bounded by the queue size regardless of how far behind it is.
+    """
+
+    __slots__ = (
+        "broadcaster", "subscriber_id", "pending", "ready", "closed",
+        "delivered", "dropped", "last_delivered_seq", "last_delivery_at", "subscribed_at",
+    )
+
+    def __init__(self, broadcaster: "Broadcaster", subscriber_id: int, maxlen: int):
+        self.broadcaster = broadcaster
+        self.subscriber_id = subscriber_id
+        # (sequence number, publish time, encoded event)
+        self.pending: deque = deque(maxlen=maxlen)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.last_delivered_seq = broadcaster.seq
+        self.subscribed_at = self.last_delivery_at = time.monotonic()
+
+    async def get(self) -> Optional[Any]:
+        """Next event for this subscriber, or None once it has been evicted or closed"""
+        while not self.pending:
+            if self.closed:
+                return None
+            self.ready.clear()
+            await self.ready.wait()
+        seq, _, event = self.pending.popleft()
+        self.delivered += 1
+        self.last_delivered_seq = seq
+        self.last_delivery_at = time.monotonic()
+        return event
+
+    def lag_events(self) -> int:
+        """How many published events this subscriber has not consumed yet (including dropped ones)"""
+        return self.broadcaster.seq - self.last_delivered_seq
+
+    def stalled_for(self, now: Optional[float] = None) -> float:
+        """Seconds since the last delivery while events are waiting; 0 when caught up"""
+        if not self.pending:
+            return 0.0
+        return (time.monotonic() if now is None else now) - self.last_delivery_at
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "id": self.subscriber_id,
+            "pending": len(self.pending),
+            "lag_events": self.lag_events(),
+            "stalled_seconds": round(self.stalled_for(now), 3),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "connected_seconds": round(now - self.subscribed_at, 3),
+        }
+
+
+class Broadcaster:
+    """
+    In-process fan-out for a live stream.
+    A single producer publishes events that are encoded to bytes exactly once; every
+    subscriber reads them from its own bounded queue. When a queue is full the overflow
+    policy either drops the oldest event or coalesces to the latest one, and subscribers
+    that stay stalled for longer than `max_stall_seconds` are evicted; `on_evict` is
+    called after each eviction.
+    """
+
+    def __init__(self, name: str, queue_size: int = 8, policy: str = DROP_OLDEST, max_stall_seconds: float = 30.0,
+                 on_evict: Optional[Callable[["Broadcaster"], None]] = None):
+        if policy not in (DROP_OLDEST, COALESCE_LATEST):
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.name = name
+        self.policy = policy
+        self.queue_size = 1 if policy == COALESCE_LATEST else queue_size
+        self.max_stall_seconds = max_stall_seconds
+        self.on_evict = on_evict
+        self.subscribers: Set[Subscription] = set()
+        self.latest: Optional[tuple] = None
+        self.seq = 0
+        self.next_subscriber_id = 0
+        self.dropped_total = 0
+        self.evicted_total = 0
+
+    def subscribe(self) -> Subscription:
+        """Register a new subscriber, primed with the latest event published while anyone was listening"""
+        self.next_subscriber_id += 1
+        subscription = Subscription(self, self.next_subscriber_id, self.queue_size)
+        if self.latest is not None:
+            subscription.pending.append(self.latest)
+            subscription.last_delivered_seq = self.latest[0] - 1
+            subscription.ready.set()
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.closed = True
+        self.subscribers.discard(subscription)
+        if not self.subscribers:
+            # With nobody listening the producer may stop (the derby engine deactivates idle
+            # sessions), so the last event can be arbitrarily old by the next subscribe
+            self.latest = None
+
+    def _evict(self, subscription: Subscription):
+        self.unsubscribe(subscription)
+        subscription.pending.clear()
+        subscription.ready.set()
+        self.evicted_total += 1
+
+    def publish(self, event: Union[str, bytes, Any]):
+        """
+        Push one event to every subscriber, applying the overflow and eviction policies.
+        Text is encoded to bytes here, once; other event objects (e.g. a ws_protocol.StreamEvent
+        carrying several pre-encoded forms) are shared by reference as they are.
+        """
+        if isinstance(event, str):
+            event = event.encode()
+        self.seq += 1
+        now = time.monotonic()
+        item = self.latest = (self.seq, now, event)
+        stalled = []
+        for subscription in self.subscribers:
+            if len(subscription.pending) == self.queue_size:
+                # deque(maxlen) discards the oldest entry on append
+                subscription.dropped += 1
+                self.dropped_total += 1
+                if now - subscription.last_delivery_at > self.max_stall_seconds:
+                    stalled.append(subscription)
+            subscription.pending.append(item)
+            subscription.ready.set()
+        for subscription in stalled:
+            self._evict(subscription)
+        if stalled and self.on_evict is not None:
+            self.on_evict(self)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self.subscribers)
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """Aggregate counters plus the `top` most lagging subscribers"""
+        now = time.monotonic()
+        laggiest: List[Subscription] = heapq.nlargest(top, self.subscribers, key=lambda s: (s.lag_events(), s.stalled_for(now)))
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "subscribers": self.subscriber_count,
+            "published": self.seq,
+            "dropped": self.dropped_total,
+            "evicted": self.evicted_total,
+            "max_lag_events": max((s.lag_events() for s in self.subscribers), default=0),
+            "laggiest": [s.stats(now) for s in laggiest],
+        }
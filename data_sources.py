@@ -0,0 +1,270 @@
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+
+
+class ChainDataSource:
+    """
+    What the ingestion loops and replay need from a chain backend; the method names and
+    response shapes follow hypersync.HypersyncClient so the real client is a thin wrapper.
+    `get` returns Python objects, `get_arrow` Arrow tables, and `stream_arrow` an object
+    with async `recv()` (None when done) and `close()`.
+    """
+
+    name = "abstract"
+
+    async def get_height(self) -> int:
+        raise NotImplementedError
+
+    async def get(self, query):
+        raise NotImplementedError
+
+    async def get_arrow(self, query):
+        raise NotImplementedError
+
+    async def stream_arrow(self, query, config):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.name}
+
+
+class HypersyncDataSource(ChainDataSource):
+    name = "hypersync"
+
+    def __init__(self, url: str, bearer_token: str):
+        import hypersync
+        self.url = url
+        self.client = hypersync.HypersyncClient(hypersync.ClientConfig(url=url, bearer_token=bearer_token))
+
+    async def get_height(self) -> int:
+        return await self.client.get_height()
+
+    async def get(self, query):
+        return await self.client.get(query)
+
+    async def get_arrow(self, query):
+        return await self.client.get_arrow(query)
+
+    async def stream_arrow(self, query, config):
+        return await self.client.stream_arrow(query, config)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.name, "url": self.url}
+
+
+def zipf_weights(addresses: Sequence[str], exponent: float = 1.0) -> Dict[str, float]:
+    """Rank-based weights: the k-th address gets 1 / k ** exponent of the traffic"""
+    return {address: 1.0 / (rank ** exponent) for rank, address in enumerate(addresses, start=1)}
+
+
+def _fixed_binary(matrix: np.ndarray) -> pa.Array:
+    """Rows of a (n, width) uint8 matrix as a fixed-size binary column, without copying per value"""
+    n, width = matrix.shape
+    return pa.Array.from_buffers(pa.binary(width), n, [None, pa.py_buffer(np.ascontiguousarray(matrix).tobytes())])
+
+
+def _big_endian(values: np.ndarray, width: int = 8) -> np.ndarray:
+    return values.astype(">u8").view(np.uint8).reshape(-1, 8)[:, 8 - width:]
+
+
+class SyntheticBlock:
+    """Columns of one generated block; `to` indexes into the source's address table"""
+    __slots__ = ("number", "timestamp", "hashes", "values", "gas_used", "gas_price", "to")
+
+    def __init__(self, number: int, timestamp: int, hashes: np.ndarray, values: np.ndarray,
+                 gas_used: np.ndarray, gas_price: np.ndarray, to: np.ndarray):
+        self.number = number
+        self.timestamp = timestamp
+        self.hashes = hashes
+        self.values = values
+        self.gas_used = gas_used
+        self.gas_price = gas_price
+        self.to = to
+
+
+class SyntheticStream:
+    def __init__(self, source: "SyntheticDataSource", query, max_num_blocks: int):
+        self.source = source
+        self.next_block = query.from_block
+        self.to_block = query.to_block
+        self.max_num_blocks = max_num_blocks
+
+    async def recv(self):
+        end = self.source.height() + 1 if self.to_block is None else min(self.to_block, self.source.height() + 1)
+        if self.next_block >= end:
+            return None
+        numbers = range(self.next_block, min(end, self.next_block + self.max_num_blocks))
+        self.next_block = numbers.stop
+        return self.source.arrow_response(numbers)
+
+    async def close(self):
+        pass
+
+
+class SyntheticDataSource(ChainDataSource):
+    """
+    A generated chain for running offline: one block every `block_interval` seconds of
+    wall time, with a Poisson number of transactions averaging `tps`. A share
+    `tracked_share` of transactions goes to `address_weights` (e.g. the derby contracts)
+    in proportion to their weights; the rest is spread over `other_addresses` random
+    addresses. Blocks are generated column-wise from a per-block seed, so any block
+    reads the same every time it is requested, and recent blocks are cached.
+    """
+
+    name = "synthetic"
+
+    def __init__(self, tps: float = 1000.0, block_interval: float = 0.5, address_weights: Optional[Dict[str, float]] = None,
+                 tracked_share: float = 0.3, other_addresses: int = 10_000, seed: int = 42,
+                 genesis: Optional[float] = None, history_blocks: int = 1000, cache_blocks: int = 512):
+        self.tps = tps
+        self.block_interval = block_interval
+        self.seed = seed
+        # Wall-clock time of block 0; by default the chain already has `history_blocks` blocks
+        self.genesis = genesis if genesis is not None else time.time() - history_blocks * block_interval
+        rng = np.random.default_rng(seed)
+        tracked = {address.lower(): weight for address, weight in (address_weights or {}).items()}
+        others = ["0x" + rng.bytes(20).hex() for _ in range(other_addresses)]
+        self.addresses: List[str] = list(tracked) + others
+        self._address_bytes = np.frombuffer(
+            b"".join(bytes.fromhex(address[2:]) for address in self.addresses), dtype=np.uint8
+        ).reshape(-1, 20)
+        weights = np.array(list(tracked.values()), dtype=np.float64)
+        share = tracked_share if len(tracked) else 0.0
+        probabilities = np.concatenate((
+            weights / weights.sum() * share if len(tracked) else np.zeros(0),
+            np.full(other_addresses, (1.0 - share) / max(other_addresses, 1)),
+        ))
+        self._cumulative = np.cumsum(probabilities / probabilities.sum())
+        self._address_index = {address: i for i, address in enumerate(self.addresses)}
+        self._cache: "OrderedDict[int, SyntheticBlock]" = OrderedDict()
+        self.cache_blocks = cache_blocks
+        self.blocks_generated = 0
+        self.transactions_generated = 0
+
+    def height(self) -> int:
+        return int((time.time() - self.genesis) / self.block_interval)
+
+    def block_time(self, number: int) -> float:
+        """Wall-clock time at which block `number` is produced"""
+        return self.genesis + number * self.block_interval
+
+    def block(self, number: int) -> SyntheticBlock:
+        block = self._cache.get(number)
+        if block is not None:
+            self._cache.move_to_end(number)
+            return block
+        rng = np.random.default_rng((self.seed, number))
+        n = int(rng.poisson(self.tps * self.block_interval))
+        # Most transfers are small, a few are large; a third carry no value at all
+        values = np.where(rng.random(n) < 0.33, 0.0, rng.lognormal(mean=np.log(1e17), sigma=2.5, size=n))
+        block = SyntheticBlock(
+            number=number,
+            timestamp=int(self.block_time(number)),
+            hashes=np.frombuffer(rng.bytes(32 * n), dtype=np.uint8).reshape(n, 32),
+            values=values,
+            gas_used=rng.integers(21_000, 500_000, size=n, dtype=np.int64),
+            gas_price=rng.integers(50 * 10**9, 60 * 10**9, size=n, dtype=np.int64),
+            to=np.searchsorted(self._cumulative, rng.random(n), side="right").clip(0, len(self.addresses) - 1),
+        )
+        self._cache[number] = block
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        self.blocks_generated += 1
+        self.transactions_generated += n
+        return block
+
+    def _range(self, query) -> range:
+        end = self.height() + 1
+        if query.to_block is not None:
+            end = min(end, query.to_block)
+        return range(query.from_block, max(query.from_block, end))
+
+    def _response(self, numbers: range, blocks, transactions):
+        return SimpleNamespace(
+            data=SimpleNamespace(blocks=blocks, transactions=transactions),
+            next_block=numbers.stop, archive_height=self.height(), total_execution_time=0,
+        )
+
+    def arrow_response(self, numbers: range):
+        blocks = [self.block(number) for number in numbers]
+        counts = np.array([len(block.values) for block in blocks], dtype=np.int64)
+        total = int(counts.sum())
+        values = np.concatenate([block.values for block in blocks]) if blocks else np.zeros(0)
+        # Quantities are big-endian like HyperSync's; values can exceed 2**64 wei, so they get 16 bytes
+        high = np.floor(values / 2.0**64)
+        low = np.clip(values - high * 2.0**64, 0, 2.0**64 - 4096)
+        value_bytes = np.hstack((_big_endian(high.astype(np.uint64)), _big_endian(low.astype(np.uint64))))
+        hashes = np.concatenate([block.hashes for block in blocks]) if blocks else np.zeros((0, 32), np.uint8)
+        to = np.concatenate([block.to for block in blocks]) if blocks else np.zeros(0, np.int64)
+        block_table = pa.table({
+            "number": pa.array([block.number for block in blocks], pa.uint64()),
+            "timestamp": _fixed_binary(_big_endian(np.array([block.timestamp for block in blocks], dtype=np.uint64))),
+        })
+        transaction_table = pa.table({
+            "block_number": pa.array(np.repeat([block.number for block in blocks], counts).astype(np.uint64), pa.uint64()),
+            "hash": pa.Array.from_buffers(
+                pa.binary(), total, [None, pa.py_buffer((np.arange(total + 1, dtype=np.int32) * 32).tobytes()), pa.py_buffer(hashes.tobytes())]
+            ),
+            "value": _fixed_binary(value_bytes),
+            "gas_used": _fixed_binary(_big_endian(np.concatenate([block.gas_used for block in blocks]) if blocks else np.zeros(0, np.int64))),
+            "gas_price": _fixed_binary(_big_endian(np.concatenate([block.gas_price for block in blocks]) if blocks else np.zeros(0, np.int64))),
+            "to": _fixed_binary(self._address_bytes[to]),
+        })
+        return self._response(numbers, block_table, transaction_table)
+
+    def _selected(self, query) -> Optional[np.ndarray]:
+        """Address indexes a query's `to` selection allows, or None for every transaction"""
+        wanted = set()
+        for selection in query.transactions or []:
+            addresses = getattr(selection, "to", None)
+            if not addresses:
+                return None
+            wanted.update(self._address_index[a.lower()] for a in addresses if a.lower() in self._address_index)
+        return np.fromiter(wanted, dtype=np.int64) if query.transactions else None
+
+    async def get_height(self) -> int:
+        return self.height()
+
+    async def get(self, query):
+        """Object response; only the transactions the selection matches become Python objects"""
+        numbers = self._range(query)
+        selected = self._selected(query)
+        blocks, transactions = [], []
+        for number in numbers:
+            block = self.block(number)
+            blocks.append(SimpleNamespace(number=number, timestamp=hex(block.timestamp)))
+            rows = np.flatnonzero(np.isin(block.to, selected)) if selected is not None else np.arange(len(block.to))
+            for row in rows.tolist():
+                transactions.append(SimpleNamespace(
+                    block_number=number,
+                    hash="0x" + block.hashes[row].tobytes().hex(),
+                    to=self.addresses[block.to[row]],
+                    value=hex(int(block.values[row])),
+                    gas_used=hex(int(block.gas_used[row])),
+                    gas_price=hex(int(block.gas_price[row])),
+                ))
+        return self._response(numbers, blocks, transactions)
+
+    async def get_arrow(self, query):
+        return self.arrow_response(self._range(query))
+
+    async def stream_arrow(self, query, config):
+        return SyntheticStream(self, query, getattr(config, "max_num_blocks", None) or 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.name,
+            "tps": self.tps,
+            "block_interval_seconds": self.block_interval,
+            "height": self.height(),
+            "blocks_generated": self.blocks_generated,
+            "transactions_generated": self.transactions_generated,
+        }
@@ -0,0 +1,110 @@
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple
+
+from hypersync import TransactionSelection
+
+ADDRESS_PATTERN = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+
+class DerbyConfigError(ValueError):
+    """Raised for a Derby config with a malformed address or more entities/addresses than allowed"""
+
+
+def normalize_address(address: str) -> str:
+    """Lowercase, 0x-prefixed form, which is how HyperSync returns addresses"""
+    address = address.strip().lower()
+    return address if address.startswith("0x") else "0x" + address
+
+
+@dataclass(frozen=True)
+class DerbySnapshot:
+    """
+    Immutable, precompiled view of one Derby config version.
+    The hot loop only needs `address_index` (normalized address -> entity column)
+    and the prebuilt `selection`; nothing is rebuilt or lowercased per tick.
+    """
+    version: int
+    entity_names: Tuple[str, ...]
+    entities: Mapping[str, Tuple[str, ...]]
+    address_index: Mapping[str, int]
+    selection: TransactionSelection
+
+    @property
+    def addresses(self) -> Tuple[str, ...]:
+        return tuple(self.address_index.keys())
+
+    def to_config(self) -> Dict[str, List[str]]:
+        return {name: list(addresses) for name, addresses in self.entities.items()}
+
+
+def validate_derby_config(config: Dict[str, List[str]], max_entities: int, max_addresses: int) -> Dict[str, List[str]]:
+    """
+    Checked copy of an {entity: [addresses]} config, addresses lowercased. Every session's
+    addresses share one upstream query, so a single malformed address would fail the race
+    for all of them; nothing unchecked may reach a snapshot.
+    """
+    if not isinstance(config, dict):
+        raise DerbyConfigError("Config must map entity names to address lists")
+    if len(config) > max_entities:
+        raise DerbyConfigError(f"Too many entities ({len(config)}, at most {max_entities})")
+    checked = {}
+    for name, addresses in config.items():
+        if not isinstance(name, str) or not name or not isinstance(addresses, list):
+            raise DerbyConfigError("Config must map entity names to address lists")
+        if len(addresses) > max_addresses:
+            raise DerbyConfigError(f"Too many addresses for '{name}' ({len(addresses)}, at most {max_addresses})")
+        for address in addresses:
+            if not isinstance(address, str) or not ADDRESS_PATTERN.match(address.strip()):
+                raise DerbyConfigError(f"Invalid address for '{name}': {address!r} (expected 0x and 40 hex digits)")
+        checked[name] = [address.strip().lower() for address in addresses]
+    return checked
+
+
+def compile_derby_config(config: Dict[str, List[str]], version: int) -> DerbySnapshot:
+    """Compile an {entity: [addresses]} config into a snapshot. Later entities win duplicate addresses."""
+    entity_names = tuple(config.keys())
+    entities = {}
+    address_index = {}
+    for column, name in enumerate(entity_names):
+        normalized = tuple(dict.fromkeys(normalize_address(addr) for addr in config[name] if addr and addr.strip()))
+        entities[name] = normalized
+        for address in normalized:
+            address_index[address] = column
+    return DerbySnapshot(
+        version=version,
+        entity_names=entity_names,
+        entities=MappingProxyType(entities),
+        address_index=MappingProxyType(address_index),
+        selection=TransactionSelection(to=list(address_index.keys())),
+    )
+
+
+@dataclass(frozen=True)
+class DerbyUnion:
+    """
+    One deduplicated upstream selection covering every active session.
+    `targets` maps each address to the (session id, entity column) pairs that count it,
+    so per-address counts can be demultiplexed back into each session's payload.
+    """
+    version: int
+    targets: Mapping[str, Tuple[Tuple[str, int], ...]]
+    selection: TransactionSelection
+
+    @property
+    def addresses(self) -> Tuple[str, ...]:
+        return tuple(self.targets.keys())
+
+
+def compile_union(snapshots: Mapping[str, DerbySnapshot], version: int) -> DerbyUnion:
+    """Merge the address indexes of several session snapshots into one union"""
+    targets: Dict[str, List[Tuple[str, int]]] = {}
+    for session_id, snapshot in snapshots.items():
+        for address, column in snapshot.address_index.items():
+            targets.setdefault(address, []).append((session_id, column))
+    return DerbyUnion(
+        version=version,
+        targets=MappingProxyType({address: tuple(pairs) for address, pairs in targets.items()}),
+        selection=TransactionSelection(to=list(targets.keys())),
+    )
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from broadcaster import COALESCE_LATEST, Broadcaster, Subscription
+from derby_index import DerbySnapshot, DerbyUnion, compile_derby_config, compile_union, validate_derby_config
+from ws_protocol import FIREHOSE_CHANNEL
+
+DEFAULT_SESSION = "default"
+
+
+class SessionLimitError(Exception):
+    """Raised when a new Derby session would exceed the configured maximum"""
+
+
+class DerbySession:
+    """One viewer's Derby race: its compiled config, its subscribers and its rolling counts"""
+
+    def __init__(self, session_id: str, snapshot: DerbySnapshot, channel: int, max_stall_seconds: float = 30.0,
+                 on_evict: Optional[Callable[[Broadcaster], None]] = None):
+        self.session_id = session_id
+        self.snapshot = snapshot
+        # Numeric id that tags this session's binary WebSocket frames
+        self.channel = channel
+        # Each payload is a full snapshot of the race, so slow viewers only need the newest one
+        self.broadcaster = Broadcaster(
+            f"derby:{session_id}", policy=COALESCE_LATEST, max_stall_seconds=max_stall_seconds, on_evict=on_evict
+        )
+        # Owned by the Derby engine; reset whenever the session's config or activity changes
+        self.ring = None
+        # Last published (config version, tps matrix), the base for WebSocket delta frames
+        self.last_frame = None
+        # Wall-clock time the current config was posted; 0 for the defaults
+        self.config_updated_at = 0.0
+        self.last_active = time.monotonic()
+
+    @property
+    def active(self) -> bool:
+        return self.broadcaster.subscriber_count > 0
+
+
+class DerbySessionRegistry:
+    """
+    Per-session Derby configs served from a single upstream query.
+    Active sessions (those with at least one subscriber) are merged into one
+    deduplicated DerbyUnion; any change to a config or to the active set bumps
+    the registry version and wakes the engine immediately.
+    """
+
+    def __init__(self, default_config: Dict[str, List[str]], max_sessions: int = 1000, idle_seconds: float = 600.0,
+                 max_stall_seconds: float = 30.0, max_entities: int = 20, max_addresses_per_entity: int = 50):
+        self.default_config = default_config
+        self.max_sessions = max_sessions
+        # Per config, so no session can grow the shared union query without bound
+        self.max_entities = max_entities
+        self.max_addresses_per_entity = max_addresses_per_entity
+        self.idle_seconds = idle_seconds
+        self.max_stall_seconds = max_stall_seconds
+        self.next_channel = FIREHOSE_CHANNEL
+        # Broadcaster counters of pruned sessions, so totals across sessions never go backwards
+        self.retired = {"published": 0, "dropped": 0, "evicted": 0}
+        self.sessions: Dict[str, DerbySession] = {DEFAULT_SESSION: self._new_session(DEFAULT_SESSION)}
+        self.version = 0
+        self._union: Optional[DerbyUnion] = None
+        self._changed = asyncio.Event()
+
+    def _new_session(self, session_id: str) -> DerbySession:
+        self.next_channel += 1
+        return DerbySession(
+            session_id, compile_derby_config(self.default_config, version=1), self.next_channel,
+            max_stall_seconds=self.max_stall_seconds, on_evict=self._on_evict,
+        )
+
+    def _on_evict(self, broadcaster: Broadcaster):
+        # Evicting the last slow viewer deactivates the session without an unsubscribe call
+        if broadcaster.subscriber_count == 0:
+            self._notify()
+
+    def _notify(self):
+        self.version += 1
+        self._union = None
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: Optional[float] = None) -> bool:
+        """Sleep until the next change or the timeout; returns True if something changed"""
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def get_or_create(self, session_id: str) -> DerbySession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                self.prune_idle()
+                if len(self.sessions) >= self.max_sessions:
+                    raise SessionLimitError(f"Too many Derby sessions ({self.max_sessions})")
+            session = self.sessions[session_id] = self._new_session(session_id)
+        return session
+
+    def update_config(self, session_id: str, config: Dict[str, List[str]], version: Optional[int] = None,
+                      updated_at: Optional[float] = None) -> DerbySnapshot:
+        """
+        Compile a new config version for one session; an empty config resets it to the defaults.
+        `version` lets another process that already compiled the config keep its numbering.
+        `updated_at` is when the config was posted (now if not given): a config older than
+        the session's current one is ignored, since version numbers from different processes
+        say nothing about which is newer. Returns the session's snapshot either way.
+        Raises DerbyConfigError, before touching any session, for a config that fails validation.
+        """
+        if config:
+            config = self.validate_config(config)
+        session = self.get_or_create(session_id)
+        updated_at = time.time() if updated_at is None else updated_at
+        if updated_at < session.config_updated_at:
+            return session.snapshot
+        version = max(session.snapshot.version + 1, version or 0)
+        session.snapshot = compile_derby_config(config or self.default_config, version)
+        session.config_updated_at = updated_at
+        session.ring = None
+        session.last_active = time.monotonic()
+        if session.active:
+            self._notify()
+        return session.snapshot
+
+    def validate_config(self, config: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        return validate_derby_config(config, self.max_entities, self.max_addresses_per_entity)
+
+    def subscribe(self, session_id: str) -> Tuple[DerbySession, Subscription]:
+        session = self.get_or_create(session_id)
+        was_active = session.active
+        subscription = session.broadcaster.subscribe()
+        if not was_active:
+            self._notify()
+        return session, subscription
+
+    def unsubscribe(self, session: DerbySession, subscription: Subscription):
+        # An evicted subscription has already left the broadcaster (and notified)
+        was_subscribed = subscription in session.broadcaster.subscribers
+        session.broadcaster.unsubscribe(subscription)
+        session.last_active = time.monotonic()
+        if not session.active:
+            # Its addresses leave the union; the ring restarts if the session comes back
+            session.ring = None
+            if was_subscribed:
+                self._notify()
+
+    def active_sessions(self) -> List[DerbySession]:
+        return [session for session in self.sessions.values() if session.active]
+
+    @property
+    def union(self) -> DerbyUnion:
+        """Union of every active session's addresses, compiled once per registry version"""
+        if self._union is None or self._union.version != self.version:
+            self._union = compile_union(
+                {session.session_id: session.snapshot for session in self.active_sessions()}, self.version
+            )
+        return self._union
+
+    def prune_idle(self, now: Optional[float] = None) -> int:
+        """Forget sessions nobody has watched for `idle_seconds`; the default session is kept"""
+        now = time.monotonic() if now is None else now
+        stale = [
+            session_id for session_id, session in self.sessions.items()
+            if session_id != DEFAULT_SESSION and not session.active and now - session.last_active > self.idle_seconds
+        ]
+        for session_id in stale:
+            broadcaster = self.sessions.pop(session_id).broadcaster
+            self.retired["published"] += broadcaster.seq
+            self.retired["dropped"] += broadcaster.dropped_total
+            self.retired["evicted"] += broadcaster.evicted_total
+        return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        active = self.active_sessions()
+        return {
+            "sessions": len(self.sessions),
+            "active_sessions": len(active),
+            "subscribers": sum(session.broadcaster.subscriber_count for session in active),
+            "distinct_addresses": len(self.union.targets),
+            "registry_version": self.version,
+        }
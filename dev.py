@@ -5,10 +5,13 @@ from dotenv import load_dotenv
 import time
 import traceback
 from hypersync import TransactionField, BlockField
+from height_watcher import HeightWatcher
 
 
 MONAD_HYPERSYNC_URL = "https://monad-testnet.hypersync.xyz"
 POLL_INTERVAL_SECONDS = 0.04
+# The tip is fetched at most once per this many seconds (roughly one Monad block)
+HEIGHT_TTL_SECONDS = 0.4
 
 async def poll_live_monad_transactions():
     load_dotenv()
@@ -26,6 +29,8 @@ async def poll_live_monad_transactions():
             bearer_token=bearer_token
         )
         client = hypersync.HypersyncClient(client_config)
+        height_watcher = HeightWatcher(client, ttl=HEIGHT_TTL_SECONDS)
+        asyncio.create_task(height_watcher.run())
         print("HypersyncClient initialized.")
     except Exception as e:
         print(f"Fatal Error during HypersyncClient initialization: {type(e).__name__}: {e}")
@@ -37,10 +42,13 @@ async def poll_live_monad_transactions():
 
     while True:
         try:
-            latest_block_number = await client.get_height()
-            if last_block_number is not None and latest_block_number <= last_block_number:
-                await asyncio.sleep(POLL_INTERVAL_SECONDS)
-                continue
+            if last_block_number is None:
+                latest_block_number = await height_watcher.get_height()
+            else:
+                # Sleeps until the shared watcher sees the next block instead of polling get_height
+                latest_block_number = await height_watcher.wait_for_height(last_block_number + 1, timeout=5.0)
+                if latest_block_number is None or latest_block_number <= last_block_number:
+                    continue
             
             query = hypersync.Query(
                   from_block=latest_block_number,
@@ -0,0 +1,211 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import numpy as np
+import pyarrow as pa
+
+WEI_PER_MON = 1e18
+
+
+# 256 ** k for every byte position a quantity can have
+_POWERS_OF_256 = 256.0 ** np.arange(64)
+
+
+def _as_array(column) -> pa.Array:
+    if isinstance(column, pa.ChunkedArray):
+        return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    return column
+
+
+def _to_int64(column) -> np.ndarray:
+    return _as_array(column).fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+def _binary_layout(column: pa.Array):
+    """Offsets (rebased to 0), lengths and the raw byte buffer of a (large) binary array"""
+    if column.null_count:
+        column = column.fill_null(b"")
+    offset_type = np.int64 if pa.types.is_large_binary(column.type) else np.int32
+    _, offsets_buffer, data_buffer = column.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=offset_type)[column.offset:column.offset + len(column) + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]] if data_buffer is not None else np.zeros(0, np.uint8)
+    offsets = offsets - offsets[0]
+    return offsets, np.diff(offsets), data
+
+
+def quantity_to_float(column) -> np.ndarray:
+    """
+    Decode a HyperSync quantity column into float64 without a Python loop.
+    Quantities arrive as variable-length big-endian bytes: every byte is weighted by
+    256 ** (bytes left in its value) and the weights are summed per value with reduceat.
+    Nulls decode to 0.
+    """
+    column = _as_array(column)
+    n = len(column)
+    if n == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    kind = column.type
+    if pa.types.is_integer(kind) or pa.types.is_floating(kind):
+        return column.fill_null(0).to_numpy(zero_copy_only=False).astype(np.float64)
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        # Hex-encoded output: no columnar decoder, fall back to per-value parsing
+        return np.array([float(int(v, 16)) if v else 0.0 for v in column.to_pylist()], dtype=np.float64)
+
+    if pa.types.is_fixed_size_binary(kind):
+        width = kind.byte_width
+        column = column.fill_null(b"\x00" * width)
+        data = np.frombuffer(column.buffers()[1], dtype=np.uint8)
+        matrix = data[column.offset * width:(column.offset + n) * width].reshape(n, width)
+        return matrix @ _POWERS_OF_256[width - 1::-1]
+
+    offsets, lengths, data = _binary_layout(column)
+    result = np.zeros(n, dtype=np.float64)
+    if len(data) == 0:
+        return result
+    exponents = np.repeat(offsets[1:], lengths) - 1 - np.arange(len(data))
+    weighted = data * _POWERS_OF_256[exponents]
+    # reduceat can't express empty segments, so zero-length values are left at 0
+    non_empty = lengths > 0
+    result[non_empty] = np.add.reduceat(weighted, offsets[:-1][non_empty])
+    return result
+
+
+def binary_to_hex(column) -> List[str]:
+    """0x-prefixed hex strings for a binary column, hexing the whole buffer in one call"""
+    column = _as_array(column)
+    if not (pa.types.is_binary(column.type) or pa.types.is_large_binary(column.type)):
+        return [value.hex() if isinstance(value, bytes) else value for value in column.to_pylist()]
+    offsets, _, data = _binary_layout(column)
+    raw = data.tobytes().hex()
+    bounds = (offsets * 2).tolist()
+    return ["0x" + raw[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def binary_to_fixed(column, width: int) -> bytes:
+    """Concatenated raw values of a binary column, each left-padded or truncated to `width` bytes"""
+    column = _as_array(column)
+    if not (pa.types.is_binary(column.type) or pa.types.is_large_binary(column.type)):
+        values = [bytes.fromhex(v[2:] if v.startswith("0x") else v) if isinstance(v, str) else (v or b"") for v in column.to_pylist()]
+        return b"".join(v[-width:].rjust(width, b"\x00") for v in values)
+    offsets, lengths, data = _binary_layout(column)
+    if len(column) == 0 or (lengths == width).all():
+        return data.tobytes()
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    return b"".join(raw[start:end][-width:].rjust(width, b"\x00") for start, end in zip(bounds[:-1], bounds[1:]))
+
+
+@dataclass
+class FirehoseBatch:
+    """Columnar summary of one firehose query plus the transactions that will actually be sent"""
+    block_numbers: np.ndarray
+    block_timestamps: np.ndarray
+    block_tx_counts: np.ndarray
+    block_fees: np.ndarray
+    block_values: np.ndarray
+    total_transactions: int = 0
+    total_fees: float = 0.0
+    total_value: float = 0.0
+    transactions: List[Dict[str, Any]] = field(default_factory=list)
+    # The same transactions in columnar form for binary transports
+    transaction_values: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    transaction_hashes: bytes = b""
+
+    @property
+    def latest_block_number(self) -> int:
+        return int(self.block_numbers[-1])
+
+    @property
+    def latest_block_timestamp(self) -> int:
+        return int(self.block_timestamps[-1])
+
+    def __len__(self) -> int:
+        return len(self.block_numbers)
+
+
+def build_firehose_batch(blocks, transactions, max_transactions: int) -> FirehoseBatch:
+    """
+    Aggregate an Arrow response into per-block tx counts, fee sums and value sums.
+    Only the last `max_transactions` transactions are materialized as Python dicts.
+    """
+    empty = np.zeros(0)
+    if blocks is None or blocks.num_rows == 0:
+        return FirehoseBatch(empty.astype(np.int64), empty.astype(np.int64), empty, empty, empty)
+
+    block_numbers = _to_int64(blocks.column("number"))
+    block_timestamps = quantity_to_float(blocks.column("timestamp")).astype(np.int64)
+    order = np.argsort(block_numbers, kind="stable")
+    block_numbers, block_timestamps = block_numbers[order], block_timestamps[order]
+    # Blocks without a timestamp can't be placed in time
+    keep = block_timestamps > 0
+    block_numbers, block_timestamps = block_numbers[keep], block_timestamps[keep]
+
+    n_blocks = len(block_numbers)
+    if transactions is None or transactions.num_rows == 0 or n_blocks == 0:
+        zeros = np.zeros(n_blocks)
+        return FirehoseBatch(block_numbers, block_timestamps, zeros.copy(), zeros.copy(), zeros.copy())
+
+    values = quantity_to_float(transactions.column("value")) / WEI_PER_MON
+    fees = quantity_to_float(transactions.column("gas_used")) * quantity_to_float(transactions.column("gas_price")) / WEI_PER_MON
+
+    tx_block_numbers = _to_int64(transactions.column("block_number"))
+    block_index = np.clip(np.searchsorted(block_numbers, tx_block_numbers), 0, n_blocks - 1)
+    matched = block_numbers[block_index] == tx_block_numbers
+    block_index = block_index[matched]
+
+    batch = FirehoseBatch(
+        block_numbers=block_numbers,
+        block_timestamps=block_timestamps,
+        block_tx_counts=np.bincount(block_index, minlength=n_blocks).astype(np.float64),
+        block_fees=np.bincount(block_index, weights=fees[matched], minlength=n_blocks),
+        block_values=np.bincount(block_index, weights=values[matched], minlength=n_blocks),
+        total_transactions=transactions.num_rows,
+        total_fees=float(fees.sum()),
+        total_value=float(values.sum()),
+    )
+
+    # Materialize Python objects only for the transactions that go out to clients
+    start = max(0, transactions.num_rows - max_transactions)
+    hash_column = transactions.column("hash").slice(start)
+    hashes = binary_to_hex(hash_column)
+    batch.transaction_values = values[start:]
+    batch.transaction_hashes = binary_to_fixed(hash_column, 32)
+    batch.transactions = [
+        {"hash": tx_hash, "value": f"{value:.4f}"}
+        for tx_hash, value in zip(hashes, values[start:].tolist())
+    ]
+    return batch
+
+
+def iter_block_groups(blocks, transactions, max_span_seconds: float):
+    """
+    Split one Arrow response into consecutive groups of blocks covering at most
+    `max_span_seconds` of chain time, yielding (blocks, transactions) table slices.
+    Every group holds at least one block, so a long gap between blocks can't stall it.
+    """
+    if blocks is None or blocks.num_rows == 0:
+        return
+    block_numbers = _to_int64(blocks.column("number"))
+    if (np.diff(block_numbers) < 0).any():
+        order = np.argsort(block_numbers, kind="stable")
+        blocks, block_numbers = blocks.take(order), block_numbers[order]
+    # Missing timestamps inherit the previous block's so the search stays monotonic
+    timestamps = np.maximum.accumulate(quantity_to_float(blocks.column("timestamp")))
+
+    if transactions is not None and transactions.num_rows:
+        tx_block_numbers = _to_int64(transactions.column("block_number"))
+        if (np.diff(tx_block_numbers) < 0).any():
+            order = np.argsort(tx_block_numbers, kind="stable")
+            transactions, tx_block_numbers = transactions.take(order), tx_block_numbers[order]
+    else:
+        transactions, tx_block_numbers = None, np.zeros(0, dtype=np.int64)
+
+    ends = np.maximum(np.searchsorted(timestamps, timestamps + max_span_seconds, side="right"), np.arange(1, len(timestamps) + 1))
+    start = 0
+    while start < len(block_numbers):
+        end = int(ends[start])
+        tx_start = int(np.searchsorted(tx_block_numbers, block_numbers[start], side="left"))
+        tx_end = int(np.searchsorted(tx_block_numbers, block_numbers[end - 1], side="right"))
+        yield blocks.slice(start, end - start), transactions.slice(tx_start, tx_end - tx_start) if transactions is not None else None
+        start = end
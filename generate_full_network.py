@@ -4,7 +4,7 @@ import asyncio
 import json
 import time
 from datetime import datetime
-from nft_service import get_network_graph_data
+from nft_service import get_network_graph_data, nft_network_service
 
 async def generate_full_network():
     """
@@ -26,7 +26,8 @@ async def generate_full_network():
     print(f"📋 Configuration:")
     print(f"   • Collections to analyze: {limit}")
     print(f"   • Minimum shared holders for connection: {min_shared_holders}")
-    print(f"   • Rate limiting: 1.5 seconds between requests for both APIs")
+    print(f"   • Rate limits: {nft_network_service.rate_limits['magic_eden'].rate:g} req/s Magic Eden, "
+          f"{nft_network_service.rate_limits['alchemy'].rate:g} req/s Alchemy")
     print()
     
     try:
@@ -53,7 +54,10 @@ async def generate_full_network():
         edges = graph["edges"]
         stats = graph["stats"]
         
-        print(f"\n✅ Network Generation Complete!")
+        if graph["partial"]:
+            print(f"\n⚠️  Network Generation PARTIAL: holders of {len(graph['failed_collections'])} collections could not be fetched")
+        else:
+            print(f"\n✅ Network Generation Complete!")
         print(f"⏱️  Total time: {elapsed/60:.1f} minutes")
         print()
         
@@ -120,7 +124,9 @@ async def generate_full_network():
                 "timestamp": datetime.now().isoformat(),
                 "generation_time_minutes": elapsed / 60,
                 "collections_requested": limit,
-                "min_shared_holders_threshold": min_shared_holders
+                "min_shared_holders_threshold": min_shared_holders,
+                "partial": graph["partial"],
+                "failed_collections": graph["failed_collections"]
             },
             "network_stats": {
                 "total_nodes": len(nodes),
@@ -150,14 +156,18 @@ async def generate_full_network():
         with open(summary_filename, 'w') as f:
             json.dump(summary, f, indent=2)
         
-        # Also save as latest files for the web interface
-        with open('monad_nft_network_latest.json', 'w') as f:
-            json.dump(result, f, indent=2, default=str)
+        # Also save as latest files for the web interface, unless this run is missing collections
+        if not graph["partial"]:
+            with open('monad_nft_network_latest.json', 'w') as f:
+                json.dump(result, f, indent=2, default=str)
         
         print(f"💾 Files Created:")
         print(f"   • {full_filename} - Complete network data")
         print(f"   • {summary_filename} - Summary report")
-        print(f"   • monad_nft_network_latest.json - Latest data for web interface")
+        if graph["partial"]:
+            print(f"   • monad_nft_network_latest.json left as is (partial run); rerun to fetch the missing collections")
+        else:
+            print(f"   • monad_nft_network_latest.json - Latest data for web interface")
         print()
         
         print(f"🎯 Network generation complete! Ready for visualization.")
@@ -167,6 +177,8 @@ async def generate_full_network():
         print(f"❌ Error during network generation: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        await nft_network_service.close()
 
 if __name__ == "__main__":
     asyncio.run(generate_full_network()) 
\ No newline at end of file
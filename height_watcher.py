@@ -0,0 +1,95 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+
+class HeightWatcher:
+    """
+    One shared view of the chain tip.
+    `get_height` answers from a cache younger than `ttl` seconds; on a miss, concurrent
+    callers share a single in-flight upstream request (singleflight). Tasks that need a
+    specific block use `wait_for_height`, which is woken through a condition when the tip
+    advances; `run` polls once per `ttl` only while somebody is waiting.
+    """
+
+    def __init__(self, client, ttl: float = 0.5):
+        self.client = client
+        self.ttl = ttl
+        self.height: Optional[int] = None
+        self.updated_at = 0.0
+        self.upstream_calls = 0
+        self.last_error: Optional[str] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._condition = asyncio.Condition()
+        self._waiters = 0
+        self._demand = asyncio.Event()
+
+    async def _fetch(self) -> int:
+        try:
+            self.upstream_calls += 1
+            try:
+                height = await self.client.get_height()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            self.updated_at = time.monotonic()
+            if self.height is None or height > self.height:
+                self.height = height
+                async with self._condition:
+                    self._condition.notify_all()
+            return self.height
+        finally:
+            self._inflight = None
+
+    async def refresh(self) -> int:
+        """Fetch the tip now, joining a request that is already in flight"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+        # Shielded so one cancelled caller doesn't cancel the request for everybody else
+        return await asyncio.shield(self._inflight)
+
+    async def get_height(self) -> int:
+        if self.height is not None and time.monotonic() - self.updated_at < self.ttl:
+            return self.height
+        return await self.refresh()
+
+    async def wait_for_height(self, min_height: int, timeout: Optional[float] = None) -> Optional[int]:
+        """Wait until the tip reaches `min_height` or the timeout passes; returns the latest known tip"""
+        if self.height is not None and self.height >= min_height:
+            return self.height
+        self._waiters += 1
+        self._demand.set()
+        try:
+            async with self._condition:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.height is not None and self.height >= min_height), timeout
+                )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters -= 1
+        return self.height
+
+    async def run(self, error_delay: float = 5.0):
+        """Background poller for `wait_for_height`; idle while nobody is waiting"""
+        while True:
+            if self._waiters == 0:
+                self._demand.clear()
+                await self._demand.wait()
+            try:
+                await self.get_height()
+            except Exception:
+                # Recorded in last_error; waiters time out on their own
+                await asyncio.sleep(error_delay)
+                continue
+            await asyncio.sleep(max(0.0, self.updated_at + self.ttl - time.monotonic()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "height": self.height,
+            "age_seconds": round(time.monotonic() - self.updated_at, 3) if self.height is not None else None,
+            "ttl_seconds": self.ttl,
+            "upstream_calls": self.upstream_calls,
+            "waiters": self._waiters,
+            "last_error": self.last_error,
+        }
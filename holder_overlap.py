@@ -0,0 +1,50 @@
+from typing import Callable, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def incidence_matrix(holder_ids: Sequence[np.ndarray]) -> sp.csr_matrix:
+    """Collection x address 0/1 matrix; row i has a 1 at every id in holder_ids[i] (sorted, unique)"""
+    lengths = np.fromiter((len(ids) for ids in holder_ids), dtype=np.int64, count=len(holder_ids))
+    indptr = np.zeros(len(holder_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    indices = np.concatenate(holder_ids) if indptr[-1] else np.zeros(0, dtype=np.uint32)
+    columns = int(indices.max()) + 1 if len(indices) else 0
+    indices = indices.astype(np.int32 if columns < 2**31 else np.int64)
+    return sp.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(holder_ids), columns))
+
+
+def overlap_edges(holder_ids: Sequence[np.ndarray], min_shared: int = 1, block_rows: int = 256,
+                  on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every pair i < j of collections sharing at least `min_shared` holders, as
+    (i, j, shared) arrays in row-major order.
+
+    Shared counts are the entries of C·Cᵀ for the incidence matrix C, computed for
+    `block_rows` rows of C at a time so only one block of the product is in memory;
+    each block is thresholded and cut to its upper triangle before the next.
+    Pairs with no holder in common never appear, whatever `min_shared` is.
+    """
+    incidence = incidence_matrix(holder_ids)
+    transposed = incidence.T.tocsr()
+    n = incidence.shape[0]
+    min_shared = max(1, min_shared)
+    sources, targets, weights = [], [], []
+    for start in range(0, n, block_rows):
+        block = (incidence[start:start + block_rows] @ transposed).tocoo()
+        rows = block.row.astype(np.int64) + start
+        keep = (block.col > rows) & (block.data >= min_shared)
+        rows, cols, shared = rows[keep], block.col[keep].astype(np.int64), block.data[keep]
+        order = np.lexsort((cols, rows))
+        sources.append(rows[order])
+        targets.append(cols[order])
+        weights.append(shared[order])
+        if on_progress is not None:
+            stop = min(n, start + block_rows)
+            # Pairs (i, j > i) covered by the rows done so far
+            on_progress(stop * n - stop * (stop + 1) // 2, n * (n - 1) // 2)
+    if not sources:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(weights).astype(np.int64)
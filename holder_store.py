@@ -0,0 +1,245 @@
+import fcntl
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+ADDRESS_BYTES = 20
+# Per holder set: key length, fetched_at (unix seconds), ttl seconds, holder count, payload length
+RECORD_HEADER = struct.Struct("<HdfII")
+LOCK_FILE = "lock"
+
+
+def encode_ids(ids: np.ndarray) -> bytes:
+    """Sorted uint32 address ids -> zlib-compressed gaps between consecutive ids"""
+    return zlib.compress(np.diff(ids, prepend=np.uint32(0)).astype("<u4").tobytes())
+
+
+def decode_ids(payload: bytes) -> np.ndarray:
+    return np.cumsum(np.frombuffer(zlib.decompress(payload), dtype="<u4"), dtype=np.uint32)
+
+
+class AddressBook:
+    """
+    Every holder address seen, each interned once as a uint32 id (its position), so holder
+    sets are id arrays instead of sets of 42-character strings. With a `path`, addresses are
+    appended to that file as 20 raw bytes each and ids survive restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._raw = bytearray()
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "ab") as f:
+                size = f.tell()
+                if size % ADDRESS_BYTES:
+                    f.truncate(size - size % ADDRESS_BYTES)
+            with open(path, "rb") as f:
+                self._raw = bytearray(f.read())
+            self._file = open(path, "ab")
+        self._ids: Dict[bytes, int] = {
+            bytes(self._raw[i:i + ADDRESS_BYTES]): i // ADDRESS_BYTES for i in range(0, len(self._raw), ADDRESS_BYTES)
+        }
+
+    def __len__(self) -> int:
+        return len(self._raw) // ADDRESS_BYTES
+
+    def intern(self, addresses: Iterable[str]) -> np.ndarray:
+        """Sorted, unique uint32 ids of hex addresses, assigning ids to new ones; malformed addresses are skipped"""
+        ids = set()
+        new = bytearray()
+        for address in addresses:
+            try:
+                raw = bytes.fromhex(address[2:] if address.startswith("0x") else address)
+            except ValueError:
+                continue
+            if len(raw) != ADDRESS_BYTES:
+                continue
+            address_id = self._ids.get(raw)
+            if address_id is None:
+                address_id = self._ids[raw] = len(self) + len(new) // ADDRESS_BYTES
+                new += raw
+            ids.add(address_id)
+        if new:
+            self._raw += new
+            if self._file is not None:
+                self._file.write(new)
+                self._file.flush()
+        return np.array(sorted(ids), dtype=np.uint32)
+
+    def addresses(self, ids: np.ndarray) -> List[str]:
+        raw = self._raw
+        return ["0x" + raw[i * ADDRESS_BYTES:(i + 1) * ADDRESS_BYTES].hex() for i in ids.tolist()]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StoreLockedError(RuntimeError):
+    """Raised when another process (or another HolderStore in this one) has the store open"""
+
+
+class HolderStore:
+    """
+    Durable holder sets per collection, so graph builds only refetch what went stale.
+
+    Two append-only files in `directory`:
+      addresses.bin  the AddressBook: every holder address ever seen, 20 raw bytes each;
+                     an address's id is its position, so ids are stable and never reused
+      holders.log    one record per fetched collection: RECORD_HEADER, the collection key
+                     (utf-8), then its sorted address ids, delta-encoded and zlib-compressed
+
+    The newest record for a key wins. Only headers are read on open; holder sets are
+    decoded when asked for. Torn tails from a crash are truncated, and the log is
+    rewritten when superseded records outweigh live ones.
+
+    Ids are handed out from this process's view of addresses.bin, so two writers would
+    give different addresses the same id; an exclusive lock on `lock` in the directory
+    keeps it to one open store, and a second one raises StoreLockedError.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float = 86400.0):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = open(os.path.join(directory, LOCK_FILE), "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            raise StoreLockedError(f"Holder store {directory} is already open in another process") from None
+        self.address_book = AddressBook(os.path.join(directory, "addresses.bin"))
+        self.log_path = os.path.join(directory, "holders.log")
+
+        # key -> (payload offset, payload length, fetched_at, ttl, count)
+        self.index: Dict[str, Tuple[int, int, float, float, int]] = {}
+        self.dead_bytes = self._scan()
+        self._log = open(self.log_path, "ab")
+        self._reader = open(self.log_path, "rb")
+        if self.dead_bytes > max(1 << 20, self.live_bytes):
+            self.compact()
+
+    def _scan(self) -> int:
+        """Index the log's records; returns the bytes taken by superseded ones"""
+        dead = 0
+        offset = 0
+        with open(self.log_path, "ab+") as f:
+            f.seek(0)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                key_length, fetched_at, ttl, count, length = RECORD_HEADER.unpack(header)
+                key = f.read(key_length)
+                start = offset + RECORD_HEADER.size + key_length
+                f.seek(length, os.SEEK_CUR)
+                if len(key) < key_length or f.tell() > os.fstat(f.fileno()).st_size:
+                    break
+                previous = self.index.get(key.decode())
+                if previous is not None:
+                    dead += RECORD_HEADER.size + key_length + previous[1]
+                self.index[key.decode()] = (start, length, fetched_at, ttl, count)
+                offset = start + length
+            if offset < os.fstat(f.fileno()).st_size:
+                f.truncate(offset)
+        return dead
+
+    @property
+    def live_bytes(self) -> int:
+        return sum(RECORD_HEADER.size + len(key.encode()) + entry[1] for key, entry in self.index.items())
+
+    def put(self, key: str, holders: Iterable[str], fetched_at: Optional[float] = None, ttl: Optional[float] = None) -> np.ndarray:
+        """Store a collection's holders; returns their ids"""
+        ids = self.address_book.intern(holders)
+        self.put_ids(key, ids, fetched_at, ttl)
+        return ids
+
+    def put_ids(self, key: str, ids: np.ndarray, fetched_at: Optional[float] = None, ttl: Optional[float] = None):
+        raw_key = key.encode()
+        payload = encode_ids(ids)
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        ttl = self.ttl_seconds if ttl is None else ttl
+        start = self._log.tell() + RECORD_HEADER.size + len(raw_key)
+        self._log.write(RECORD_HEADER.pack(len(raw_key), fetched_at, ttl, len(ids), len(payload)) + raw_key + payload)
+        self._log.flush()
+        previous = self.index.get(key)
+        if previous is not None:
+            self.dead_bytes += RECORD_HEADER.size + len(raw_key) + previous[1]
+        self.index[key] = (start, len(payload), fetched_at, ttl, len(ids))
+
+    def is_fresh(self, key: str, now: Optional[float] = None) -> bool:
+        entry = self.index.get(key)
+        if entry is None:
+            return False
+        now = time.time() if now is None else now
+        return now - entry[2] < entry[3]
+
+    def stale(self, keys: Iterable[str], now: Optional[float] = None) -> List[str]:
+        """Keys with no record, or whose record is older than its TTL"""
+        now = time.time() if now is None else now
+        return [key for key in keys if not self.is_fresh(key, now)]
+
+    def get_ids(self, key: str, fresh_only: bool = True) -> Optional[np.ndarray]:
+        """Sorted uint32 ids of a collection's holders; None when missing (or stale, unless fresh_only=False)"""
+        entry = self.index.get(key)
+        if entry is None or (fresh_only and not self.is_fresh(key)):
+            return None
+        start, length = entry[0], entry[1]
+        self._reader.seek(start)
+        ids = decode_ids(self._reader.read(length))
+        if len(ids) and ids[-1] >= len(self.address_book):
+            # The address file lost its tail in a crash after this record was written
+            return None
+        return ids
+
+    def get(self, key: str, fresh_only: bool = True) -> Optional[Set[str]]:
+        ids = self.get_ids(key, fresh_only)
+        return None if ids is None else set(self.address_book.addresses(ids))
+
+    def compact(self):
+        """Rewrite the log with only the newest record per key"""
+        records = []
+        for key, (start, length, fetched_at, ttl, count) in self.index.items():
+            self._reader.seek(start)
+            records.append((key.encode(), fetched_at, ttl, count, self._reader.read(length)))
+        temporary = self.log_path + ".tmp"
+        index = {}
+        with open(temporary, "wb") as f:
+            for raw_key, fetched_at, ttl, count, payload in records:
+                f.write(RECORD_HEADER.pack(len(raw_key), fetched_at, ttl, count, len(payload)) + raw_key)
+                index[raw_key.decode()] = (f.tell(), len(payload), fetched_at, ttl, count)
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log.close()
+        self._reader.close()
+        os.replace(temporary, self.log_path)
+        self.index = index
+        self.dead_bytes = 0
+        self._log = open(self.log_path, "ab")
+        self._reader = open(self.log_path, "rb")
+
+    def close(self):
+        self.address_book.close()
+        self._log.close()
+        self._reader.close()
+        # Closing the file releases the lock
+        self._lock.close()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "directory": self.directory,
+            "collections": len(self.index),
+            "fresh_collections": len(self.index) - len(self.stale(self.index, now)),
+            "addresses": len(self.address_book),
+            "log_bytes": self.live_bytes + self.dead_bytes,
+            "dead_bytes": self.dead_bytes,
+        }
@@ -0,0 +1,334 @@
+"""
+Local pub/sub between one ingester process and the web workers, over a Unix domain socket.
+
+The ingester is the only process that polls HyperSync; it builds every StreamEvent once
+and writes it to each connected worker. Workers republish the events into their own
+broadcasters, so the SSE and WebSocket code paths are the same in every process.
+
+Every message, in both directions, is:
+    u8  kind            (1 = control, 2 = event)
+    u16 topic length
+    u32 body length
+    topic (utf-8): "firehose" or "derby:<session id>"; empty for control messages
+    body: JSON for control messages; for events, u32 sse / frame / delta lengths
+          (delta length 0xFFFFFFFF = no delta) followed by the three byte strings
+
+Worker -> ingester (control):
+    {"op": "subscribe" | "unsubscribe", "topic": "firehose" | "derby:<id>"}
+    {"op": "config", "session": "<id>", "config": {...}, "version": <int>, "updated_at": <unix seconds>}
+
+Ingester -> worker (control):
+    {"type": "evicted", "topic": ...}   the worker fell behind; it resubscribes
+    {"type": "error", "error": ...}
+
+Each worker connection is one subscriber per topic on the ingester's broadcasters, so a
+slow worker gets the same drop/coalesce/evict treatment as a slow browser.
+
+Workers number config versions independently, so the ingester decides between configs
+for the same session by `updated_at`, the wall-clock time the config was posted (all
+processes share the host's clock); `version` only seeds the numbering.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import struct
+from typing import Any, Dict, Optional, Set, Tuple
+
+from broadcaster import Broadcaster, Subscription
+from derby_sessions import DerbySessionRegistry, SessionLimitError
+from ws_protocol import StreamEvent, frame_seq, retag_derby_channel
+
+KIND_CONTROL = 1
+KIND_EVENT = 2
+
+FIREHOSE_TOPIC = "firehose"
+DERBY_TOPIC_PREFIX = "derby:"
+
+MESSAGE_HEADER = struct.Struct("<BHI")
+EVENT_LENGTHS = struct.Struct("<III")
+NO_DELTA = 0xFFFFFFFF
+
+
+def derby_topic(session_id: str) -> str:
+    return DERBY_TOPIC_PREFIX + session_id
+
+
+def pack_message(kind: int, topic: str, body: bytes) -> bytes:
+    raw_topic = topic.encode()
+    return MESSAGE_HEADER.pack(kind, len(raw_topic), len(body)) + raw_topic + body
+
+
+def pack_control(message: Dict[str, Any]) -> bytes:
+    return pack_message(KIND_CONTROL, "", json.dumps(message).encode())
+
+
+def encode_event(event: StreamEvent) -> bytes:
+    delta = event.delta if event.delta is not None else b""
+    return b"".join((
+        EVENT_LENGTHS.pack(len(event.sse), len(event.frame), len(delta) if event.delta is not None else NO_DELTA),
+        event.sse, event.frame, delta,
+    ))
+
+
+def decode_event(body: bytes) -> StreamEvent:
+    sse_length, frame_length, delta_length = EVENT_LENGTHS.unpack_from(body, 0)
+    offset = EVENT_LENGTHS.size
+    sse = body[offset:offset + sse_length]; offset += sse_length
+    frame = body[offset:offset + frame_length]; offset += frame_length
+    delta = body[offset:offset + delta_length] if delta_length != NO_DELTA else None
+    return StreamEvent(sse=sse, frame=frame, delta=delta)
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, str, bytes]:
+    kind, topic_length, body_length = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    payload = await reader.readexactly(topic_length + body_length)
+    return kind, payload[:topic_length].decode(), payload[topic_length:]
+
+
+class BusServer:
+    """Ingester side: serves the firehose broadcaster and the derby sessions to worker processes"""
+
+    def __init__(self, path: str, firehose: Broadcaster, sessions: DerbySessionRegistry):
+        self.path = path
+        self.firehose = firehose
+        self.sessions = sessions
+        self.workers = 0
+        self.connections_total = 0
+        self.last_error: Optional[str] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # A socket file nobody answers on is left over from a crash; a live one means a second ingester
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise RuntimeError(f"Another ingester is already listening on {self.path}")
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Closing the server only stops accepting; drop the workers too so they reconnect
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _pump(self, writer: asyncio.StreamWriter, write_lock: asyncio.Lock, subscription: Subscription, topic: str):
+        while True:
+            event = await subscription.get()
+            try:
+                async with write_lock:
+                    if event is None:
+                        writer.write(pack_control({"type": "evicted", "topic": topic}))
+                    else:
+                        writer.write(pack_message(KIND_EVENT, topic, encode_event(event)))
+                    await writer.drain()
+            except ConnectionError:
+                # The worker went away; its reader loop cleans up the subscriptions
+                return
+            if event is None:
+                return
+
+    def _subscribe(self, topic: str):
+        """(subscription, cleanup) for one topic"""
+        if topic == FIREHOSE_TOPIC:
+            subscription = self.firehose.subscribe()
+            return subscription, lambda: self.firehose.unsubscribe(subscription)
+        if topic.startswith(DERBY_TOPIC_PREFIX):
+            session, subscription = self.sessions.subscribe(topic[len(DERBY_TOPIC_PREFIX):])
+            return subscription, lambda: self.sessions.unsubscribe(session, subscription)
+        raise ValueError(f"Unknown topic: {topic}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.workers += 1
+        self.connections_total += 1
+        self._writers.add(writer)
+        write_lock = asyncio.Lock()
+        subscriptions: Dict[str, Tuple[asyncio.Task, Any]] = {}
+
+        def stop(topic: str):
+            task, cleanup = subscriptions.pop(topic)
+            task.cancel()
+            cleanup()
+
+        async def reply(message: Dict[str, Any]):
+            async with write_lock:
+                writer.write(pack_control(message))
+                await writer.drain()
+
+        try:
+            while True:
+                kind, _, body = await read_message(reader)
+                if kind != KIND_CONTROL:
+                    continue
+                try:
+                    # A malformed message is answered with an error; it must not cost the
+                    # worker its connection and every subscription on it
+                    message = json.loads(body)
+                    if not isinstance(message, dict):
+                        raise ValueError("Control message must be a JSON object")
+                    op = message.get("op")
+                    topic = message.get("topic", "")
+                    if op == "subscribe":
+                        if topic in subscriptions:
+                            stop(topic)
+                        subscription, cleanup = self._subscribe(topic)
+                        subscriptions[topic] = (asyncio.create_task(self._pump(writer, write_lock, subscription, topic)), cleanup)
+                    elif op == "unsubscribe":
+                        if topic in subscriptions:
+                            stop(topic)
+                    elif op == "config":
+                        if not isinstance(message.get("updated_at", 0), (int, float)):
+                            raise ValueError("updated_at must be a number")
+                        self.sessions.update_config(
+                            message["session"], message["config"], message.get("version"), message.get("updated_at")
+                        )
+                    else:
+                        await reply({"type": "error", "error": f"Unknown op: {op}"})
+                except (KeyError, ValueError, SessionLimitError) as e:
+                    await reply({"type": "error", "error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            for topic in list(subscriptions):
+                stop(topic)
+            self.workers -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "workers": self.workers, "connections_total": self.connections_total, "last_error": self.last_error}
+
+
+class BusClient:
+    """
+    Worker side: mirrors the ingester's events into local broadcasters.
+    The firehose is always subscribed; a derby session is subscribed upstream while it
+    has local viewers, which keeps the ingester's union limited to watched sessions.
+    """
+
+    def __init__(self, path: str, firehose: Broadcaster, sessions: DerbySessionRegistry, prune_interval: float = 30.0):
+        self.path = path
+        self.firehose = firehose
+        self.sessions = sessions
+        self.prune_interval = prune_interval
+        self.connected = False
+        self.events = 0
+        self.gaps = 0
+        self.last_error: Optional[str] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._upstream: Set[str] = set()
+        # Upstream sequence of the last event per topic; a jump means the delta has no base here
+        self._last_seq: Dict[str, int] = {}
+
+    def send(self, message: Dict[str, Any]):
+        """Queue a control message; dropped while disconnected (state is replayed on reconnect)"""
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(pack_control(message))
+
+    def send_config(self, session_id: str, config: Dict[str, Any], version: int, updated_at: float):
+        self.send({"op": "config", "session": session_id, "config": config, "version": version, "updated_at": updated_at})
+
+    def _sync_sessions(self):
+        active = {derby_topic(session.session_id) for session in self.sessions.active_sessions()}
+        for topic in active - self._upstream:
+            self.send({"op": "subscribe", "topic": topic})
+        for topic in self._upstream - active:
+            self.send({"op": "unsubscribe", "topic": topic})
+            self._last_seq.pop(topic, None)
+        self._upstream = active
+
+    async def _follow_sessions(self):
+        while True:
+            self._sync_sessions()
+            if not await self.sessions.wait_for_change(self.prune_interval):
+                self.sessions.prune_idle()
+
+    def _publish(self, topic: str, event: StreamEvent):
+        self.events += 1
+        seq = frame_seq(event.frame)
+        previous = self._last_seq.get(topic)
+        self._last_seq[topic] = seq
+        if event.delta is not None and previous != (seq - 1) & 0xFFFFFFFF:
+            # Events were dropped between the processes; local viewers must get a keyframe
+            self.gaps += 1
+            event = StreamEvent(sse=event.sse, frame=event.frame)
+        if topic == FIREHOSE_TOPIC:
+            self.firehose.publish(event)
+            return
+        session = self.sessions.sessions.get(topic[len(DERBY_TOPIC_PREFIX):])
+        if session is None:
+            return
+        delta = retag_derby_channel(event.delta, session.channel) if event.delta is not None else None
+        session.broadcaster.publish(StreamEvent(sse=event.sse, frame=retag_derby_channel(event.frame, session.channel), delta=delta))
+
+    async def serve(self):
+        """Connect and relay until the connection drops; the caller decides how to retry"""
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self._writer = writer
+        self.connected = True
+        self._upstream = set()
+        self._last_seq = {}
+        follower = None
+        try:
+            self.send({"op": "subscribe", "topic": FIREHOSE_TOPIC})
+            # Sessions configured here while the ingester was away (or restarted); when workers
+            # hold different configs for a session, the ingester keeps the most recently posted
+            for session in self.sessions.sessions.values():
+                if session.config_updated_at:
+                    self.send_config(
+                        session.session_id, session.snapshot.to_config(), session.snapshot.version, session.config_updated_at
+                    )
+            follower = asyncio.create_task(self._follow_sessions())
+            while True:
+                try:
+                    kind, topic, body = await read_message(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                if kind == KIND_EVENT:
+                    self._publish(topic, decode_event(body))
+                    continue
+                try:
+                    message = json.loads(body)
+                    if not isinstance(message, dict):
+                        raise ValueError("Control message must be a JSON object")
+                    if message.get("type") == "evicted":
+                        self._last_seq.pop(message["topic"], None)
+                        if message["topic"] == FIREHOSE_TOPIC or message["topic"] in self._upstream:
+                            self.send({"op": "subscribe", "topic": message["topic"]})
+                    elif message.get("type") == "error":
+                        self.last_error = message.get("error")
+                except (KeyError, ValueError) as e:
+                    # Skip it rather than drop the connection and every mirrored stream with it
+                    self.last_error = f"Malformed control message: {e}"
+        finally:
+            self.connected = False
+            self._writer = None
+            if follower is not None:
+                follower.cancel()
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "connected": self.connected,
+            "events": self.events,
+            "delta_gaps": self.gaps,
+            "upstream_sessions": len(self._upstream),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,180 @@
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TextIO, Tuple
+
+
+class CategoryLimit:
+    """Token bucket plus 1-in-`sample` sampling for one log category"""
+    __slots__ = ("rate", "burst", "sample", "tokens", "updated_at", "suppressed", "suppressed_total")
+
+    def __init__(self, rate: Optional[float] = None, burst: float = 1.0, sample: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.sample = max(1, sample)
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.suppressed = 0
+        self.suppressed_total = 0
+
+    def admit(self) -> bool:
+        if self.sample > 1 and random.randrange(self.sample):
+            self.suppressed += 1
+            self.suppressed_total += 1
+            return False
+        if self.rate is not None:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                self.suppressed_total += 1
+                return False
+            self.tokens -= 1
+        return True
+
+
+class LiveView:
+    """Latest state of a terminal view; rendered on the writer thread at most once per `interval`"""
+    __slots__ = ("render", "interval", "stream", "state", "version", "rendered_version", "due_at")
+
+    def __init__(self, render: Callable[[Any], str], interval: float, stream: TextIO):
+        self.render = render
+        self.interval = interval
+        self.stream = stream
+        self.state = None
+        self.version = 0
+        self.rendered_version = 0
+        self.due_at = 0.0
+
+
+class LogPipeline:
+    """
+    Non-blocking log output.
+    Callers on the event loop only format the message and put it on a bounded queue; a
+    daemon thread drains the queue in batches and does the actual writes and flushes.
+    Per-category limits (rate and sampling) are applied before enqueueing, and the number
+    of suppressed messages is appended to the next one that gets through. When the queue
+    is full, messages are dropped and counted rather than blocking the caller.
+    """
+
+    def __init__(self, max_queue: int = 10_000, batch_size: int = 256):
+        self.queue: "queue.Queue[Optional[Tuple[TextIO, str]]]" = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.limits: Dict[str, CategoryLimit] = {}
+        self.views: Dict[str, LiveView] = {}
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, category: str, rate: Optional[float] = None, burst: float = 1.0, sample: int = 1):
+        """Allow `category` at most `rate` messages/s (bursts of `burst`), keeping 1 in `sample`"""
+        self.limits[category.upper()] = CategoryLimit(rate, burst, sample)
+
+    def add_view(self, name: str, render: Callable[[Any], str], interval: float, stream: TextIO = sys.stdout):
+        self.views[name] = LiveView(render, interval, stream)
+
+    def update_view(self, name: str, state: Any):
+        """Replace a view's state; the writer renders the newest state when the view is next due"""
+        view = self.views.get(name)
+        if view is None or view.interval <= 0:
+            return
+        view.state = state
+        view.version += 1
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+
+    def write(self, text: str, stream: TextIO = sys.stderr, category: Optional[str] = None):
+        if category is not None:
+            limit = self.limits.get(category.upper())
+            if limit is not None:
+                if not limit.admit():
+                    return
+                if limit.suppressed:
+                    text = f"{text} (+{limit.suppressed} suppressed)"
+                    limit.suppressed = 0
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((stream, text))
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _render_due_views(self, now: float) -> float:
+        """Write the views that are due; returns seconds until the next one is"""
+        wait = 1.0
+        for view in self.views.values():
+            if view.interval <= 0:
+                continue
+            if view.version != view.rendered_version and now >= view.due_at:
+                version, state = view.version, view.state
+                try:
+                    self._emit(view.stream, [view.render(state)])
+                except Exception as e:
+                    self._emit(sys.stderr, [f"LOG ERROR: live view failed to render: {e}"])
+                view.rendered_version = version
+                view.due_at = now + view.interval
+            wait = min(wait, max(0.0, view.due_at - now) if view.version != view.rendered_version else view.interval)
+        return max(wait, 0.05)
+
+    def _emit(self, stream: TextIO, lines):
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except (OSError, ValueError):
+            # Closed or broken stream (e.g. the supervisor went away); nothing useful to do
+            pass
+        self.written += len(lines)
+
+    def _run(self):
+        timeout = 0.05
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self.queue.get(timeout=timeout)
+                while True:
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            # One write and one flush per stream per batch
+            by_stream: Dict[int, Tuple[TextIO, list]] = {}
+            for stream, text in batch:
+                by_stream.setdefault(id(stream), (stream, []))[1].append(text)
+            for stream, lines in by_stream.values():
+                self._emit(stream, lines)
+            timeout = self._render_due_views(time.monotonic())
+
+    def close(self, timeout: float = 2.0):
+        """Flush queued messages and stop the writer thread"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "suppressed": {category: limit.suppressed_total for category, limit in self.limits.items()},
+        }
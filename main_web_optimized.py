@@ -1,31 +1,118 @@
 import asyncio
 import json
 import os
+import re
 import sys
 import time
 import traceback
 from contextlib import asynccontextmanager
 from collections import defaultdict, deque
-from typing import List, Dict, Any, AsyncGenerator, Tuple
+from typing import List, Dict, Any, AsyncGenerator, Callable, Optional, Tuple
 
-import hypersync
+import numpy as np
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi import Query as QueryParam
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from hypersync import BlockField, TransactionField, TransactionSelection, ClientConfig, Query, FieldSelection
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from hypersync import BlockField, TransactionField, TransactionSelection, Query, FieldSelection, StreamConfig
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
+from block_history import BlockHistoryStore
+from broadcaster import DROP_OLDEST, Broadcaster, Subscription
+from data_sources import HypersyncDataSource, SyntheticDataSource, zipf_weights
+from derby_index import DerbyConfigError
+from derby_sessions import DEFAULT_SESSION, DerbySessionRegistry, SessionLimitError
+from firehose_arrow import build_firehose_batch, iter_block_groups
+from height_watcher import HeightWatcher
+from ingest_bus import BusClient, BusServer
+from log_pipeline import LogPipeline
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, FAST_BUCKETS, SIZE_BUCKETS, InstrumentedClient, MetricsRegistry, monitor_event_loop_lag
+from poll_scheduler import PollScheduler
+from rollups import RollupEngine
+from tps_window import BlockRing, window_label
+from ws_protocol import (
+    FIREHOSE_CHANNEL, StreamEvent, encode_derby_delta, encode_derby_keyframe, encode_firehose_frame, hello,
+)
+
 # --- Configuration ---
 load_dotenv()
 MONAD_HYPERSYNC_URL = os.getenv("MONAD_HYPERSYNC_URL", "https://monad-testnet.hypersync.xyz")
 HYPERSYNC_BEARER_TOKEN = os.getenv("HYPERSYNC_BEARER_TOKEN")
-# This is now the interval for fetching large batches
-CITYSCAPE_POLLING_INTERVAL = 5.0
-DERBY_POLLING_INTERVAL = 2.0
+# Where blocks come from: "hypersync" (needs the bearer token) or "synthetic", a generated
+# chain for offline runs and load tests (see data_sources.py)
+DATA_SOURCE = os.getenv("DATA_SOURCE", "hypersync").lower()
+SYNTHETIC_TPS = float(os.getenv("SYNTHETIC_TPS", 1000))
+SYNTHETIC_BLOCK_INTERVAL_SECONDS = float(os.getenv("SYNTHETIC_BLOCK_INTERVAL_SECONDS", 0.5))
+# Share of synthetic transactions sent to the default Derby contracts, Zipf-distributed over them
+SYNTHETIC_DERBY_SHARE = float(os.getenv("SYNTHETIC_DERBY_SHARE", 0.3))
+SYNTHETIC_ZIPF_EXPONENT = float(os.getenv("SYNTHETIC_ZIPF_EXPONENT", 1.0))
+# Optional JSON {"0xaddress": weight, ...} replacing the Zipf weights
+SYNTHETIC_ADDRESS_WEIGHTS = os.getenv("SYNTHETIC_ADDRESS_WEIGHTS")
+SYNTHETIC_SEED = int(os.getenv("SYNTHETIC_SEED", 42))
+# Unix time of synthetic block 0, so separate processes can agree on block times
+SYNTHETIC_GENESIS = float(os.environ["SYNTHETIC_GENESIS"]) if os.getenv("SYNTHETIC_GENESIS") else None
+# Adaptive polling (see poll_scheduler.py): at the tip, a tick is scheduled right after the
+# Nth block expected from the measured block interval; misses and errors back off with jitter
+DEFAULT_BLOCK_INTERVAL_SECONDS = 0.5
+CITYSCAPE_BLOCKS_PER_POLL = int(os.getenv("CITYSCAPE_BLOCKS_PER_POLL", 4))
+DERBY_BLOCKS_PER_POLL = int(os.getenv("DERBY_BLOCKS_PER_POLL", 4))
+POLL_MAX_DELAY_SECONDS = 30.0
+# Cursor-based firehose ingestion: where to start on boot and how far one query may reach
+CITYSCAPE_INITIAL_LOOKBACK_BLOCKS = 10
+CITYSCAPE_MAX_BLOCKS_PER_QUERY = 50
+# The frontend render queue holds at most 500 transactions, so never send more per event
+CITYSCAPE_MAX_TRANSACTIONS_PER_EVENT = 500
+DERBY_INITIAL_LOOKBACK_BLOCKS = 8
+DERBY_MAX_BLOCKS_PER_QUERY = 50
 ERROR_RETRY_DELAY_SECONDS = 5
-TPS_MEMORY_SECONDS = 10 
+# Shared chain tip: callers within this many seconds of the last fetch reuse it. This is the
+# starting value; the firehose keeps it at the measured block interval, never below the minimum.
+HEIGHT_TTL_SECONDS = float(os.getenv("HEIGHT_TTL_SECONDS", 0.5))
+HEIGHT_MIN_TTL_SECONDS = 0.1
+# Rolling TPS: how much chain time the per-block ring buffer remembers and which windows it reports
+TPS_MEMORY_SECONDS = 300
+TPS_WINDOWS_SECONDS = (10, 60, 300)
+# Headline "tps" value sent to clients
+TPS_PRIMARY_WINDOW_SECONDS = 10
+# Upper bound on blocks per second, used to size the ring buffer
+TPS_MAX_BLOCKS_PER_SECOND = 4
+# Backpressure for SSE viewers: pending events kept per subscriber, and how long a
+# subscriber may go without consuming anything before it is disconnected
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 8))
+STREAM_MAX_STALL_SECONDS = float(os.getenv("STREAM_MAX_STALL_SECONDS", 30))
+# On-disk per-block history: where it lives, how far back a restart may backfill from it,
+# and the most buckets one /tps-history response may return
+HISTORY_PATH = os.getenv("HISTORY_PATH", "data/block_history.bin")
+HISTORY_MAX_BACKFILL_BLOCKS = int(os.getenv("HISTORY_MAX_BACKFILL_BLOCKS", 2000))
+HISTORY_MAX_POINTS = 5000
+# Rollup chart queries return at most this many buckets unless asked for fewer
+ROLLUP_MAX_POINTS = 1000
+# Historical replay: range and speed limits, upstream parallelism and how far ahead it prefetches
+REPLAY_MAX_BLOCKS = int(os.getenv("REPLAY_MAX_BLOCKS", 200_000))
+REPLAY_MAX_SPEED = 1000.0
+REPLAY_MAX_CONCURRENT = int(os.getenv("REPLAY_MAX_CONCURRENT", 4))
+REPLAY_STREAM_CONCURRENCY = 4
+REPLAY_MAX_BLOCKS_PER_RESPONSE = 1000
+REPLAY_PREFETCH_EVENTS = 64
+# Wall-clock time between replay events; each event covers `speed` times as much chain time
+REPLAY_EVENT_INTERVAL_SECONDS = 0.5
+# Deployment role. "standalone": one process does everything. "ingester": the only process
+# that polls HyperSync; it also serves its payloads to workers over INGEST_BUS_PATH.
+# "worker": no upstream loops, only fan-out of the ingester's events (run many of these).
+ROLE_STANDALONE, ROLE_INGESTER, ROLE_WORKER = "standalone", "ingester", "worker"
+SERVE_ROLE = os.getenv("SERVE_ROLE", ROLE_STANDALONE).lower()
+INGEST_BUS_PATH = os.getenv("INGEST_BUS_PATH", "data/ingest.sock")
+BUS_RETRY_DELAY_SECONDS = 1.0
+HISTORY_TAIL_INTERVAL_SECONDS = 1.0
+# Logging: per-tick and per-connection lines are rate limited; the derby live view is
+# rendered from the newest default-session payload at most once per interval (0 = off)
+LOG_TPS_CALC_PER_SECOND = float(os.getenv("LOG_TPS_CALC_PER_SECOND", 0.2))
+LOG_CONNECTIONS_PER_SECOND = float(os.getenv("LOG_CONNECTIONS_PER_SECOND", 5))
+LOG_CONNECTIONS_BURST = 20
+DERBY_VIEW_INTERVAL_SECONDS = float(os.getenv("DERBY_VIEW_INTERVAL_SECONDS", 10))
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", 8000))
 
@@ -40,11 +127,21 @@ DEX_CONTRACTS = {
     "Uniswap": "0x3aE6D8A282D67893e17AA70ebFFb33EE5aa65893",
 }
 
-# This will now be our dynamic configuration, initialized with the defaults.
+# Default Derby configuration, used by the "default" session and by any new session.
 # The structure is { "entityName": ["0xaddress1", "0xaddress2", ...], ... }
-DERBY_TRACKER_CONFIG: Dict[str, List[str]] = {
+DEFAULT_DERBY_CONFIG: Dict[str, List[str]] = {
     name: [address] for name, address in DEX_CONTRACTS.items()
 }
+# Every viewer session gets its own config, compiled into an immutable, versioned
+# DerbySnapshot; all active sessions share one union upstream query.
+DERBY_SESSIONS = DerbySessionRegistry(
+    DEFAULT_DERBY_CONFIG,
+    max_sessions=int(os.getenv("DERBY_MAX_SESSIONS", 1000)),
+    idle_seconds=float(os.getenv("DERBY_SESSION_IDLE_SECONDS", 600)),
+    max_stall_seconds=STREAM_MAX_STALL_SECONDS,
+    max_entities=int(os.getenv("DERBY_MAX_ENTITIES", 20)),
+    max_addresses_per_entity=int(os.getenv("DERBY_MAX_ADDRESSES_PER_ENTITY", 50)),
+)
 
 # --- Pydantic Models for API ---
 class DerbyEntity(BaseModel):
@@ -54,25 +151,190 @@ class DerbyEntity(BaseModel):
 class UpdateDerbyConfigRequest(BaseModel):
     entities: List[DerbyEntity]
 
+# Derby session id shared by /derby-stream, /update-derby-config and /ws
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+SESSION_QUERY = QueryParam(default=DEFAULT_SESSION, min_length=1, max_length=64, pattern=SESSION_ID_PATTERN)
+
+def new_poll_scheduler(blocks_per_poll: int) -> PollScheduler:
+    return PollScheduler(
+        blocks_per_poll=blocks_per_poll,
+        default_block_interval=DEFAULT_BLOCK_INTERVAL_SECONDS,
+        max_delay=POLL_MAX_DELAY_SECONDS,
+    )
+
+def new_tps_ring(columns=("tx_count", "fee_sum")) -> BlockRing:
+    return BlockRing(
+        capacity=TPS_MEMORY_SECONDS * TPS_MAX_BLOCKS_PER_SECOND,
+        windows=TPS_WINDOWS_SECONDS,
+        columns=columns,
+    )
+
 # --- Global State & Application Lifespan ---
-app_state: Dict[str, Any] = {"hypersync_client": None, "derby_connections": set()}
+app_state: Dict[str, Any] = {
+    "data_source": None,
+    "height_watcher": None,
+    "height_task": None,
+    "firehose_broadcaster": Broadcaster(
+        "firehose", queue_size=STREAM_QUEUE_SIZE, policy=DROP_OLDEST, max_stall_seconds=STREAM_MAX_STALL_SECONDS
+    ),
+    "firehose_ring": None,
+    "firehose_scheduler": new_poll_scheduler(CITYSCAPE_BLOCKS_PER_POLL),
+    "derby_scheduler": new_poll_scheduler(DERBY_BLOCKS_PER_POLL),
+    "cityscape_task": None,
+    "derby_task": None,
+    "active_replays": 0,
+    "block_history": None,
+    "rollups": RollupEngine(),
+    "loop_lag_task": None,
+    "bus_server": None,
+    "bus_client": None,
+    "bus_task": None,
+    "history_tail_task": None,
+    "nft_service": None,
+}
+
+# --- Metrics (Prometheus text format on /metrics) ---
+# Series are created here, once; hot paths only call inc/observe on them.
+METRICS = MetricsRegistry()
+UPSTREAM_SECONDS = METRICS.histogram("monad_upstream_request_seconds", "Chain data source call latency", ["method"])
+UPSTREAM_ERRORS = METRICS.counter("monad_upstream_errors_total", "Chain data source calls that raised", ["method"])
+HYPERSYNC_EXECUTION_SECONDS = METRICS.histogram("monad_hypersync_execution_seconds", "Server-side total_execution_time per response", ["loop"])
+RESPONSE_ROWS = METRICS.histogram("monad_response_rows", "Block and transaction rows per HyperSync response", ["loop"], SIZE_BUCKETS)
+RESPONSE_BYTES = METRICS.histogram("monad_response_bytes", "Arrow buffer bytes per HyperSync response", ["loop"], SIZE_BUCKETS)
+PAYLOAD_BUILD_SECONDS = METRICS.histogram("monad_payload_build_seconds", "Time spent building and encoding one tick's events", ["stream"], FAST_BUCKETS)
+EVENT_LOOP_LAG = METRICS.histogram("monad_event_loop_lag_seconds", "How late the event loop wakes a 0.5 s sleeper", buckets=FAST_BUCKETS)
+EVENT_LOOP_LAG_LAST = METRICS.gauge("monad_event_loop_lag_last_seconds", "Most recent event loop lag sample")
+STREAM_SUBSCRIBERS = METRICS.gauge("monad_stream_subscribers", "Connected SSE/WebSocket subscribers", ["stream"])
+STREAM_EVENTS = METRICS.counter("monad_stream_events_published_total", "Events published to subscribers", ["stream"])
+STREAM_DROPPED = METRICS.counter("monad_stream_events_dropped_total", "Events dropped or coalesced for slow subscribers", ["stream"])
+STREAM_EVICTED = METRICS.counter("monad_stream_subscribers_evicted_total", "Subscribers disconnected for stalling", ["stream"])
+LOG_MESSAGES_DROPPED = METRICS.counter("monad_log_messages_dropped_total", "Log lines dropped because the log queue was full")
+LOG_MESSAGES_SUPPRESSED = METRICS.counter("monad_log_messages_suppressed_total", "Log lines held back by per-category rate limits", ["category"])
+DERBY_ACTIVE_SESSIONS = METRICS.gauge("monad_derby_active_sessions", "Derby sessions with at least one subscriber")
+NFT_BUILD_DONE = METRICS.gauge("monad_nft_build_done", "Items completed in the current NFT network build", ["phase"])
+NFT_BUILD_TOTAL = METRICS.gauge("monad_nft_build_total", "Items to process in the current NFT network build", ["phase"])
+NFT_UPSTREAM_RATE = METRICS.gauge("monad_nft_upstream_rate", "Adaptive request budget per NFT upstream (requests/s)", ["upstream"])
+NFT_UPSTREAM_THROTTLED = METRICS.counter("monad_nft_upstream_throttled_total", "429 responses from NFT upstreams", ["upstream"])
+NFT_UPSTREAM_FAILURES = METRICS.counter("monad_nft_upstream_failures_total", "5xx responses and connection errors from NFT upstreams", ["upstream"])
+NFT_UPSTREAM_CIRCUIT_OPEN = METRICS.gauge("monad_nft_upstream_circuit_open", "1 while the upstream's circuit breaker is not closed", ["upstream"])
+
+for loop_name in ("firehose", "derby", "replay"):
+    HYPERSYNC_EXECUTION_SECONDS.labels(loop_name); RESPONSE_ROWS.labels(loop_name); RESPONSE_BYTES.labels(loop_name)
+FIREHOSE_BUILD_SECONDS = PAYLOAD_BUILD_SECONDS.labels("firehose")
+DERBY_BUILD_SECONDS = PAYLOAD_BUILD_SECONDS.labels("derby")
+
+def collect_stream_metrics():
+    firehose = app_state["firehose_broadcaster"]
+    STREAM_SUBSCRIBERS.labels("firehose").set(firehose.subscriber_count)
+    STREAM_EVENTS.labels("firehose").value = firehose.seq
+    STREAM_DROPPED.labels("firehose").value = firehose.dropped_total
+    STREAM_EVICTED.labels("firehose").value = firehose.evicted_total
+
+    broadcasters = [session.broadcaster for session in DERBY_SESSIONS.sessions.values()]
+    retired = DERBY_SESSIONS.retired
+    STREAM_SUBSCRIBERS.labels("derby").set(sum(b.subscriber_count for b in broadcasters))
+    STREAM_EVENTS.labels("derby").value = retired["published"] + sum(b.seq for b in broadcasters)
+    STREAM_DROPPED.labels("derby").value = retired["dropped"] + sum(b.dropped_total for b in broadcasters)
+    STREAM_EVICTED.labels("derby").value = retired["evicted"] + sum(b.evicted_total for b in broadcasters)
+    DERBY_ACTIVE_SESSIONS.labels().set(len(DERBY_SESSIONS.active_sessions()))
+    LOG_MESSAGES_DROPPED.labels().value = LOGS.dropped
+    for category, limit in LOGS.limits.items():
+        LOG_MESSAGES_SUPPRESSED.labels(category).value = limit.suppressed_total
+
+METRICS.add_collector(collect_stream_metrics)
+
+def observe_response(loop_name: str, response):
+    """total_execution_time, row count and (for Arrow responses) byte size of one HyperSync response"""
+    if getattr(response, "total_execution_time", None) is not None:
+        HYPERSYNC_EXECUTION_SECONDS.labels(loop_name).observe(response.total_execution_time / 1000)
+    data = getattr(response, "data", None)
+    if data is None:
+        return
+    rows = nbytes = 0
+    for table in (data.blocks, data.transactions):
+        if table is None:
+            continue
+        if hasattr(table, "num_rows"):
+            rows += table.num_rows
+            nbytes += table.nbytes
+        else:
+            rows += len(table)
+    RESPONSE_ROWS.labels(loop_name).observe(rows)
+    if nbytes:
+        RESPONSE_BYTES.labels(loop_name).observe(nbytes)
+
+def new_data_source(bearer_token: Optional[str]):
+    if DATA_SOURCE == "synthetic":
+        if SYNTHETIC_ADDRESS_WEIGHTS:
+            weights = json.loads(SYNTHETIC_ADDRESS_WEIGHTS)
+        else:
+            weights = zipf_weights(list(DEX_CONTRACTS.values()), SYNTHETIC_ZIPF_EXPONENT)
+        return SyntheticDataSource(
+            tps=SYNTHETIC_TPS, block_interval=SYNTHETIC_BLOCK_INTERVAL_SECONDS, address_weights=weights,
+            tracked_share=SYNTHETIC_DERBY_SHARE, seed=SYNTHETIC_SEED, genesis=SYNTHETIC_GENESIS,
+        )
+    return HypersyncDataSource(MONAD_HYPERSYNC_URL, bearer_token)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print_info("SYSTEM", "Application starting up...")
     bearer_token = os.environ.get("HYPERSYNC_BEARER_TOKEN")
-    if not bearer_token:
+    if DATA_SOURCE not in ("hypersync", "synthetic"):
+        print_red(f"STARTUP: Unknown DATA_SOURCE '{DATA_SOURCE}'.")
+        sys.exit(1)
+    if DATA_SOURCE == "hypersync" and not bearer_token:
         print_red("STARTUP: HYPERSYNC_BEARER_TOKEN environment variable not found.")
         sys.exit(1)
+    if SERVE_ROLE not in (ROLE_STANDALONE, ROLE_INGESTER, ROLE_WORKER):
+        print_red(f"STARTUP: Unknown SERVE_ROLE '{SERVE_ROLE}'.")
+        sys.exit(1)
+    print_info("SYSTEM", f"Serving as {SERVE_ROLE}.")
     try:
-        client_config = ClientConfig(url=MONAD_HYPERSYNC_URL, bearer_token=bearer_token)
-        app_state["hypersync_client"] = hypersync.HypersyncClient(client_config)
-        print_info("SYSTEM", "HypersyncClient initialized.")
+        # Workers still need a data source of their own for on-demand replays
+        app_state["data_source"] = InstrumentedClient(new_data_source(bearer_token), UPSTREAM_SECONDS, UPSTREAM_ERRORS)
+        print_info("SYSTEM", f"Data source initialized: {app_state['data_source'].stats()}")
+        # Only one process appends to the history; workers follow the file
+        app_state["block_history"] = BlockHistoryStore(HISTORY_PATH, read_only=(SERVE_ROLE == ROLE_WORKER))
+        print_info("SYSTEM", f"Block history: {app_state['block_history'].records} blocks in {HISTORY_PATH}.")
+        # Rollups live in memory; rebuild them from disk before ingestion appends anything
+        rebuilt = await asyncio.to_thread(app_state["rollups"].rebuild, app_state["block_history"])
+        print_info("SYSTEM", f"Rollups rebuilt from {rebuilt} stored blocks.")
+        app_state["loop_lag_task"] = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG.labels(), EVENT_LOOP_LAG_LAST.labels()))
+        if SERVE_ROLE == ROLE_WORKER:
+            app_state["bus_client"] = BusClient(INGEST_BUS_PATH, app_state["firehose_broadcaster"], DERBY_SESSIONS)
+            app_state["bus_task"] = asyncio.create_task(ingest_bus_loop())
+            app_state["history_tail_task"] = asyncio.create_task(history_tail_loop())
+        else:
+            app_state["height_watcher"] = HeightWatcher(app_state["data_source"], ttl=HEIGHT_TTL_SECONDS)
+            app_state["height_task"] = asyncio.create_task(app_state["height_watcher"].run(ERROR_RETRY_DELAY_SECONDS))
+            app_state["cityscape_task"] = asyncio.create_task(cityscape_ingestion_loop())
+            app_state["derby_task"] = asyncio.create_task(derby_engine_loop())
+        if SERVE_ROLE == ROLE_INGESTER:
+            app_state["bus_server"] = BusServer(INGEST_BUS_PATH, app_state["firehose_broadcaster"], DERBY_SESSIONS)
+            await app_state["bus_server"].start()
+            print_info("BUS", f"Serving workers on {INGEST_BUS_PATH}.")
         yield
     finally:
-        if app_state["hypersync_client"]:
-            print_info("SYSTEM", "Closing HypersyncClient.")
+        if app_state["bus_server"]:
+            await app_state["bus_server"].close()
+        for task_name in ("cityscape_task", "derby_task", "height_task", "loop_lag_task", "bus_task", "history_tail_task"):
+            task = app_state[task_name]
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        print_info("SYSTEM", "Stopped Cityscape and Derby background tasks.")
+        if app_state["block_history"]:
+            app_state["block_history"].close()
+        if app_state["data_source"]:
+            print_info("SYSTEM", "Closing data source.")
+            await app_state["data_source"].close()
+        if app_state["nft_service"]:
+            await app_state["nft_service"].close()
         print_info("SYSTEM", "Application shutdown complete.")
+        LOGS.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -86,201 +348,539 @@ app.add_middleware(
 )
 
 # --- Helper Print Functions ---
-def print_red(msg, file=sys.stderr): print(f"\033[91mERROR: {msg}\033[0m", file=file, flush=True)
-def print_yellow(msg, file=sys.stderr): print(f"\033[93mWARNING: {msg}\033[0m", file=file, flush=True)
-def print_green(msg, file=sys.stdout): print(f"\033[92m{msg}\033[0m", file=file, flush=True)
-def print_cyan(msg, file=sys.stdout): print(f"\033[96m{msg}\033[0m", file=file, flush=True)
-def print_info(msg_prefix, message, file=sys.stderr): print(f"{msg_prefix.upper()} INFO: {message}", file=file, flush=True)
+# Writes go through a queue to a background thread, never straight to stdout/stderr from the event loop
+LOGS = LogPipeline()
+LOGS.configure("TPS_CALC", rate=LOG_TPS_CALC_PER_SECOND)
+LOGS.configure("CONNECTIONS", rate=LOG_CONNECTIONS_PER_SECOND, burst=LOG_CONNECTIONS_BURST)
+
+def print_red(msg, file=sys.stderr, category=None): LOGS.write(f"\033[91mERROR: {msg}\033[0m", file, category)
+def print_yellow(msg, file=sys.stderr, category=None): LOGS.write(f"\033[93mWARNING: {msg}\033[0m", file, category)
+def print_green(msg, file=sys.stdout, category=None): LOGS.write(f"\033[92m{msg}\033[0m", file, category)
+def print_cyan(msg, file=sys.stdout, category=None): LOGS.write(f"\033[96m{msg}\033[0m", file, category)
+def print_info(msg_prefix, message, file=sys.stderr, category=None): LOGS.write(f"{msg_prefix.upper()} INFO: {message}", file, category or msg_prefix)
 
 # ==========================================================
-# === Generator 1: Cityscape Firehose Stream (TPS LOGIC FIXED)
+# === Firehose helpers (shared by the live loop and replay)
 # ==========================================================
-async def cityscape_stream_generator(request: Request) -> AsyncGenerator[str, None]:
-    hypersync_client = app_state["hypersync_client"]
-    query = Query(
-        from_block=0, # This will be set dynamically in the loop
+def new_firehose_query(from_block: int, to_block: Optional[int] = None) -> Query:
+    return Query(
+        from_block=from_block,
+        to_block=to_block,
         transactions=[TransactionSelection()],
         field_selection=FieldSelection(
             transaction=[TransactionField.HASH, TransactionField.VALUE, TransactionField.BLOCK_NUMBER, TransactionField.GAS_USED, TransactionField.GAS_PRICE],
             block=[BlockField.NUMBER, BlockField.TIMESTAMP]
-        )
+        ),
+        # Empty blocks still advance time, so the ring buffer needs them too
+        include_all_blocks=True
     )
+
+def append_batch_to_ring(ring: BlockRing, batch):
+    """Feed per-block aggregates into a rolling-window ring, skipping blocks it has already seen"""
+    for block_number, timestamp, tx_count, fee_sum in zip(
+        batch.block_numbers.tolist(), batch.block_timestamps.tolist(),
+        batch.block_tx_counts.tolist(), batch.block_fees.tolist()
+    ):
+        if ring.last_block_number is not None and block_number <= ring.last_block_number:
+            continue
+        ring.append(block_number, timestamp, (tx_count, fee_sum))
+
+def firehose_payload(batch, ring: BlockRing) -> dict:
+    """The /firehose-stream event shape"""
+    return {
+        "transactions": batch.transactions,
+        "latest_block": {"number": batch.latest_block_number, "timestamp": batch.latest_block_timestamp},
+        "tps": ring.rate(TPS_PRIMARY_WINDOW_SECONDS, "tx_count"),
+        "tps_windows": ring.rates("tx_count"),
+        "fee_rate_windows": ring.rates("fee_sum"),
+        "total_fees_in_batch": batch.total_fees
+    }
+
+# ==========================================================
+# === Ingestion: Shared Cityscape Firehose (cursor driven by next_block)
+# ==========================================================
+async def cityscape_ingestion_loop():
+    """
+    Single tip-follower for the firehose. Polls HyperSync once per interval and
+    publishes each computed batch to the shared broadcaster, so upstream load
+    stays flat regardless of how many SSE clients are connected.
+    A persistent cursor advanced by `QueryResponse.next_block` makes sure every
+    block is fetched exactly once.
+    """
+    data_source = app_state["data_source"]
+    height_watcher = app_state["height_watcher"]
+    scheduler = app_state["firehose_scheduler"]
+    broadcaster = app_state["firehose_broadcaster"]
+    ring = app_state["firehose_ring"] = new_tps_ring()
+    history = app_state["block_history"]
+    rollups = app_state["rollups"]
+    query = new_firehose_query(from_block=0) # from_block is set dynamically in the loop
     
-    print_info("CITYSCAPE", "Starting stream with dynamic TPS calculation.")
+    # Persistent cursor: the next block that has not been ingested yet
+    next_block = None
+
+    print_info("CITYSCAPE", "Starting shared firehose ingestion with rolling-window TPS.")
 
     while True:
         try:
-            if await request.is_disconnected():
-                print_yellow("Cityscape client disconnected."); break
-            
-            # Dynamically set the block range for the query to get the last ~5 seconds of blocks
-            current_height = await hypersync_client.get_height()
-            # Assuming ~0.5s block times, 10 blocks is ~5 seconds.
-            query.from_block = max(0, current_height - 10)
-            query.to_block = current_height + 1 # +1 to make it inclusive
+            current_height = await height_watcher.get_height()
+            if next_block is None:
+                # Warm start: begin a few blocks behind the tip
+                next_block = max(0, current_height - CITYSCAPE_INITIAL_LOOKBACK_BLOCKS)
+                if history is not None and history.last_block_number is not None:
+                    # After a short restart, backfill the gap in the on-disk history instead
+                    resume = history.last_block_number + 1
+                    if current_height - resume <= HISTORY_MAX_BACKFILL_BLOCKS:
+                        next_block = min(next_block, resume)
+
+            if next_block > current_height:
+                # Nothing new since the last batch: the block is late or the chain stalled
+                await asyncio.sleep(scheduler.next_delay(got_new=False))
+                continue
+
+            # Fetch every block exactly once, in bounded chunks when catching up
+            query.from_block = next_block
+            query.to_block = min(current_height + 1, next_block + CITYSCAPE_MAX_BLOCKS_PER_QUERY)
+
+            response = await data_source.get_arrow(query)
+            observe_response("firehose", response)
 
-            response = await hypersync_client.get(query)
+            # HyperSync may stop early (server time limit); resume from where it stopped
+            if response.next_block > next_block:
+                next_block = response.next_block
+            else:
+                next_block = query.to_block
             
-            tps = 0.0 # Default value
-            if response.data and response.data.transactions and response.data.blocks and len(response.data.blocks) > 1:
-                # --- NEW DYNAMIC TPS CALCULATION LOGIC ---
-                total_transactions = len(response.data.transactions)
-                
-                # Get the timestamps of the first and last block in the batch
-                timestamps = [int(b.timestamp, 16) for b in response.data.blocks if b.timestamp]
-                min_ts = min(timestamps)
-                max_ts = max(timestamps)
-                
-                # Calculate the actual time duration of the batch
-                duration = max_ts - min_ts
-
-                # Calculate TPS, avoiding division by zero
-                if duration > 0:
-                    tps = total_transactions / duration
-                else:
-                    # If all transactions happened in the same second, we can't get a rate,
-                    # so we just show the count as the "rate" for that one second.
-                    tps = total_transactions
-
-                print_info("TPS_CALC", f"Batch TXs: {total_transactions}, Duration: {duration}s, Dynamic TPS: {tps:.2f}")
-
-                # --- PAYLOAD PREPARATION (UNCHANGED) ---
-                transactions_payload = [{"hash": tx.hash, "value": f"{(int(tx.value, 16) / 1e18):.4f}"} for tx in response.data.transactions]
-                latest_block = max(response.data.blocks, key=lambda b: b.number)
-                total_fees = sum((int(tx.gas_used, 16) * int(tx.gas_price, 16)) / 1e18 for tx in response.data.transactions if tx.gas_used and tx.gas_price)
-                
-                sse_payload = {
-                    "transactions": transactions_payload,
-                    "latest_block": {"number": latest_block.number, "timestamp": int(latest_block.timestamp, 16)},
-                    "tps": tps, # Using the new dynamically calculated TPS
-                    "total_fees_in_batch": total_fees
-                }
-                yield f"data: {json.dumps(sse_payload)}\n\n"
-
-            # Sleep for the 5-second polling interval
-            await asyncio.sleep(CITYSCAPE_POLLING_INTERVAL)
+            # Columnar aggregation; only the transactions we send become Python objects
+            build_started = time.perf_counter()
+            batch = build_firehose_batch(response.data.blocks, response.data.transactions, CITYSCAPE_MAX_TRANSACTIONS_PER_EVENT)
+            if len(batch):
+                scheduler.observe(batch.latest_block_number, batch.latest_block_timestamp)
+                height_watcher.ttl = max(HEIGHT_MIN_TTL_SECONDS, scheduler.block_interval)
+                # --- Per-block aggregates feed the rolling-window ring buffer ---
+                append_batch_to_ring(ring, batch)
+                if history is not None:
+                    rollups.ingest(history.append_batch(batch))
+                sse_payload = firehose_payload(batch, ring)
+                tps = sse_payload["tps"]
+                print_info("TPS_CALC", f"Blocks {query.from_block}-{next_block - 1}, TXs: {batch.total_transactions}, Rolling TPS ({TPS_PRIMARY_WINDOW_SECONDS}s): {tps:.2f}, Viewers: {broadcaster.subscriber_count}")
+
+                frame = encode_firehose_frame(
+                    broadcaster.seq + 1, batch.latest_block_number, batch.latest_block_timestamp, batch.total_fees, tps,
+                    list(sse_payload["tps_windows"].values()), list(sse_payload["fee_rate_windows"].values()),
+                    batch.transaction_values, batch.transaction_hashes,
+                )
+                # Encoded once per transport; every subscriber receives the same object
+                event = StreamEvent(sse=f"data: {json.dumps(sse_payload)}\n\n".encode(), frame=frame)
+                FIREHOSE_BUILD_SECONDS.observe(time.perf_counter() - build_started)
+                broadcaster.publish(event)
+
+            # Keep pulling immediately while behind the tip, otherwise wait for the next expected blocks
+            delay = scheduler.next_delay(got_new=True, behind=next_block <= current_height)
+            if delay:
+                await asyncio.sleep(delay)
 
         except Exception as e:
-            print_red(f"CITYSCAPE ERROR: {e}"); await asyncio.sleep(ERROR_RETRY_DELAY_SECONDS)
+            delay = scheduler.on_error()
+            print_red(f"CITYSCAPE ERROR: {e} (retrying in {delay:.1f}s)"); await asyncio.sleep(delay)
 
 # ==========================================================
-# === Generator 2: Derby Tracker Stream (UNCHANGED)
+# === Ingestion: Shared Derby Engine (one upstream query per config version)
 # ==========================================================
-async def derby_stream_generator(request: Request) -> AsyncGenerator[str, None]:
-    hypersync_client = app_state["hypersync_client"]
-    
-    # Register this connection
-    connection_id = id(request)
-    app_state["derby_connections"].add(connection_id)
-    
-    last_config_check = 0
-    CONFIG_CHECK_INTERVAL = 10  # Check for config changes every 10 seconds
-    
-    try:
-        while True:
-            # Periodically refresh the configuration
-            current_time = time.time()
-            if current_time - last_config_check > CONFIG_CHECK_INTERVAL:
-                current_config = DERBY_TRACKER_CONFIG.copy()
-                last_config_check = current_time
-                print_info("DERBY", f"Refreshed config. Now tracking: {list(current_config.keys())}")
-            else:
-                # Use the existing config for this iteration
-                if 'current_config' not in locals():
-                    current_config = DERBY_TRACKER_CONFIG.copy()
-            
-            all_addresses = [addr for entity_addrs in current_config.values() for addr in entity_addrs]
-            address_to_dex = {addr.lower(): name for name, addrs in current_config.items() for addr in addrs}
-            
-            # No need for persistent timestamp tracking - we calculate TPS from each batch
-
-            if not all_addresses:
-                print_yellow("DERBY WARNING: No addresses to track. Stream will yield empty updates.")
-                if await request.is_disconnected(): 
-                    break
-                yield f"data: {json.dumps({})}\\n\\n"
-                await asyncio.sleep(DERBY_POLLING_INTERVAL)
+def new_derby_query(selection) -> Query:
+    return Query(
+        from_block=0,
+        transactions=[selection],
+        field_selection=FieldSelection(
+            block=[BlockField.NUMBER, BlockField.TIMESTAMP],
+            transaction=[TransactionField.TO, TransactionField.BLOCK_NUMBER]
+        ),
+        # Blocks without matching transactions still count towards elapsed time
+        include_all_blocks=True
+    )
+
+async def backfill_derby_ring(data_source, session, from_block: int, to_block: int):
+    """
+    Fill a joining (or reconfigured) session's empty ring with blocks [from_block, to_block)
+    using its own addresses, so its first frames show the recent rate instead of zeros.
+    The shared cursor then continues from to_block.
+    """
+    snapshot = session.snapshot
+    ring = session.ring
+    if not snapshot.address_index:
+        return
+    query = new_derby_query(snapshot.selection)
+    query.from_block = from_block
+    query.to_block = to_block
+    while query.from_block < to_block:
+        response = await data_source.get(query)
+        observe_response("derby", response)
+        rows = {}
+        for tx in (response.data.transactions or []) if response.data else []:
+            column = snapshot.address_index.get(tx.to)
+            if column is not None:
+                row = rows.setdefault(tx.block_number, [0] * len(snapshot.entity_names))
+                row[column] += 1
+        for block in sorted(response.data.blocks or [], key=lambda b: b.number) if response.data else []:
+            if not block.timestamp or (ring.last_block_number is not None and block.number <= ring.last_block_number):
                 continue
+            ring.append(block.number, int(block.timestamp, 16), rows.get(block.number) or [0] * len(ring.columns))
+        if response.next_block <= query.from_block:
+            break
+        query.from_block = response.next_block
 
-            try:
-                current_height = await hypersync_client.get_height()
-                # Use a smaller window to avoid double-counting transactions
-                # Get only the last ~4 seconds of blocks (about 8 blocks at 0.5s per block)
-                start_block = max(0, current_height - 8)
-            except Exception as e:
-                print_red(f"DERBY ERROR: Failed to get initial block height: {e}")
-                await asyncio.sleep(ERROR_RETRY_DELAY_SECONDS)
+async def derby_engine_loop():
+    """
+    Single Derby engine for every session. Each tick it runs one upstream query for the
+    deduplicated union of all active sessions' addresses, counts matches per address once,
+    then demultiplexes the counts into each session's ring buffer and payload. Upstream
+    cost scales with distinct addresses, not with sessions or connections.
+    """
+    data_source = app_state["data_source"]
+    height_watcher = app_state["height_watcher"]
+    scheduler = app_state["derby_scheduler"]
+
+    union = None
+    next_block = None
+
+    print_info("DERBY", "Starting shared Derby engine.")
+
+    while True:
+        try:
+            DERBY_SESSIONS.prune_idle()
+            sessions = DERBY_SESSIONS.active_sessions()
+            if not sessions:
+                # Nobody is watching a race; don't spend upstream calls on it
+                next_block = None
+                await DERBY_SESSIONS.wait_for_change(POLL_MAX_DELAY_SECONDS)
                 continue
 
-            query = Query(
-                from_block=start_block,
-                to_block=current_height + 1,  # Make it inclusive
-                transactions=[TransactionSelection(to=all_addresses)],
-                field_selection=FieldSelection(
-                    block=[BlockField.NUMBER, BlockField.TIMESTAMP],
-                    transaction=[TransactionField.TO, TransactionField.BLOCK_NUMBER]
-                )
-            )
+            if union is not DERBY_SESSIONS.union:
+                # Sessions or configs changed: swap in the recompiled union, keep the cursor
+                union = DERBY_SESSIONS.union
+                targets = union.targets
+                # The snapshots the union was compiled from; its entity columns index into these
+                snapshots = {session.session_id: session.snapshot for session in sessions}
+                query = new_derby_query(union.selection)
+                print_info("DERBY", f"Union version {union.version}: {len(sessions)} active sessions, {len(targets)} distinct addresses.")
 
-            try:
-                if await request.is_disconnected():
-                    print_yellow("Derby client disconnected."); break
-                
-                response = await hypersync_client.get(query)
-                
+            current_height = await height_watcher.get_height()
+            cursor_running = next_block is not None
+            if not cursor_running:
+                # The first query covers the lookback for every session at once
+                next_block = max(0, current_height - DERBY_INITIAL_LOOKBACK_BLOCKS)
+            for session in sessions:
+                if session.ring is None:
+                    # New, reconfigured or returning session: a ring with one column per entity,
+                    # caught up to the shared cursor before it joins the union query
+                    session.ring = new_tps_ring(columns=session.snapshot.entity_names)
+                    if cursor_running:
+                        try:
+                            await backfill_derby_ring(data_source, session, max(0, next_block - DERBY_INITIAL_LOOKBACK_BLOCKS), next_block)
+                        except Exception:
+                            # Retry the backfill next tick rather than leave a ring with a gap
+                            session.ring = None
+                            raise
+            if union is not DERBY_SESSIONS.union:
+                # Sessions changed during a backfill: go on with the ones the union still
+                # describes; the rest rejoin next tick with the recompiled union
+                sessions = [s for s in sessions if s.ring is not None and s.snapshot is snapshots[s.session_id]]
+
+            fetched = False
+            if targets and next_block <= current_height:
+                fetched = True
+                query.from_block = next_block
+                query.to_block = min(current_height + 1, next_block + DERBY_MAX_BLOCKS_PER_QUERY)
+                response = await data_source.get(query)
+                observe_response("derby", response)
+                if union is not DERBY_SESSIONS.union:
+                    # Sessions changed while the query was in flight. The rows are still right for
+                    # sessions whose snapshot and ring survived, so keep those and advance the
+                    # cursor; sessions that left drop out, and new or reconfigured ones are
+                    # backfilled next tick with the recompiled union
+                    sessions = [s for s in sessions if s.ring is not None and s.snapshot is snapshots[s.session_id]]
+                next_block = response.next_block if response.next_block > next_block else query.to_block
+
+                # Count once per (block, address): a single dict lookup per transaction
+                block_address_counts = {}
+                for tx in (response.data.transactions or []) if response.data else []:
+                    if tx.to in targets:
+                        counts = block_address_counts.setdefault(tx.block_number, {})
+                        counts[tx.to] = counts.get(tx.to, 0) + 1
+
+                for block in sorted(response.data.blocks or [], key=lambda b: b.number) if response.data else []:
+                    if not block.timestamp:
+                        continue
+                    timestamp = int(block.timestamp, 16)
+                    scheduler.observe(block.number, timestamp)
+                    # Demultiplex this block's per-address counts into per-session entity rows
+                    session_rows = {}
+                    for address, count in block_address_counts.get(block.number, {}).items():
+                        for session_id, column in targets[address]:
+                            row = session_rows.get(session_id)
+                            if row is None:
+                                row = session_rows[session_id] = [0] * len(snapshots[session_id].entity_names)
+                            row[column] += count
+                    for session in sessions:
+                        ring = session.ring
+                        if ring.last_block_number is not None and block.number <= ring.last_block_number:
+                            continue
+                        ring.append(block.number, timestamp, session_rows.get(session.session_id) or [0] * len(ring.columns))
+
+            build_started = time.perf_counter()
+            for session in sessions:
+                snapshot = session.snapshot
+                if len(session.ring) < 2 and snapshot.address_index:
+                    # No span to take a rate over yet; an all-zero frame would be wrong, not just early
+                    continue
                 payload = {}
-                # Initialize all entities with 0 TPS
-                for dex_name in current_config.keys():
-                    payload[dex_name] = {"tps": 0.0}
-                
-                if response.data and response.data.transactions and response.data.blocks:
-                    # Count transactions in this specific batch for each DEX
-                    current_batch_counts = {}
-                    for dex_name in current_config.keys():
-                        current_batch_counts[dex_name] = 0
-                    
-                    block_timestamp_map = {b.number: int(b.timestamp, 16) for b in response.data.blocks if b.number and b.timestamp}
-                    
-                    # Count transactions to each DEX in this batch
-                    for tx in response.data.transactions:
-                        if tx.to and tx.block_number in block_timestamp_map:
-                            dex_name = address_to_dex.get(tx.to.lower())
-                            if dex_name:
-                                current_batch_counts[dex_name] += 1
-                    
-                    # Calculate time span of this batch
-                    if response.data.blocks and len(response.data.blocks) > 0:
-                        timestamps = [int(b.timestamp, 16) for b in response.data.blocks if b.timestamp]
-                        if len(timestamps) > 1:
-                            time_span = max(timestamps) - min(timestamps)
-                            if time_span > 0:
-                                # Calculate TPS for this batch: transactions / time_span
-                                for dex_name in current_config.keys():
-                                    tx_count = current_batch_counts[dex_name]
-                                    tps = tx_count / time_span
-                                    payload[dex_name] = {"tps": tps}
-                            else:
-                                # All transactions in same second, use count as rate
-                                for dex_name in current_config.keys():
-                                    payload[dex_name] = {"tps": float(current_batch_counts[dex_name])}
-                        else:
-                            # Single block, use transaction count as approximation
-                            for dex_name in current_config.keys():
-                                payload[dex_name] = {"tps": float(current_batch_counts[dex_name])}
-                
-                # This will print the report for the entities in this specific connection
-                print_derby_update(payload, list(current_config.keys()))
-                yield f"data: {json.dumps(payload)}\n\n"
-
-                # Don't use response.next_block - always query recent blocks
-                
-                await asyncio.sleep(DERBY_POLLING_INTERVAL)
-            except Exception as e:
-                print_red(f"DERBY ERROR: {e}"); await asyncio.sleep(ERROR_RETRY_DELAY_SECONDS)
+                for dex_name in snapshot.entity_names:
+                    payload[dex_name] = {
+                        "tps": session.ring.rate(TPS_PRIMARY_WINDOW_SECONDS, dex_name),
+                        "tps_windows": session.ring.rates(dex_name),
+                    }
+                if session.session_id == DEFAULT_SESSION:
+                    # The terminal live view follows the default race only; the log writer renders it
+                    LOGS.update_view("derby", (payload, list(snapshot.entity_names)))
+                # One encoded event per session per tick, shared by all its connections
+                seq = session.broadcaster.seq + 1
+                matrix = np.array([list(payload[name]["tps_windows"].values()) for name in snapshot.entity_names], dtype=np.float32)
+                delta = None
+                if session.last_frame is not None and session.last_frame[0] == snapshot.version:
+                    delta = encode_derby_delta(seq, session.channel, snapshot.version, matrix, session.last_frame[1])
+                session.last_frame = (snapshot.version, matrix)
+                session.broadcaster.publish(StreamEvent(
+                    sse=f"data: {json.dumps(payload)}\n\n".encode(),
+                    frame=encode_derby_keyframe(seq, session.channel, snapshot.version, matrix, snapshot.entity_names),
+                    delta=delta,
+                ))
+            DERBY_BUILD_SECONDS.observe(time.perf_counter() - build_started)
+
+            # Sleep until the next expected blocks (no wait while catching up), or wake
+            # immediately when sessions or configs change
+            delay = scheduler.next_delay(got_new=fetched, behind=fetched and next_block <= current_height)
+            if delay:
+                await DERBY_SESSIONS.wait_for_change(delay)
+        except Exception as e:
+            delay = scheduler.on_error()
+            print_red(f"DERBY ERROR: {e} (retrying in {delay:.1f}s)"); await asyncio.sleep(delay)
+
+# ==========================================================
+# === Worker role: events and history come from the ingester
+# ==========================================================
+async def ingest_bus_loop():
+    bus_client = app_state["bus_client"]
+    while True:
+        try:
+            print_info("BUS", f"Connecting to ingester at {INGEST_BUS_PATH}.")
+            await bus_client.serve()
+            print_yellow("BUS: Ingester closed the connection.")
+        except Exception as e:
+            print_red(f"BUS ERROR: {e} (retrying in {BUS_RETRY_DELAY_SECONDS:.0f}s)")
+        await asyncio.sleep(BUS_RETRY_DELAY_SECONDS)
+
+async def history_tail_loop():
+    """Feed the ingester's newly appended blocks into this process's rollups"""
+    history = app_state["block_history"]
+    rollups = app_state["rollups"]
+    while True:
+        try:
+            rollups.ingest(history.refresh())
+        except Exception as e:
+            print_red(f"HISTORY ERROR: {e}")
+        await asyncio.sleep(HISTORY_TAIL_INTERVAL_SECONDS)
+
+# ==========================================================
+# === SSE Generators (read from the shared broadcasters)
+# ==========================================================
+async def relay_subscription(request: Request, subscription: Subscription, label: str) -> AsyncGenerator[bytes, None]:
+    """Yield a subscriber's events until it disconnects or is evicted for falling too far behind"""
+    while True:
+        event = await subscription.get()
+        if event is None:
+            print_yellow(f"{label.capitalize()} client evicted after stalling for more than {subscription.broadcaster.max_stall_seconds:.0f}s "
+                         f"({subscription.dropped} events dropped).", category="CONNECTIONS"); break
+        if await request.is_disconnected():
+            print_yellow(f"{label.capitalize()} client disconnected.", category="CONNECTIONS"); break
+        yield event.sse
+
+async def broadcast_stream_generator(request: Request, broadcaster: Broadcaster, label: str) -> AsyncGenerator[bytes, None]:
+    subscription = broadcaster.subscribe()
+    print_info(label, f"Client subscribed. Viewers: {broadcaster.subscriber_count}", category="CONNECTIONS")
+    try:
+        async for event in relay_subscription(request, subscription, label):
+            yield event
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+def cityscape_stream_generator(request: Request) -> AsyncGenerator[bytes, None]:
+    return broadcast_stream_generator(request, app_state["firehose_broadcaster"], "CITYSCAPE")
+
+async def derby_stream_generator(request: Request, session_id: str) -> AsyncGenerator[bytes, None]:
+    session, subscription = DERBY_SESSIONS.subscribe(session_id)
+    print_info("DERBY", f"Client subscribed to session '{session_id}'. Viewers: {session.broadcaster.subscriber_count}", category="CONNECTIONS")
+    try:
+        async for event in relay_subscription(request, subscription, "DERBY"):
+            yield event
+    finally:
+        DERBY_SESSIONS.unsubscribe(session, subscription)
+
+# ==========================================================
+# === Historical firehose replay
+# ==========================================================
+async def prefetch_replay_batches(query: Query, speed: float, batches: asyncio.Queue):
+    """
+    Stream the range with parallel upstream fetches and cut it into playback-sized batches.
+    The bounded queue is the backpressure: when playback falls behind, `put` blocks, the
+    stream stops being drained and HyperSync's own prefetch channel stops growing.
+    """
+    stream = await app_state["data_source"].stream_arrow(query, StreamConfig(
+        concurrency=REPLAY_STREAM_CONCURRENCY,
+        max_num_blocks=REPLAY_MAX_BLOCKS_PER_RESPONSE,
+    ))
+    try:
+        while True:
+            response = await stream.recv()
+            if response is None:
+                break
+            observe_response("replay", response)
+            for blocks, transactions in iter_block_groups(response.data.blocks, response.data.transactions, speed * REPLAY_EVENT_INTERVAL_SECONDS):
+                batch = build_firehose_batch(blocks, transactions, CITYSCAPE_MAX_TRANSACTIONS_PER_EVENT)
+                if len(batch):
+                    await batches.put(batch)
     finally:
-        app_state["derby_connections"].discard(connection_id)
+        await stream.close()
+        await batches.put(None)
+
+async def firehose_replay_generator(request: Request, from_block: int, to_block: int, speed: float,
+                                    release: Callable[[], None]) -> AsyncGenerator[bytes, None]:
+    """
+    Replay [from_block, to_block) in /firehose-stream's payload shape, paced at `speed` times real time.
+    `release` frees the replay slot the endpoint reserved.
+    """
+    print_info("REPLAY", f"Replaying blocks {from_block}-{to_block - 1} at {speed:g}x. Active replays: {app_state['active_replays']}")
+    batches: asyncio.Queue = asyncio.Queue(maxsize=REPLAY_PREFETCH_EVENTS)
+    prefetch_task = asyncio.create_task(prefetch_replay_batches(new_firehose_query(from_block, to_block), speed, batches))
+    ring = new_tps_ring()
+    # Maps chain time onto wall time once the first batch arrives
+    chain_start = wall_start = None
+    events = 0
+    try:
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                break
+            append_batch_to_ring(ring, batch)
+            if chain_start is None:
+                chain_start, wall_start = batch.latest_block_timestamp, time.monotonic()
+            delay = wall_start + (batch.latest_block_timestamp - chain_start) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if await request.is_disconnected():
+                print_yellow("Replay client disconnected."); return
+            events += 1
+            yield f"data: {json.dumps(firehose_payload(batch, ring))}\n\n".encode()
+
+        # Surfaces an upstream error that ended the prefetch early
+        await prefetch_task
+        # A named event, so EventSource.onmessage handlers built for the live stream ignore it
+        yield f"event: end\ndata: {json.dumps({'from_block': from_block, 'to_block': to_block, 'events': events})}\n\n".encode()
+    except Exception as e:
+        print_red(f"REPLAY ERROR: {e}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n".encode()
+    finally:
+        prefetch_task.cancel()
+        release()
+
+# ==========================================================
+# === WebSocket transport (binary frames, see ws_protocol.py)
+# ==========================================================
+async def websocket_pump(websocket: WebSocket, send_lock: asyncio.Lock, subscription: Subscription, stream: str):
+    """Forward one subscription's frames; deltas only follow a frame this socket actually received"""
+    have_base = False
+    while True:
+        previous_seq = subscription.last_delivered_seq
+        event = await subscription.get()
+        if event is None:
+            print_yellow(f"WS client evicted from {stream} after stalling for more than {subscription.broadcaster.max_stall_seconds:.0f}s.", category="CONNECTIONS")
+            async with send_lock:
+                await websocket.send_text(json.dumps({"type": "evicted", "stream": stream}))
+                await websocket.close(code=1013)  # Try again later
+            return
+        contiguous = have_base and subscription.last_delivered_seq == previous_seq + 1
+        frame = event.delta if contiguous and event.delta is not None else event.frame
+        have_base = True
+        async with send_lock:
+            await websocket.send_bytes(frame)
+
+async def websocket_session(websocket: WebSocket):
+    """One socket, any number of firehose/derby subscriptions, driven by JSON control messages"""
+    send_lock = asyncio.Lock()
+    # stream key -> (pump task, cleanup)
+    subscriptions: Dict[str, Tuple[asyncio.Task, Any]] = {}
+
+    async def reply(message: dict):
+        async with send_lock:
+            await websocket.send_text(json.dumps(message))
 
-def print_derby_update(payload: dict, entity_names: List[str]):
+    def stop(key: str):
+        task, cleanup = subscriptions.pop(key)
+        task.cancel()
+        cleanup()
+
+    await reply(hello([window_label(w) for w in TPS_WINDOWS_SECONDS], window_label(TPS_PRIMARY_WINDOW_SECONDS)))
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                op, stream = message["op"], message["stream"]
+            except (ValueError, TypeError, KeyError):
+                await reply({"type": "error", "error": "Expected {\"op\": ..., \"stream\": ...}"}); continue
+
+            if stream == "firehose":
+                key, reply_fields = "firehose", {"stream": "firehose", "channel": FIREHOSE_CHANNEL}
+            elif stream == "derby":
+                session_id = message.get("session", DEFAULT_SESSION)
+                if not isinstance(session_id, str) or not re.match(SESSION_ID_PATTERN, session_id):
+                    await reply({"type": "error", "error": "Invalid session id"}); continue
+                key, reply_fields = f"derby:{session_id}", {"stream": "derby", "session": session_id}
+            else:
+                await reply({"type": "error", "error": f"Unknown stream: {stream}"}); continue
+
+            if op == "subscribe":
+                if key in subscriptions:
+                    continue
+                if stream == "firehose":
+                    broadcaster = app_state["firehose_broadcaster"]
+                    subscription = broadcaster.subscribe()
+                    cleanup = lambda broadcaster=broadcaster, subscription=subscription: broadcaster.unsubscribe(subscription)
+                else:
+                    try:
+                        session, subscription = DERBY_SESSIONS.subscribe(session_id)
+                    except SessionLimitError as e:
+                        await reply({"type": "error", "error": str(e)}); continue
+                    reply_fields["channel"] = session.channel
+                    cleanup = lambda session=session, subscription=subscription: DERBY_SESSIONS.unsubscribe(session, subscription)
+                # Acknowledge before the pump can send the first frame on this channel
+                await reply({"type": "subscribed", **reply_fields})
+                subscriptions[key] = (asyncio.create_task(websocket_pump(websocket, send_lock, subscription, key)), cleanup)
+                print_info("WS", f"Client subscribed to {key}.", category="CONNECTIONS")
+            elif op == "unsubscribe":
+                if key in subscriptions:
+                    stop(key)
+                await reply({"type": "unsubscribed", **reply_fields})
+            else:
+                await reply({"type": "error", "error": f"Unknown op: {op}"})
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was closed by an evicted pump
+        print_yellow("WS client disconnected.", category="CONNECTIONS")
+    finally:
+        for key in list(subscriptions):
+            stop(key)
+
+def render_derby_view(state: Tuple[dict, List[str]]) -> str:
+    """Runs on the log writer thread, once per DERBY_VIEW_INTERVAL_SECONDS at most"""
+    payload, entity_names = state
     report = "\n" + "="*60 + "\n--- PERPETUAL MONAD DERBY (Live Terminal View) ---\n"
     total_tps = 0
     # Sort by the provided entity names to maintain order
@@ -289,32 +889,77 @@ def print_derby_update(payload: dict, entity_names: List[str]):
         tps = data["tps"]
         report += f"{dex_name:<20}: {tps:.2f} TPS\n"; total_tps += tps
     report += "-"*60 + f"\n{'TOTAL':<20}: {total_tps:.2f} TPS\n" + "="*60
-    print_green(report)
+    return f"\033[92m{report}\033[0m"
+
+LOGS.add_view("derby", render_derby_view, DERBY_VIEW_INTERVAL_SECONDS)
 
 # ==========================================================
 # === FastAPI Endpoints
 # ==========================================================
 @app.post("/update-derby-config")
-async def update_derby_config(config_request: UpdateDerbyConfigRequest):
-    global DERBY_TRACKER_CONFIG
-    
+async def update_derby_config(config_request: UpdateDerbyConfigRequest, session: str = SESSION_QUERY):
     new_config = {entity.name: entity.addresses for entity in config_request.entities}
-    
+    try:
+        new_config = DERBY_SESSIONS.validate_config(new_config)
+    except DerbyConfigError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     if not new_config:
-        print_yellow("DERBY_CONFIG: Received empty config. Resetting to default DEX contracts.")
-        DERBY_TRACKER_CONFIG = {name: [address] for name, address in DEX_CONTRACTS.items()}
-    else:
-        DERBY_TRACKER_CONFIG = new_config
+        print_yellow(f"DERBY_CONFIG: Received empty config for session '{session}'. Resetting to default DEX contracts.")
+
+    # Compile once and push to the engine; it switches before its next tick
+    try:
+        snapshot = DERBY_SESSIONS.update_config(session, new_config)
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
-    print_info("DERBY_CONFIG", f"Updated Derby tracker config. Now tracking {len(DERBY_TRACKER_CONFIG)} entities.")
-    # You might want to add validation for addresses here in a real application
-    print_cyan(json.dumps(DERBY_TRACKER_CONFIG, indent=2))
+    if app_state["bus_client"]:
+        # The ingester computes the race; it adopts this version number unless it holds a newer config
+        app_state["bus_client"].send_config(session, new_config, snapshot.version, DERBY_SESSIONS.sessions[session].config_updated_at)
+    print_info("DERBY_CONFIG", f"Updated Derby config for session '{session}' to version {snapshot.version}. Now tracking {len(snapshot.entity_names)} entities.")
+    print_cyan(json.dumps(snapshot.to_config(), indent=2))
 
-    return {"status": "success", "message": "Derby configuration updated."}
+    return {"status": "success", "message": "Derby configuration updated.", "session": session, "version": snapshot.version}
+
+@app.get("/derby-sessions")
+async def derby_sessions_endpoint():
+    return DERBY_SESSIONS.stats()
+
+@app.get("/stream-stats")
+async def stream_stats_endpoint(top: int = QueryParam(default=10, ge=0, le=100)):
+    """Backpressure view of every live stream: drops, evictions and the most lagging subscribers"""
+    derby = [session.broadcaster.stats(top) for session in DERBY_SESSIONS.active_sessions()]
+    return {
+        "firehose": app_state["firehose_broadcaster"].stats(top),
+        "derby": {
+            "subscribers": sum(stats["subscribers"] for stats in derby),
+            "dropped": sum(stats["dropped"] for stats in derby),
+            "evicted": sum(stats["evicted"] for stats in derby),
+            "sessions": sorted(derby, key=lambda stats: stats["max_lag_events"], reverse=True)[:top],
+        },
+        "logging": LOGS.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(METRICS.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "monad-visualizer"}
+    height_watcher = app_state["height_watcher"]
+    bus = app_state["bus_server"] or app_state["bus_client"]
+    return {
+        "status": "healthy",
+        "service": "monad-visualizer",
+        "role": SERVE_ROLE,
+        "data_source": app_state["data_source"].stats() if app_state["data_source"] else None,
+        "chain": height_watcher.stats() if height_watcher else None,
+        "bus": bus.stats() if bus else None,
+        "polling": {
+            "firehose": app_state["firehose_scheduler"].stats(),
+            "derby": app_state["derby_scheduler"].stats(),
+        },
+    }
 
 @app.get("/")
 @app.head("/")  # Add support for HEAD requests
@@ -325,19 +970,112 @@ async def root():
         "endpoints": {
             "health": "/health",
             "firehose_stream": "/firehose-stream",
-            "derby_stream": "/derby-stream"
+            "tps_history": "/tps-history?from=<unix>&to=<unix>&resolution=<seconds>",
+            "tps_rollups": "/tps-rollups?from=<unix>&to=<unix>&max_points=<n>",
+            "firehose_replay": "/firehose-replay?from_block=<n>&to_block=<n>&speed=<x>",
+            "derby_stream": "/derby-stream?session=<id>",
+            "derby_sessions": "/derby-sessions",
+            "stream_stats": "/stream-stats",
+            "metrics": "/metrics",
+            "websocket": "/ws"
         },
         "frontend": "https://monad-viewer-frontend.vercel.app",  # Update this with your actual Vercel URL
         "documentation": "API Documentation coming soon"
     }
 
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    await websocket_session(websocket)
+
 @app.get("/firehose-stream")
 async def firehose_stream_endpoint(request: Request):
     return StreamingResponse(cityscape_stream_generator(request), media_type="text/event-stream")
 
+@app.get("/firehose-replay")
+async def firehose_replay_endpoint(
+    request: Request,
+    from_block: int = QueryParam(..., ge=0),
+    to_block: int = QueryParam(..., gt=0, description="Exclusive"),
+    speed: float = QueryParam(default=10.0, gt=0, le=REPLAY_MAX_SPEED, description="Multiple of real time"),
+):
+    if to_block <= from_block:
+        raise HTTPException(status_code=422, detail="to_block must be greater than from_block")
+    if to_block - from_block > REPLAY_MAX_BLOCKS:
+        raise HTTPException(status_code=422, detail=f"Replay range is limited to {REPLAY_MAX_BLOCKS} blocks")
+    if app_state["active_replays"] >= REPLAY_MAX_CONCURRENT:
+        raise HTTPException(status_code=429, detail=f"Too many concurrent replays ({REPLAY_MAX_CONCURRENT})")
+    # Reserve the slot before responding: counting it once streaming starts let
+    # simultaneous requests all pass the check above
+    app_state["active_replays"] += 1
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            app_state["active_replays"] -= 1
+
+    # The generator releases the slot when it ends; the background task covers a
+    # response whose body was never started (client gone before the first chunk)
+    return StreamingResponse(
+        firehose_replay_generator(request, from_block, to_block, speed, release),
+        media_type="text/event-stream", background=BackgroundTask(release),
+    )
+
+@app.get("/tps-history")
+async def tps_history_endpoint(
+    from_ts: Optional[int] = QueryParam(default=None, alias="from", ge=0, description="Unix seconds, inclusive"),
+    to_ts: Optional[int] = QueryParam(default=None, alias="to", ge=0, description="Unix seconds, exclusive"),
+    resolution: int = QueryParam(default=60, ge=1, description="Bucket size in seconds"),
+):
+    """Per-bucket tx counts, fees, value and average TPS, answered from the on-disk block history"""
+    history = app_state["block_history"]
+    if history is None or history.records == 0:
+        return {"error": "No block history recorded yet"}
+    to_ts = history.last_timestamp + 1 if to_ts is None else to_ts
+    from_ts = to_ts - 3600 if from_ts is None else from_ts
+    if to_ts <= from_ts:
+        raise HTTPException(status_code=422, detail="'to' must be greater than 'from'")
+    if (to_ts - from_ts) / resolution > HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=422, detail=f"At most {HISTORY_MAX_POINTS} buckets per request; increase resolution")
+    return {
+        "from": from_ts,
+        "to": to_ts,
+        "resolution": resolution,
+        "first_recorded": history.first_timestamp,
+        "last_recorded": history.last_timestamp,
+        "buckets": history.aggregate(from_ts, to_ts, resolution),
+    }
+
+@app.get("/tps-rollups")
+async def tps_rollups_endpoint(
+    from_ts: Optional[int] = QueryParam(default=None, alias="from", ge=0, description="Unix seconds, inclusive"),
+    to_ts: Optional[int] = QueryParam(default=None, alias="to", ge=0, description="Unix seconds, exclusive"),
+    max_points: int = QueryParam(default=300, ge=1, le=ROLLUP_MAX_POINTS),
+    resolution: Optional[int] = QueryParam(default=None, description="Force a tier: 1, 60 or 3600 seconds"),
+):
+    """Chart data at any zoom level from pre-aggregated 1 s / 1 min / 1 h buckets"""
+    rollups = app_state["rollups"]
+    if rollups.last_timestamp is None:
+        return {"error": "No rollups available yet"}
+    to_ts = rollups.last_timestamp + 1 if to_ts is None else to_ts
+    from_ts = to_ts - 3600 if from_ts is None else from_ts
+    if to_ts <= from_ts:
+        raise HTTPException(status_code=422, detail="'to' must be greater than 'from'")
+    try:
+        result = rollups.query(from_ts, to_ts, max_points=max_points, resolution=resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"from": from_ts, "to": to_ts, **result, "tiers": rollups.stats()}
+
 @app.get("/derby-stream")
-async def derby_stream_endpoint(request: Request):
-    return StreamingResponse(derby_stream_generator(request), media_type="text/event-stream")
+async def derby_stream_endpoint(request: Request, session: str = SESSION_QUERY):
+    try:
+        DERBY_SESSIONS.get_or_create(session)
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return StreamingResponse(derby_stream_generator(request, session), media_type="text/event-stream")
 
 # Static files are served from Vercel frontend
 
@@ -346,6 +1084,8 @@ async def derby_stream_endpoint(request: Request):
 # ==========================================================
 try:
     from nft_service import get_network_graph_data, nft_network_service
+    # Its pooled HTTP clients are closed at shutdown
+    app_state["nft_service"] = nft_network_service
     
     @app.get("/nft-network-graph")
     async def nft_network_graph_endpoint(
@@ -379,6 +1119,17 @@ try:
         """Legacy endpoint - redirects to network graph"""
         return await nft_network_graph_endpoint(limit, min_shared_holders)
     
+    def collect_nft_metrics():
+        for phase, (done, total) in nft_network_service.build_progress.items():
+            NFT_BUILD_DONE.labels(phase).set(done)
+            NFT_BUILD_TOTAL.labels(phase).set(total)
+        for upstream, limiter in nft_network_service.rate_limits.items():
+            NFT_UPSTREAM_RATE.labels(upstream).set(limiter.rate)
+            NFT_UPSTREAM_THROTTLED.labels(upstream).value = limiter.throttled
+            NFT_UPSTREAM_FAILURES.labels(upstream).value = limiter.failures
+            NFT_UPSTREAM_CIRCUIT_OPEN.labels(upstream).set(0 if limiter.state == "closed" else 1)
+
+    METRICS.add_collector(collect_nft_metrics)
     print_info("SYSTEM", "NFT Network Graph endpoints loaded successfully")
 except ImportError:
     print_yellow("NFT Network service not available - install dependencies with: pip install httpx")
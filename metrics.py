@@ -0,0 +1,179 @@
+import asyncio
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format, version 0.0.4
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+SIZE_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """Fixed buckets; `observe` is one bisect and three additions"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricFamily:
+    """
+    One named metric and its labelled series. Series are created once through `labels`
+    (ideally at import time) and then updated directly by the hot path, without lookups.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        series = self.series.get(values)
+        if series is None:
+            if self.kind == "histogram":
+                series = Histogram(self.buckets)
+            elif self.kind == "counter":
+                series = Counter()
+            else:
+                series = Gauge()
+            self.series[values] = series
+        return series
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, series in self.series.items():
+            if self.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                    cumulative += count
+                    le = 'le="%s"' % _format_value(bound)
+                    yield f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}"
+                yield f"{self.name}_sum{_format_labels(self.label_names, values)} {_format_value(series.sum)}"
+                yield f"{self.name}_count{_format_labels(self.label_names, values)} {series.count}"
+            else:
+                yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(series.value)}"
+
+
+class MetricsRegistry:
+    """
+    All metrics of the process. Values owned by other components (subscriber counts,
+    drop counters, NFT progress) are read by collectors at scrape time, so the code that
+    owns them is not touched on its hot path.
+    """
+
+    def __init__(self):
+        self.families: List[MetricFamily] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def _add(self, family: MetricFamily) -> MetricFamily:
+        self.families.append(family)
+        return family
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> MetricFamily:
+        return self._add(MetricFamily(name, help_text, "counter", label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> MetricFamily:
+        return self._add(MetricFamily(name, help_text, "gauge", label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> MetricFamily:
+        return self._add(MetricFamily(name, help_text, "histogram", label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """`collector` refreshes gauges/counters from their owners right before each scrape"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines: List[str] = []
+        for family in self.families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedClient:
+    """Wraps a HyperSync client (or any chain data source) so every call to `methods` is timed and its failures counted"""
+
+    def __init__(self, client, latency: MetricFamily, errors: MetricFamily,
+                 methods: Sequence[str] = ("get_height", "get", "get_arrow", "stream_arrow")):
+        self._client = client
+        for method in methods:
+            if not hasattr(client, method):
+                continue
+            setattr(self, method, self._wrap(getattr(client, method), latency.labels(method), errors.labels(method)))
+
+    @staticmethod
+    def _wrap(call, histogram: Histogram, errors: Counter):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return timed
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+async def monitor_event_loop_lag(histogram: Histogram, gauge: Optional[Gauge] = None, interval: float = 0.5):
+    """How late the loop wakes a sleeper is how long every other task has been kept waiting"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        histogram.observe(lag)
+        if gauge is not None:
+            gauge.set(lag)
@@ -1,10 +1,42 @@
 import asyncio
 import json
+import os
 import time
 from typing import Dict, List, Any, Optional, Set, Tuple
 from datetime import datetime
 from collections import defaultdict
 import httpx
+import numpy as np
+
+from holder_overlap import overlap_edges
+from holder_store import AddressBook, HolderStore, StoreLockedError
+from rate_limit import AdaptiveRateLimit, CircuitOpenError
+
+try:
+    import h2  # noqa: F401  (httpx only speaks HTTP/2 when the h2 package is installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Connection pool sizes per upstream; requests beyond max_connections wait for a free connection
+MAGIC_EDEN_MAX_CONNECTIONS = int(os.getenv("MAGIC_EDEN_MAX_CONNECTIONS", 4))
+ALCHEMY_MAX_CONNECTIONS = int(os.getenv("ALCHEMY_MAX_CONNECTIONS", 16))
+NFT_KEEPALIVE_SECONDS = float(os.getenv("NFT_KEEPALIVE_SECONDS", 60))
+# Request budgets per upstream, shared by every concurrent pagination. Each starts at the
+# first value and adapts to what the upstream accepts, up to the *_MAX_* ceiling
+MAGIC_EDEN_REQUESTS_PER_SECOND = float(os.getenv("MAGIC_EDEN_REQUESTS_PER_SECOND", 2))
+MAGIC_EDEN_MAX_REQUESTS_PER_SECOND = float(os.getenv("MAGIC_EDEN_MAX_REQUESTS_PER_SECOND", 8))
+ALCHEMY_REQUESTS_PER_SECOND = float(os.getenv("ALCHEMY_REQUESTS_PER_SECOND", 10))
+ALCHEMY_MAX_REQUESTS_PER_SECOND = float(os.getenv("ALCHEMY_MAX_REQUESTS_PER_SECOND", 40))
+# Attempts per request when the upstream answers 429/5xx or the connection fails
+NFT_REQUEST_ATTEMPTS = int(os.getenv("NFT_REQUEST_ATTEMPTS", 5))
+# How long a request waits for an open circuit breaker to close before giving up
+NFT_CIRCUIT_WAIT_SECONDS = float(os.getenv("NFT_CIRCUIT_WAIT_SECONDS", 900))
+# Collections whose holder pages are fetched at the same time during a graph build
+HOLDER_FETCH_CONCURRENCY = int(os.getenv("HOLDER_FETCH_CONCURRENCY", 16))
+# Holder sets persist here between runs (empty disables) and are refetched after the TTL
+HOLDER_STORE_DIR = os.getenv("HOLDER_STORE_DIR", "data/holders")
+HOLDER_TTL_SECONDS = float(os.getenv("HOLDER_TTL_SECONDS", 24 * 3600))
 
 class NFTNetworkService:
     """
@@ -29,8 +61,100 @@ class NFTNetworkService:
         # Cache for expensive operations
         self.collections_cache = None
         self.holder_overlap_cache = {}
-        self.holders_cache = {}  # Cache holders to avoid repeated API calls
+        # Holders per collection as sorted uint32 ids into self.address_book, not sets of strings
+        self.holders_cache: Dict[str, np.ndarray] = {}  # Cache holders to avoid repeated API calls
+        # Collections whose last holder fetch failed or stopped early; their holders are incomplete
+        self.holder_fetch_failures: Set[str] = set()
+        self._holder_store: Optional[HolderStore] = None
+        # Set when another process holds the store; this one then keeps holders in memory only
+        self._holder_store_locked = False
+        self._address_book: Optional[AddressBook] = None
+        # Progress of the current/last build_network_graph run, read by /metrics
+        self.build_progress = {"holders": [0, 0], "connections": [0, 0]}
         
+        # One keep-alive client per upstream, created on first use and closed from the app lifespan
+        self.max_connections = {"magic_eden": MAGIC_EDEN_MAX_CONNECTIONS, "alchemy": ALCHEMY_MAX_CONNECTIONS}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self.rate_limits = {
+            "magic_eden": AdaptiveRateLimit(MAGIC_EDEN_REQUESTS_PER_SECOND, max_rate=MAGIC_EDEN_MAX_REQUESTS_PER_SECOND),
+            "alchemy": AdaptiveRateLimit(ALCHEMY_REQUESTS_PER_SECOND, max_rate=ALCHEMY_MAX_REQUESTS_PER_SECOND),
+        }
+        
+    def _client(self, upstream: str) -> httpx.AsyncClient:
+        """Shared pooled client for one upstream ("magic_eden" or "alchemy")"""
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            limit = self.max_connections[upstream]
+            client = self._clients[upstream] = httpx.AsyncClient(
+                headers=self.alchemy_headers if upstream == "alchemy" else self.headers,
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit, keepalive_expiry=NFT_KEEPALIVE_SECONDS),
+                http2=HTTP2_AVAILABLE,
+            )
+        return client
+    
+    async def _get(self, upstream: str, url: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """
+        GET through the upstream's pooled client, once its rate limit allows another request.
+        429s, 5xx and connection errors are retried (the rate limit backs off and honours
+        Retry-After in between); the last response is returned when attempts run out.
+        While the upstream's circuit is open the request waits for it to close, and raises
+        CircuitOpenError only if that takes longer than NFT_CIRCUIT_WAIT_SECONDS.
+        """
+        limiter = self.rate_limits[upstream]
+        deadline = time.monotonic() + NFT_CIRCUIT_WAIT_SECONDS
+        for attempt in range(1, NFT_REQUEST_ATTEMPTS + 1):
+            while True:
+                try:
+                    await limiter.acquire()
+                    break
+                except CircuitOpenError:
+                    if not await limiter.wait_for_circuit(deadline - time.monotonic()):
+                        raise
+            try:
+                response = await self._client(upstream).get(url, params=params)
+            except httpx.TransportError:
+                limiter.on_error()
+                if attempt == NFT_REQUEST_ATTEMPTS:
+                    raise
+                continue
+            wait = limiter.on_response(response.status_code, response.headers)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if attempt < NFT_REQUEST_ATTEMPTS:
+                print(f"⚠️  {upstream} returned {response.status_code}, now at {limiter.rate:.2f} req/sec"
+                      + (f", waiting {wait:.0f}s as asked" if wait else ""))
+        return response
+    
+    @property
+    def holder_store(self) -> Optional[HolderStore]:
+        """On-disk holder sets, opened on first use; None while another process has them open"""
+        if self._holder_store is None and HOLDER_STORE_DIR and not self._holder_store_locked:
+            try:
+                self._holder_store = HolderStore(HOLDER_STORE_DIR, ttl_seconds=HOLDER_TTL_SECONDS)
+            except StoreLockedError as e:
+                print(f"⚠️  {e}; holders will be fetched and kept in memory only")
+                self._holder_store_locked = True
+        return self._holder_store
+    
+    @property
+    def address_book(self) -> AddressBook:
+        """Address <-> id mapping for holder arrays; the holder store's when there is one, so ids match"""
+        if self.holder_store is not None:
+            return self.holder_store.address_book
+        if self._address_book is None:
+            self._address_book = AddressBook()
+        return self._address_book
+    
+    async def close(self):
+        """Close the pooled connections and the holder store"""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+        if self._holder_store is not None:
+            self._holder_store.close()
+            self._holder_store = None
+    
     async def get_top_collections(self, limit: int = 1000) -> List[Dict]:
         """
         Fetch top collections by 30-day volume with pagination
@@ -60,36 +184,25 @@ class NFTNetworkService:
                 if continuation_token:
                     params["continuation"] = continuation_token
                 
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.get(url, params=params, headers=self.headers)
-                    
-                    # Handle rate limiting (429 Too Many Requests)
-                    if response.status_code == 429:
-                        print("⚠️  Rate limit hit, waiting 60 seconds...")
-                        await asyncio.sleep(60)
-                        continue
-                    
-                    response.raise_for_status()
-                    
-                    data = response.json()
-                    new_collections = data.get('collections', [])
-                    
-                    if not new_collections:
-                        print("No more collections found")
-                        break
-                    
-                    all_collections.extend(new_collections)
-                    continuation_token = data.get('continuation')
-                    
-                    print(f"📊 Fetched {len(all_collections)} collections so far... (Rate: 1 req/sec)")
-                    
-                    if not continuation_token:
-                        print("Reached end of collections list")
-                        break
-                    
-                    # Rate limiting: Magic Eden API - 1.5 seconds between requests
-                    await asyncio.sleep(1.5)
-                    
+                response = await self._get("magic_eden", url, params)
+                response.raise_for_status()
+                
+                data = response.json()
+                new_collections = data.get('collections', [])
+                
+                if not new_collections:
+                    print("No more collections found")
+                    break
+                
+                all_collections.extend(new_collections)
+                continuation_token = data.get('continuation')
+                
+                print(f"📊 Fetched {len(all_collections)} collections so far... (Rate: {self.rate_limits['magic_eden'].rate:g} req/sec)")
+                
+                if not continuation_token:
+                    print("Reached end of collections list")
+                    break
+                
         except Exception as e:
             print(f"❌ Error fetching collections: {e}")
             return []
@@ -107,18 +220,28 @@ class NFTNetworkService:
         
         return self.collections_cache
     
-    async def get_collection_holders(self, collection_id: str) -> Set[str]:
+    async def get_collection_holders(self, collection_id: str) -> np.ndarray:
         """
-        Get real holders for a specific collection using Alchemy API
+        Get real holders for a specific collection using Alchemy API, as sorted uint32
+        address ids (see `address_book`); each page is interned as it arrives
         """
-        # Check cache first
-        if collection_id in self.holders_cache:
+        # Check cache first, then the holder store; either only while the stored copy is fresh
+        store = self.holder_store
+        if collection_id in self.holders_cache and (store is None or store.is_fresh(collection_id)):
+            self.holder_fetch_failures.discard(collection_id)
             return self.holders_cache[collection_id]
+        if store is not None:
+            holders = store.get_ids(collection_id)
+            if holders is not None:
+                self.holders_cache[collection_id] = holders
+                self.holder_fetch_failures.discard(collection_id)
+                return holders
         
         print(f"🔍 Fetching holders for collection {collection_id[:10]}...")
         
-        holders = set()
+        pages = []
         page_key = None
+        complete = False
         
         try:
             while True:
@@ -132,67 +255,59 @@ class NFTNetworkService:
                 if page_key:
                     params["pageKey"] = page_key
                 
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.get(url, params=params, headers=self.alchemy_headers)
-                    
-                    # Handle rate limiting
-                    if response.status_code == 429:
-                        print("⚠️  Alchemy rate limit hit, waiting 60 seconds...")
-                        await asyncio.sleep(60)
-                        continue
-                    
-                    if response.status_code != 200:
-                        print(f"⚠️  Alchemy API error {response.status_code} for {collection_id[:10]}")
-                        break
-                    
-                    data = response.json()
-                    owners = data.get('owners', [])
-                    
-                    if not owners:
-                        break
-                    
-                    # Process owners - Alchemy returns array of address strings
-                    for owner in owners:
-                        if isinstance(owner, str) and owner.startswith('0x'):
-                            holders.add(owner.lower())
-                        elif isinstance(owner, dict) and 'ownerAddress' in owner:
-                            # Fallback for different response format
-                            owner_address = owner.get('ownerAddress')
-                            if owner_address and owner_address.startswith('0x'):
-                                holders.add(owner_address.lower())
-                    
-                    # Check for pagination
-                    page_key = data.get('pageKey')
-                    if not page_key:
-                        break
-                    
-                    # Rate limiting: Alchemy API - 1.5 seconds between requests
-                    await asyncio.sleep(1.5)
-                    
+                response = await self._get("alchemy", url, params)
+                
+                if response.status_code != 200:
+                    print(f"⚠️  Alchemy API error {response.status_code} for {collection_id[:10]}")
+                    break
+                
+                data = response.json()
+                owners = data.get('owners', [])
+                
+                if not owners:
+                    complete = True
+                    break
+                
+                # Process owners - Alchemy returns array of address strings
+                addresses = []
+                for owner in owners:
+                    if isinstance(owner, str) and owner.startswith('0x'):
+                        addresses.append(owner)
+                    elif isinstance(owner, dict) and 'ownerAddress' in owner:
+                        # Fallback for different response format
+                        owner_address = owner.get('ownerAddress')
+                        if owner_address and owner_address.startswith('0x'):
+                            addresses.append(owner_address)
+                pages.append(self.address_book.intern(addresses))
+                
+                # Check for pagination
+                page_key = data.get('pageKey')
+                if not page_key:
+                    complete = True
+                    break
+                
+        except CircuitOpenError as e:
+            print(f"⏸️  Gave up on holders for {collection_id[:10]}: {e}")
+            pages = []
         except Exception as e:
             print(f"❌ Error fetching holders for {collection_id[:10]}: {e}")
             # Return empty set if API fails - better than mock data for real analysis
-            holders = set()
+            pages = []
+        
+        holders = np.unique(np.concatenate(pages)) if pages else np.zeros(0, dtype=np.uint32)
         
-        # Cache the results
-        self.holders_cache[collection_id] = holders
+        # Cache the results; failed fetches are retried by the next build
+        if complete:
+            self.holders_cache[collection_id] = holders
+            self.holder_fetch_failures.discard(collection_id)
+            if store is not None:
+                store.put_ids(collection_id, holders)
+        else:
+            self.holder_fetch_failures.add(collection_id)
         print(f"✅ Found {len(holders)} real holders for {collection_id[:10]}")
         
         return holders
     
-    def calculate_holder_overlap(self, holders1: Set[str], holders2: Set[str]) -> Dict[str, int]:
-        """
-        Calculate overlap between two sets of holders
-        """
-        intersection = holders1.intersection(holders2)
-        
-        return {
-            "shared_holders": len(intersection),
-            "total_holders_1": len(holders1),
-            "total_holders_2": len(holders2),
-            "overlap_percentage": (len(intersection) / min(len(holders1), len(holders2))) * 100 if holders1 and holders2 else 0
-        }
-    
     async def build_network_graph(self, collections: List[Dict], min_shared_holders: int = 10) -> Dict:
         """
         Build network graph data with nodes and edges
@@ -204,11 +319,26 @@ class NFTNetworkService:
         nodes = []
         collection_holders = {}
         
-        # Get holders for each collection using real Alchemy API data
-        print("🔍 Fetching real holder data from Alchemy API...")
-        for i, collection in enumerate(collections):
+        # Get holders for each collection using real Alchemy API data; several collections
+        # paginate at once and the Alchemy token bucket keeps the total at our request budget
+        if self.holder_store is not None:
+            stale = len(self.holder_store.stale(collection['id'] for collection in collections))
+            print(f"💾 {len(collections) - stale} collections have fresh holders on disk, {stale} to fetch")
+        print(f"🔍 Fetching real holder data from Alchemy API ({HOLDER_FETCH_CONCURRENCY} collections at a time)...")
+        self.build_progress = {"holders": [0, len(collections)], "connections": [0, len(collections) * (len(collections) - 1) // 2]}
+        semaphore = asyncio.Semaphore(HOLDER_FETCH_CONCURRENCY)
+        
+        async def fetch_holders(collection_id: str) -> np.ndarray:
+            async with semaphore:
+                holders = await self.get_collection_holders(collection_id)
+            self.build_progress["holders"][0] += 1
+            return holders
+        
+        all_holders = await asyncio.gather(*(fetch_holders(collection['id']) for collection in collections))
+        failed = [collection['id'] for collection in collections if collection['id'] in self.holder_fetch_failures]
+        
+        for i, (collection, holders) in enumerate(zip(collections, all_holders)):
             collection_id = collection['id']
-            holders = await self.get_collection_holders(collection_id)
             collection_holders[collection_id] = holders
             
             # Calculate node size based on total holders
@@ -216,7 +346,8 @@ class NFTNetworkService:
             
             # Skip collections with no holders (API failed or truly empty)
             if node_size == 0:
-                print(f"⚠️  Skipping {collection.get('name', 'Unknown')} - no holders found")
+                reason = "holder fetch failed" if collection_id in self.holder_fetch_failures else "no holders found"
+                print(f"⚠️  Skipping {collection.get('name', 'Unknown')} - {reason}")
                 continue
             
             node = {
@@ -240,34 +371,26 @@ class NFTNetworkService:
                 print(f"📈 Processed {i + 1}/{len(collections)} collections (fetched {node_size} holders)...")
         
         # Calculate edges (connections between collections)
+        # Every pair's shared-holder count comes from one sparse product of the
+        # collection x holder incidence matrix with its transpose
         print("🔗 Calculating connections between collections...")
-        edges = []
-        total_comparisons = len(collections) * (len(collections) - 1) // 2
-        comparisons_done = 0
+        ids = [collection['id'] for collection in collections]
         
-        for i, collection1 in enumerate(collections):
-            for j, collection2 in enumerate(collections[i+1:], i+1):
-                id1, id2 = collection1['id'], collection2['id']
-                
-                holders1 = collection_holders[id1]
-                holders2 = collection_holders[id2]
-                
-                overlap = self.calculate_holder_overlap(holders1, holders2)
-                
-                if overlap['shared_holders'] >= min_shared_holders:
-                    edge = {
-                        "source": id1,
-                        "target": id2,
-                        "weight": overlap['shared_holders'],
-                        "overlap_percentage": overlap['overlap_percentage']
-                    }
-                    edges.append(edge)
-                
-                comparisons_done += 1
-                if comparisons_done % 1000 == 0:
-                    progress = (comparisons_done / total_comparisons) * 100
-                    print(f"🔍 Connection analysis: {progress:.1f}% complete ({comparisons_done}/{total_comparisons})")
+        def on_progress(done: int, total: int):
+            self.build_progress["connections"][0] = done
+            print(f"🔍 Connection analysis: {(done / max(total, 1)) * 100:.1f}% complete ({done}/{total})")
         
+        sources, targets, shared = overlap_edges(
+            [collection_holders[collection_id] for collection_id in ids], min_shared_holders, on_progress=on_progress
+        )
+        sizes = np.array([len(collection_holders[collection_id]) for collection_id in ids], dtype=np.int64)
+        percentages = shared / np.minimum(sizes[sources], sizes[targets]) * 100 if len(shared) else np.zeros(0)
+        edges = [
+            {"source": ids[i], "target": ids[j], "weight": weight, "overlap_percentage": percentage}
+            for i, j, weight, percentage in zip(sources.tolist(), targets.tolist(), shared.tolist(), percentages.tolist())
+        ]
+        self.build_progress["connections"][0] = self.build_progress["connections"][1]
+
         # Update node sizes based on degree (number of connections)
         node_degrees = defaultdict(int)
         for edge in edges:
@@ -280,7 +403,10 @@ class NFTNetworkService:
             node['influence'] = influence
             node['size'] = min(max(influence / 50, 5), 50)  # Normalize based on influence
         
-        print(f"✅ Network graph complete: {len(nodes)} nodes, {len(edges)} edges")
+        if failed:
+            print(f"⚠️  Network graph is PARTIAL: holders of {len(failed)}/{len(collections)} collections could not be fetched")
+        else:
+            print(f"✅ Network graph complete: {len(nodes)} nodes, {len(edges)} edges")
         
         return {
             "nodes": nodes,
@@ -290,7 +416,10 @@ class NFTNetworkService:
                 "total_connections": len(edges),
                 "min_shared_holders": min_shared_holders,
                 "avg_connections_per_collection": len(edges) * 2 / len(nodes) if nodes else 0
-            }
+            },
+            # Collections left out or undercounted because their holders could not be fetched
+            "partial": bool(failed),
+            "failed_collections": failed,
         }
     
     def _extract_floor_price(self, collection: Dict) -> float:
@@ -319,21 +448,12 @@ class NFTNetworkService:
         # If not in cache, fetch individually
         try:
             url = f"{self.base_url}/collections/{collection_id}/v7"
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, headers=self.headers)
-                
-                # Handle rate limiting (429 Too Many Requests)
-                if response.status_code == 429:
-                    print("⚠️  Rate limit hit for collection details, waiting 60 seconds...")
-                    await asyncio.sleep(60)
-                    # Retry the request
-                    response = await client.get(url, headers=self.headers)
-                
-                response.raise_for_status()
-                
-                collection = response.json()
-                return self._format_collection_details(collection)
-                
+            response = await self._get("magic_eden", url)
+            response.raise_for_status()
+            
+            collection = response.json()
+            return self._format_collection_details(collection)
+            
         except Exception as e:
             print(f"❌ Error fetching collection details: {e}")
             return {}
@@ -393,6 +513,7 @@ async def get_network_graph_data(limit: int = 1000, min_shared_holders: int = 10
             "generated_at": datetime.now().isoformat(),
             "data_source": "magic_eden_api",
             "collections_analyzed": len(collections),
+            "partial": graph_data["partial"],
             "parameters": {
                 "limit": limit,
                 "min_shared_holders": min_shared_holders
@@ -406,7 +527,10 @@ async def test_network_service():
     print("🧪 Testing NFT Network Service...")
     
     # Test with small dataset first
-    data = await get_network_graph_data(limit=20, min_shared_holders=5)
+    try:
+        data = await get_network_graph_data(limit=20, min_shared_holders=5)
+    finally:
+        await nft_network_service.close()
     
     if "error" in data:
         print(f"❌ Error: {data['error']}")
@@ -0,0 +1,84 @@
+import random
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+MODE_TIP = "tip"
+MODE_CATCH_UP = "catch-up"
+MODE_BACKOFF = "backoff"
+MODE_ERROR = "error"
+
+
+class PollScheduler:
+    """
+    Decides how long an ingestion loop sleeps before its next tick.
+    The block interval is estimated from the chain timestamps the loop observes. At the tip
+    the next tick lands right after the `blocks_per_poll`-th expected block; when behind
+    there is no wait at all (catch-up); when a poll finds nothing new or upstream fails,
+    the delay grows exponentially with jitter up to `max_delay`.
+    """
+
+    def __init__(self, blocks_per_poll: int = 1, default_block_interval: float = 0.5, min_delay: float = 0.05,
+                 max_delay: float = 30.0, error_base_delay: float = 1.0, jitter: float = 0.2, history: int = 256):
+        self.blocks_per_poll = blocks_per_poll
+        self.default_block_interval = default_block_interval
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.error_base_delay = error_base_delay
+        self.jitter = jitter
+        # (block number, chain timestamp) of the newest block seen on each productive tick
+        self.observed: deque = deque(maxlen=history)
+        self.tip_seen_at: Optional[float] = None
+        self.empty_streak = 0
+        self.error_streak = 0
+        self.mode = MODE_TIP
+
+    def observe(self, block_number: int, timestamp: int):
+        """Record the newest block of a batch; a new tip also restarts the wall-clock schedule"""
+        if self.observed and block_number <= self.observed[-1][0]:
+            return
+        self.observed.append((block_number, timestamp))
+        self.tip_seen_at = time.monotonic()
+
+    @property
+    def block_interval(self) -> float:
+        """Average seconds per block over the observed history (timestamps only have 1 s resolution)"""
+        if len(self.observed) >= 2:
+            (first_block, first_ts), (last_block, last_ts) = self.observed[0], self.observed[-1]
+            if last_ts > first_ts:
+                return (last_ts - first_ts) / (last_block - first_block)
+        return self.default_block_interval
+
+    def _jittered(self, delay: float) -> float:
+        return min(self.max_delay, delay) * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_delay(self, got_new: bool, behind: bool = False) -> float:
+        """Delay after a successful tick: `got_new` if it made progress, `behind` if the tip is still ahead"""
+        self.error_streak = 0
+        if behind:
+            self.empty_streak = 0
+            self.mode = MODE_CATCH_UP
+            return 0.0
+        if got_new:
+            self.empty_streak = 0
+            self.mode = MODE_TIP
+            due = (self.tip_seen_at or time.monotonic()) + self.blocks_per_poll * self.block_interval
+            return min(self.max_delay, max(self.min_delay, due - time.monotonic()))
+        # Nothing new yet: the block is late or the chain has stalled
+        self.empty_streak += 1
+        self.mode = MODE_BACKOFF
+        return max(self.min_delay, self._jittered(self.block_interval * 2 ** min(self.empty_streak - 1, 16)))
+
+    def on_error(self) -> float:
+        self.error_streak += 1
+        self.mode = MODE_ERROR
+        return self._jittered(self.error_base_delay * 2 ** min(self.error_streak - 1, 16))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "block_interval_seconds": round(self.block_interval, 4),
+            "blocks_per_poll": self.blocks_per_poll,
+            "empty_streak": self.empty_streak,
+            "error_streak": self.error_streak,
+        }
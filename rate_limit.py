@@ -0,0 +1,240 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+
+class TokenBucket:
+    """
+    Requests-per-second budget shared by every coroutine calling one upstream.
+    `acquire()` waits until a token is available; waiters are served in arrival order
+    (asyncio.Lock is FIFO), so concurrent paginations share the rate fairly. `pause()`
+    holds every waiter back until a given time, then resumes from an empty bucket.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                    self.tokens = 0.0
+                    self.updated_at = self.paused_until
+                else:
+                    self._refill()
+                    if self.tokens >= 1:
+                        break
+                    # The rate may change while we sleep, so recheck rather than assume a token
+                    wait = (1 - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+            self.tokens -= 1
+            self.acquired += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "burst": self.burst, "acquired": self.acquired, "waited_seconds": round(self.waited_seconds, 3)}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while an upstream's circuit breaker is open"""
+
+
+def retry_after_seconds(headers, now: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds the server asked us to wait: `Retry-After` (delay or HTTP date), or, once the
+    window's budget is spent, the `X-RateLimit-Reset` / `RateLimit-Reset` of the window
+    (a delay, or a Unix timestamp when it is that large)
+    """
+    now = time.time() if now is None else now
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    for prefix in ("x-ratelimit-", "ratelimit-"):
+        remaining, reset = headers.get(prefix + "remaining"), headers.get(prefix + "reset")
+        if remaining is None or reset is None:
+            continue
+        try:
+            if float(remaining) > 0:
+                return None
+            reset = float(reset)
+        except ValueError:
+            continue
+        return max(0.0, reset - now if reset > 1e9 else reset)
+    return None
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class AdaptiveRateLimit(TokenBucket):
+    """
+    Token bucket whose rate follows what the upstream accepts (AIMD): every successful
+    response adds `increase` requests/s spread over a second's worth of requests, and a
+    429 or 5xx multiplies the rate by `decrease` (at most once per `cooldown`, so one
+    burst of rejections counts once). `Retry-After` / exhausted rate-limit headers pause
+    every caller until the given time.
+
+    `failure_threshold` consecutive 5xx/transport failures open the circuit: `acquire()`
+    fails fast with CircuitOpenError for `open_seconds` (doubling on each reopen, up to
+    `max_open_seconds`), then a single probe is let through and its outcome closes or
+    reopens the circuit. Callers that would rather wait out an outage than fail use
+    `wait_for_circuit()` between attempts.
+    """
+
+    def __init__(self, rate: float, min_rate: float = 0.1, max_rate: Optional[float] = None, increase: float = 0.5,
+                 decrease: float = 0.5, cooldown: float = 1.0, failure_threshold: int = 5, open_seconds: float = 15.0,
+                 max_open_seconds: float = 300.0):
+        super().__init__(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else rate * 4
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.probe_at = 0.0
+        self.decreased_at = 0.0
+        self.throttled = 0
+        self.failures = 0
+        self.circuit_opened = 0
+        self._state_changed = asyncio.Event()
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            changed, self._state_changed = self._state_changed, asyncio.Event()
+            changed.set()
+
+    async def wait_for_circuit(self, timeout: Optional[float] = None) -> bool:
+        """
+        Sleep until the circuit may admit a request: the open period has run out, or the
+        probe has reported. Returns False if `timeout` passed first. A caller that then
+        loses the race to become the probe gets CircuitOpenError from `acquire()` and
+        waits again.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.state != CLOSED:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return False
+            if self.state == OPEN:
+                if now >= self.opened_until:
+                    return True
+                wait = self.opened_until - now
+            else:
+                # A probe is in flight; it either reports or is replaced after open_seconds
+                wait = max(0.0, self.probe_at + self.open_seconds - now)
+                if wait == 0:
+                    return True
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+            changed = self._state_changed
+            try:
+                await asyncio.wait_for(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    def _set_rate(self, rate: float):
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+        self.burst = max(1.0, self.rate)
+        self.tokens = min(self.tokens, self.burst)
+
+    async def acquire(self):
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now < self.opened_until:
+                raise CircuitOpenError(f"Upstream unavailable, retrying in {self.opened_until - now:.1f}s")
+            self._set_state(HALF_OPEN)
+            self.probe_at = now
+        elif self.state == HALF_OPEN:
+            # One probe at a time decides whether the upstream is back; a probe that never
+            # reported (its caller was cancelled) is replaced after `open_seconds`
+            if now - self.probe_at < self.open_seconds:
+                raise CircuitOpenError("Upstream unavailable, waiting for the probe request")
+            self.probe_at = now
+        await super().acquire()
+
+    def _back_off(self, now: float):
+        if now - self.decreased_at >= self.cooldown:
+            self.decreased_at = now
+            self._set_rate(self.rate * self.decrease)
+
+    def _failed(self, now: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._back_off(now)
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state == HALF_OPEN:
+                self.open_seconds = min(self.max_open_seconds, self.open_seconds * 2)
+            self.opened_until = now + self.open_seconds
+            self.circuit_opened += 1
+            self._set_state(OPEN)
+
+    def on_response(self, status_code: int, headers) -> Optional[float]:
+        """Record one response; returns the server-requested wait, if any"""
+        now = time.monotonic()
+        wait = retry_after_seconds(headers)
+        if wait:
+            self.pause(wait)
+        if status_code == 429:
+            self.throttled += 1
+            self._back_off(now)
+            if self.state == HALF_OPEN:
+                # Throttled, but up: the circuit is for outages, not rate limits
+                self._set_state(CLOSED)
+        elif status_code >= 500:
+            self._failed(now)
+        else:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.open_seconds = self.base_open_seconds
+                self._set_state(CLOSED)
+            self._set_rate(self.rate + self.increase / max(self.rate, 1.0))
+        return wait
+
+    def on_error(self):
+        """Record a request that got no response (connection refused, timeout...)"""
+        self._failed(time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "rate": round(self.rate, 3),
+            "state": self.state,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "circuit_opened": self.circuit_opened,
+            "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 3),
+        }
@@ -0,0 +1,243 @@
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# One pre-aggregated bucket. tps_min/tps_max are taken over the finer buckets that were
+# folded into it, a finer bucket missing from its span (no blocks) counting as 0 TPS; at
+# the finest tier they equal the bucket's own average rate. `filled` is how many finer
+# rows (blocks, at the finest tier) were folded in.
+ROLLUP_DTYPE = np.dtype([
+    ("start", "<i8"),
+    ("blocks", "<i8"),
+    ("tx_count", "<i8"),
+    ("fee_sum", "<f8"),
+    ("value_sum", "<f8"),
+    ("tps_min", "<f8"),
+    ("tps_max", "<f8"),
+    ("filled", "<i8"),
+])
+_SUMMED = ("blocks", "tx_count", "fee_sum", "value_sum")
+
+# (resolution seconds, retained buckets): 1 s for an hour, 1 min for a week, 1 h for a year
+DEFAULT_TIERS: Tuple[Tuple[int, int], ...] = ((1, 3600), (60, 7 * 24 * 60), (3600, 366 * 24))
+
+
+def group_rows(rows: np.ndarray, resolution: int) -> np.ndarray:
+    """Fold time-ordered rows into buckets of `resolution` seconds"""
+    starts = rows["start"] // resolution * resolution
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    grouped = np.zeros(len(first), dtype=ROLLUP_DTYPE)
+    grouped["start"] = starts[first]
+    for name in _SUMMED:
+        grouped[name] = np.add.reduceat(rows[name], first)
+    grouped["tps_min"] = np.minimum.reduceat(rows["tps_min"], first)
+    grouped["tps_max"] = np.maximum.reduceat(rows["tps_max"], first)
+    grouped["filled"] = np.diff(np.r_[first, len(rows)])
+    return grouped
+
+
+def zero_gaps(grouped: np.ndarray, resolution: int, row_resolution: int, first: int, last: int):
+    """
+    Lower tps_min to 0 in buckets missing some of their `row_resolution` rows between row
+    starts `first` and `last` (the span the rows could have covered): seconds with no
+    blocks have no row, and their rate is 0.
+    """
+    lo = np.maximum(grouped["start"], first)
+    hi = np.minimum(grouped["start"] + resolution - row_resolution, last)
+    expected = np.maximum(0, (hi - lo) // row_resolution + 1)
+    grouped["tps_min"][grouped["filled"] < expected] = 0
+
+
+def covered_seconds(starts: np.ndarray, resolution: int, first: int, end: int) -> np.ndarray:
+    """Seconds of each bucket inside [first, end), the span there is data for; at least 1"""
+    return np.maximum(1, np.minimum(starts + resolution, end) - np.maximum(starts, first))
+
+
+def block_rows(records: np.ndarray) -> np.ndarray:
+    """Per-block history records (block_history.RECORD_DTYPE) as one-block rollup rows"""
+    rows = np.zeros(len(records), dtype=ROLLUP_DTYPE)
+    rows["start"] = records["timestamp"]
+    rows["blocks"] = 1
+    rows["tx_count"] = records["tx_count"]
+    rows["fee_sum"] = records["fee_sum"]
+    rows["value_sum"] = records["value_sum"]
+    return rows
+
+
+class RollupTier:
+    """
+    Fixed-capacity circular buffer of closed buckets at one resolution, plus the one
+    bucket still being filled. Only closed buckets are handed to the next, coarser tier,
+    so its min/max TPS are always taken over complete buckets.
+    """
+
+    def __init__(self, resolution: int, retention: int, finest: bool = False, row_resolution: int = 1):
+        self.resolution = resolution
+        self.retention = retention
+        # The finest tier derives its TPS from its own tx count instead of from finer rows
+        self.finest = finest
+        # Resolution of the rows merged in, and the first and newest of their starts
+        self.row_resolution = row_resolution
+        self.first_row_start: Optional[int] = None
+        self.last_row_start: Optional[int] = None
+        self.buckets = np.zeros(retention, dtype=ROLLUP_DTYPE)
+        self.size = 0
+        self.end = 0  # next write position
+        self.open: Optional[np.ndarray] = None
+
+    def merge(self, rows: np.ndarray) -> np.ndarray:
+        """Fold finer, time-ordered rows in; returns the buckets this closed"""
+        if len(rows) == 0:
+            return rows[:0]
+        if self.first_row_start is None:
+            self.first_row_start = int(rows["start"][0])
+        self.last_row_start = max(self.last_row_start or 0, int(rows["start"][-1]))
+        grouped = group_rows(rows, self.resolution)
+        if self.open is not None:
+            if grouped["start"][0] == self.open["start"][0]:
+                for name in _SUMMED + ("filled",):
+                    grouped[name][0] += self.open[name][0]
+                grouped["tps_min"][0] = min(grouped["tps_min"][0], self.open["tps_min"][0])
+                grouped["tps_max"][0] = max(grouped["tps_max"][0], self.open["tps_max"][0])
+            elif grouped["start"][0] > self.open["start"][0]:
+                grouped = np.concatenate((self.open, grouped))
+            else:
+                # Rows older than the open bucket can only come from a replayed range; drop them
+                rows = rows[rows["start"] >= self.open["start"][0]]
+                return self.merge(rows) if len(rows) else rows
+        return self.merge_grouped(grouped)
+
+    def merge_grouped(self, grouped: np.ndarray) -> np.ndarray:
+        if self.finest:
+            grouped["tps_min"] = grouped["tps_max"] = grouped["tx_count"] / self.resolution
+        else:
+            # Rows arrive in time order, so any missing up to the newest one never will
+            zero_gaps(grouped, self.resolution, self.row_resolution, self.first_row_start, self.last_row_start)
+        closed, self.open = grouped[:-1], grouped[-1:].copy()
+        self._store(closed)
+        return closed
+
+    def _store(self, rows: np.ndarray):
+        if len(rows) >= self.retention:
+            rows = rows[-self.retention:]
+        positions = (self.end + np.arange(len(rows))) % self.retention
+        self.buckets[positions] = rows
+        self.end = (self.end + len(rows)) % self.retention
+        self.size = min(self.retention, self.size + len(rows))
+
+    def _segments(self) -> List[np.ndarray]:
+        """Closed buckets in time order, as at most two views of the circular buffer"""
+        if self.size < self.retention:
+            return [self.buckets[:self.size]]
+        return [self.buckets[self.end:], self.buckets[:self.end]]
+
+    @property
+    def oldest(self) -> Optional[int]:
+        segments = [segment for segment in self._segments() if len(segment)]
+        if segments:
+            return int(segments[0]["start"][0])
+        return int(self.open["start"][0]) if self.open is not None else None
+
+    def rows(self, start: int, end: int) -> np.ndarray:
+        """Buckets (closed and open) overlapping [start, end), touching only those rows"""
+        # The bucket holding `start` begins before it
+        start -= start % self.resolution
+        parts = []
+        for segment in self._segments():
+            lo, hi = np.searchsorted(segment["start"], [start, end], side="left")
+            if hi > lo:
+                parts.append(segment[lo:hi])
+        if self.open is not None and start <= self.open["start"][0] < end:
+            parts.append(self.open)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=ROLLUP_DTYPE)
+
+
+class RollupEngine:
+    """
+    Chain activity pre-aggregated at several resolutions.
+    Blocks feed the finest tier; every closed bucket is compacted into the next coarser
+    tier, and each tier keeps only its own retention window. Chart queries are answered
+    from the coarsest tier that still gives enough points, so they stay at a few hundred rows.
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[int, int]] = DEFAULT_TIERS):
+        self.tiers = [
+            RollupTier(resolution, retention, finest=(i == 0), row_resolution=tiers[i - 1][0] if i else 1)
+            for i, (resolution, retention) in enumerate(tiers)
+        ]
+        self.last_timestamp: Optional[int] = None
+
+    def ingest(self, records: np.ndarray):
+        """Add per-block history records, which must be newer than anything ingested before"""
+        if len(records) == 0:
+            return
+        rows = block_rows(records)
+        for tier in self.tiers:
+            rows = tier.merge(rows)
+        self.last_timestamp = int(records["timestamp"][-1])
+
+    def rebuild(self, history) -> int:
+        """Replay the on-disk block history, in bounded chunks, over the longest retention window"""
+        if history.records == 0:
+            return 0
+        horizon = max(tier.resolution * tier.retention for tier in self.tiers)
+        ingested = 0
+        for chunk in history.iter_chunks(start=history.last_timestamp - horizon):
+            self.ingest(chunk)
+            ingested += len(chunk)
+        return ingested
+
+    def choose_tier(self, start: int, end: int, max_points: int) -> RollupTier:
+        """The finest tier that still covers `start` and answers in at most `max_points` buckets"""
+        for tier in self.tiers:
+            # A tier that has never evicted anything holds all the data there is
+            covers = tier.size < tier.retention or tier.oldest <= start
+            if covers and math.ceil((end - (start - start % tier.resolution)) / tier.resolution) <= max_points:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, start: int, end: int, max_points: int = 300, resolution: Optional[int] = None) -> Dict[str, Any]:
+        if resolution is not None:
+            tier = next((tier for tier in self.tiers if tier.resolution == resolution), None)
+            if tier is None:
+                raise ValueError(f"Resolution must be one of {[tier.resolution for tier in self.tiers]}")
+        else:
+            tier = self.choose_tier(start, end, max_points)
+        rows = tier.rows(start, end)
+        bucket_seconds = tier.resolution
+        tps_avg = rows["tx_count"].astype(np.float64)
+        if len(rows):
+            # Tier buckets that were candidates: those overlapping the queried span, up to the newest one
+            first = max(start - start % tier.resolution, tier.oldest)
+            last = min((end - 1) // tier.resolution * tier.resolution, int(tier.open["start"][0]))
+            if len(rows) > max_points:
+                # Even the coarsest tier is too fine for this span: fold its rows once more
+                bucket_seconds = tier.resolution * math.ceil(len(rows) / max_points)
+                rows = group_rows(rows, bucket_seconds)
+                zero_gaps(rows, bucket_seconds, tier.resolution, first, last)
+            # Average over the seconds a bucket has data for: the newest bucket is still filling,
+            # and the oldest may predate the first block
+            tps_avg = rows["tx_count"] / covered_seconds(
+                rows["start"], bucket_seconds, max(first, tier.first_row_start), tier.last_row_start + tier.row_resolution
+            )
+        return {
+            "resolution": bucket_seconds,
+            "tier": tier.resolution,
+            "buckets": {
+                "start": rows["start"].tolist(),
+                "blocks": rows["blocks"].tolist(),
+                "tx_count": rows["tx_count"].tolist(),
+                "fee_sum": rows["fee_sum"].tolist(),
+                "value_sum": rows["value_sum"].tolist(),
+                "tps_avg": tps_avg.tolist(),
+                "tps_min": rows["tps_min"].tolist(),
+                "tps_max": rows["tps_max"].tolist(),
+            },
+        }
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {"resolution": tier.resolution, "retention": tier.retention, "buckets": tier.size + (tier.open is not None), "oldest": tier.oldest}
+            for tier in self.tiers
+        ]
@@ -30,6 +30,7 @@ class MonadVisualizer {
         "Uniswap": ["0x3aE6D8A282D67893e17AA70ebFFb33EE5aa65893"]
       },
     };
+    this.derbySessionId = this.getDerbySessionId(); // Each browser races its own Derby config
     this.racerData = {}; // To store latest TPS data { name: { tps: 0 } }
     this.racerProgress = {}; // To store visual progress { name: 0 }
     this.racerWins = {}; // To store win counts { name: 0 }
@@ -77,7 +78,7 @@ class MonadVisualizer {
     console.log("Connecting to Perpetual Derby stream...");
     this.closeStreams(); // Ensure no other streams are active
 
-    const streamUrl = `${window.CONFIG.API_BASE_URL}/derby-stream`;
+    const streamUrl = `${window.CONFIG.API_BASE_URL}/derby-stream?session=${encodeURIComponent(this.derbySessionId)}`;
     this.derbyEventSource = new EventSource(streamUrl);
 
     this.derbyEventSource.onmessage = (event) => {
@@ -94,6 +95,17 @@ class MonadVisualizer {
     this.derbyEventSource.onerror = (err) => { console.error("Derby EventSource failed:", err); this.closeStreams(); };
   }
 
+  getDerbySessionId() {
+    // Persist the session id so a reload keeps racing the same configuration
+    const storageKey = "monadDerbySessionId";
+    let sessionId = window.localStorage.getItem(storageKey);
+    if (!sessionId) {
+      sessionId = `s${Date.now().toString(36)}${Math.random().toString(36).slice(2, 10)}`;
+      window.localStorage.setItem(storageKey, sessionId);
+    }
+    return sessionId;
+  }
+
   closeStreams() {
     if (this.eventSource) {
       this.eventSource.close();
@@ -550,7 +562,7 @@ class MonadVisualizer {
     }));
 
     try {
-        const response = await fetch(`${window.CONFIG.API_BASE_URL}/update-derby-config`, {
+        const response = await fetch(`${window.CONFIG.API_BASE_URL}/update-derby-config?session=${encodeURIComponent(this.derbySessionId)}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ entities: entitiesPayload })
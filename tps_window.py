@@ -0,0 +1,116 @@
+from array import array
+from typing import Dict, Iterable, Optional, Sequence
+
+
+def window_label(seconds: int) -> str:
+    """Short label for a window length, e.g. 10 -> '10s', 60 -> '1m', 300 -> '5m'"""
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+
+class BlockRing:
+    """
+    Fixed-size, array-backed ring buffer of per-block aggregates.
+
+    Every block is stored once as (block number, timestamp, one float per column).
+    Each configured window keeps a running sum and a tail pointer that slides
+    forward as new blocks arrive, so appends are amortized O(1) per window and
+    rate queries are O(1).
+    """
+
+    def __init__(self, capacity: int, windows: Sequence[int] = (10, 60, 300), columns: Sequence[str] = ("tx_count", "fee_sum")):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.windows = tuple(sorted(windows))
+        self.columns = tuple(columns)
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+
+        self.block_numbers = array("q", [0]) * capacity
+        self.timestamps = array("q", [0]) * capacity
+        self.values = [array("d", [0.0]) * capacity for _ in self.columns]
+
+        # Sequence numbers are monotonic; slot = seq % capacity
+        self.appended = 0
+        self.window_tails: Dict[int, int] = {w: 0 for w in self.windows}
+        self.window_sums: Dict[int, list] = {w: [0.0] * len(self.columns) for w in self.windows}
+
+    def __len__(self) -> int:
+        return min(self.appended, self.capacity)
+
+    @property
+    def oldest_seq(self) -> int:
+        return max(0, self.appended - self.capacity)
+
+    @property
+    def last_block_number(self) -> Optional[int]:
+        if not self.appended:
+            return None
+        return self.block_numbers[(self.appended - 1) % self.capacity]
+
+    @property
+    def last_timestamp(self) -> Optional[int]:
+        if not self.appended:
+            return None
+        return self.timestamps[(self.appended - 1) % self.capacity]
+
+    def _drop_from_window(self, window: int):
+        slot = self.window_tails[window] % self.capacity
+        sums = self.window_sums[window]
+        for i, column in enumerate(self.values):
+            sums[i] -= column[slot]
+        self.window_tails[window] += 1
+
+    def append(self, block_number: int, timestamp: int, values: Iterable[float]):
+        """Record one block. Blocks must be appended in ascending order."""
+        # The slot about to be overwritten must leave every window first
+        if self.appended >= self.capacity:
+            evicted = self.appended - self.capacity
+            for window in self.windows:
+                if self.window_tails[window] == evicted:
+                    self._drop_from_window(window)
+
+        slot = self.appended % self.capacity
+        self.block_numbers[slot] = block_number
+        self.timestamps[slot] = timestamp
+        for i, value in enumerate(values):
+            self.values[i][slot] = value
+        self.appended += 1
+
+        for window in self.windows:
+            sums = self.window_sums[window]
+            for i, column in enumerate(self.values):
+                sums[i] += column[slot]
+            # Slide the tail past blocks that are now older than the window
+            cutoff = timestamp - window
+            while self.timestamps[self.window_tails[window] % self.capacity] <= cutoff:
+                self._drop_from_window(window)
+
+    def window_sum(self, window: int, column: str) -> float:
+        return self.window_sums[window][self.column_index[column]]
+
+    def rate(self, window: int, column: str = "tx_count") -> float:
+        """
+        Per-second rate of a column over the last `window` seconds of chain time.
+        Until the ring holds a full window of history, the rate is taken over the
+        span actually covered, excluding the first block whose start time is unknown.
+        """
+        if not self.appended:
+            return 0.0
+        tail = self.window_tails[window]
+        total = self.window_sums[window][self.column_index[column]]
+        if tail > self.oldest_seq:
+            # A block just before the window is still in memory: the window is full
+            return total / window
+        tail_slot = tail % self.capacity
+        span = self.last_timestamp - self.timestamps[tail_slot]
+        if span <= 0:
+            return 0.0
+        return (total - self.values[self.column_index[column]][tail_slot]) / span
+
+    def rates(self, column: str = "tx_count") -> Dict[str, float]:
+        """Rates for every configured window, keyed by window label"""
+        return {window_label(w): self.rate(w, column) for w in self.windows}
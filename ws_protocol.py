@@ -0,0 +1,187 @@
+"""
+Binary frame format for the /ws endpoint.
+
+One WebSocket carries both live feeds. Control traffic is JSON text; data is binary.
+
+Client -> server (text):
+    {"op": "subscribe",   "stream": "firehose"}
+    {"op": "subscribe",   "stream": "derby", "session": "<id>"}
+    {"op": "unsubscribe", "stream": "firehose" | "derby", "session": "<id>"}
+
+Server -> client (text):
+    {"type": "hello", "protocol": 1, "windows": ["10s", "1m", "5m"], "primary_window": "10s"}
+    {"type": "subscribed", "stream": ..., "channel": <u32>, ["session": ...]}
+    {"type": "unsubscribed" | "evicted" | "error", ...}
+
+Server -> client (binary), all little-endian. Every frame starts with an 8-byte header:
+    u8  frame type      (1 = firehose, 2 = derby)
+    u8  flags           (bit 0 = keyframe, bit 1 = full derby matrix)
+    u16 count           (firehose: number of windows, derby: see below)
+    u32 sequence        (per-channel, increases by one per published event)
+
+Firehose frame (always a keyframe), W = count:
+    u64 latest block number, u32 latest block timestamp, f64 total fees in batch (MON),
+    f32 tps, u32 N transactions
+    f32[W] tps per window, f32[W] fee rate per window (window order from "hello")
+    f32[N] transaction values (MON)
+    N * 32 bytes of raw transaction hashes
+
+Derby keyframe, E = count entities:
+    u32 channel, u32 config version
+    f32[E * W] tps matrix, entity-major (row e holds the W window rates of entity e)
+    E entity names, each as u8 length + utf-8 bytes
+
+Derby delta, K = count changed cells; only sent when the previous frame on the channel
+(sequence - 1) was delivered to this socket and has the same config version:
+    u32 channel, u32 config version
+    f32[K] new values, u16[K] cell indexes into the E * W matrix
+When so many cells changed that their indexes would make the delta larger than the
+matrix itself, the delta carries every cell instead (flag bit 1, K = E * W):
+    u32 channel, u32 config version
+    f32[K] the whole tps matrix, entity-major, no names
+
+Every variable-length float array starts on a 4-byte boundary, so browsers can read
+them with Float32Array views directly on the received ArrayBuffer.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+PROTOCOL_VERSION = 1
+
+FRAME_FIREHOSE = 1
+FRAME_DERBY = 2
+FLAG_KEYFRAME = 0x01
+FLAG_FULL_MATRIX = 0x02
+
+# Channel ids: the firehose is 0, Derby sessions get 1.. from the session registry
+FIREHOSE_CHANNEL = 0
+
+HEADER = struct.Struct("<BBHI")
+FIREHOSE_FIELDS = struct.Struct("<QIdfI")
+DERBY_FIELDS = struct.Struct("<II")
+HASH_BYTES = 32
+
+
+@dataclass(frozen=True)
+class StreamEvent:
+    """
+    One published event in every encoding a transport needs, each built exactly once.
+    `delta` is only valid for a receiver that got the immediately preceding event.
+    """
+    sse: bytes
+    frame: bytes
+    delta: Optional[bytes] = None
+
+
+def hello(window_labels: Sequence[str], primary_window: str) -> Dict[str, Any]:
+    return {"type": "hello", "protocol": PROTOCOL_VERSION, "windows": list(window_labels), "primary_window": primary_window}
+
+
+def encode_firehose_frame(seq: int, latest_block: int, timestamp: int, total_fees: float, tps: float,
+                          tps_windows: Sequence[float], fee_windows: Sequence[float],
+                          values: np.ndarray, hashes: bytes) -> bytes:
+    """Pack one firehose batch; `hashes` is the concatenation of the raw 32-byte hashes"""
+    count = len(values)
+    if len(hashes) != count * HASH_BYTES:
+        raise ValueError(f"Expected {count * HASH_BYTES} hash bytes, got {len(hashes)}")
+    return b"".join((
+        HEADER.pack(FRAME_FIREHOSE, FLAG_KEYFRAME, len(tps_windows), seq & 0xFFFFFFFF),
+        FIREHOSE_FIELDS.pack(latest_block, timestamp, total_fees, tps, count),
+        np.asarray(tps_windows, dtype="<f4").tobytes(),
+        np.asarray(fee_windows, dtype="<f4").tobytes(),
+        np.asarray(values, dtype="<f4").tobytes(),
+        hashes,
+    ))
+
+
+def encode_derby_keyframe(seq: int, channel: int, config_version: int, matrix: np.ndarray, entity_names: Sequence[str]) -> bytes:
+    names = []
+    for name in entity_names:
+        raw = name.encode()[:255]
+        names.append(bytes((len(raw),)) + raw)
+    return b"".join((
+        HEADER.pack(FRAME_DERBY, FLAG_KEYFRAME, len(entity_names), seq & 0xFFFFFFFF),
+        DERBY_FIELDS.pack(channel, config_version),
+        np.ascontiguousarray(matrix, dtype="<f4").tobytes(),
+        *names,
+    ))
+
+
+def encode_derby_delta(seq: int, channel: int, config_version: int, matrix: np.ndarray, previous: np.ndarray) -> Optional[bytes]:
+    """
+    Changed cells of `matrix` relative to `previous`, or every cell (without the keyframe's
+    names) when that is smaller; None if the shapes don't allow a delta
+    """
+    current = np.ascontiguousarray(matrix, dtype="<f4").ravel()
+    before = np.ascontiguousarray(previous, dtype="<f4").ravel()
+    if current.shape != before.shape or len(current) > 0xFFFF:
+        return None
+    changed = np.flatnonzero(current != before)
+    # Rates move on nearly every tick: 6 bytes per changed cell against 4 per cell
+    if 6 * len(changed) >= 4 * len(current):
+        return b"".join((
+            HEADER.pack(FRAME_DERBY, FLAG_FULL_MATRIX, len(current), seq & 0xFFFFFFFF),
+            DERBY_FIELDS.pack(channel, config_version),
+            current.tobytes(),
+        ))
+    return b"".join((
+        HEADER.pack(FRAME_DERBY, 0, len(changed), seq & 0xFFFFFFFF),
+        DERBY_FIELDS.pack(channel, config_version),
+        current[changed].tobytes(),
+        changed.astype("<u2").tobytes(),
+    ))
+
+
+def frame_seq(frame: bytes) -> int:
+    return HEADER.unpack_from(frame, 0)[3]
+
+
+def retag_derby_channel(frame: bytes, channel: int) -> bytes:
+    """Copy of a derby frame addressed to another channel, e.g. the session's id in another process"""
+    return frame[:HEADER.size] + struct.pack("<I", channel) + frame[HEADER.size + 4:]
+
+
+def decode_frame(frame: bytes, window_count: int) -> Dict[str, Any]:
+    """Reference decoder, mirroring what a browser client does with DataView/Float32Array"""
+    kind, flags, count, seq = HEADER.unpack_from(frame, 0)
+    offset = HEADER.size
+    result: Dict[str, Any] = {"type": kind, "keyframe": bool(flags & FLAG_KEYFRAME), "seq": seq}
+    if kind == FRAME_FIREHOSE:
+        latest_block, timestamp, total_fees, tps, n = FIREHOSE_FIELDS.unpack_from(frame, offset)
+        offset += FIREHOSE_FIELDS.size
+        tps_windows = np.frombuffer(frame, "<f4", count, offset); offset += 4 * count
+        fee_windows = np.frombuffer(frame, "<f4", count, offset); offset += 4 * count
+        values = np.frombuffer(frame, "<f4", n, offset); offset += 4 * n
+        hashes = frame[offset:offset + n * HASH_BYTES]
+        result.update(
+            latest_block=latest_block, timestamp=timestamp, total_fees=total_fees, tps=tps,
+            tps_windows=tps_windows.tolist(), fee_rate_windows=fee_windows.tolist(), values=values.tolist(),
+            hashes=["0x" + hashes[i:i + HASH_BYTES].hex() for i in range(0, len(hashes), HASH_BYTES)],
+        )
+        return result
+    if kind == FRAME_DERBY:
+        channel, config_version = DERBY_FIELDS.unpack_from(frame, offset)
+        offset += DERBY_FIELDS.size
+        result.update(channel=channel, config_version=config_version)
+        if result["keyframe"]:
+            matrix = np.frombuffer(frame, "<f4", count * window_count, offset).reshape(count, window_count)
+            offset += 4 * count * window_count
+            names: List[str] = []
+            for _ in range(count):
+                length = frame[offset]
+                names.append(frame[offset + 1:offset + 1 + length].decode())
+                offset += 1 + length
+            result.update(matrix=matrix.copy(), entity_names=names)
+        elif flags & FLAG_FULL_MATRIX:
+            values = np.frombuffer(frame, "<f4", count, offset)
+            result.update(values=values.copy(), indexes=np.arange(count, dtype=np.int64))
+        else:
+            values = np.frombuffer(frame, "<f4", count, offset)
+            indexes = np.frombuffer(frame, "<u2", count, offset + 4 * count)
+            result.update(values=values.copy(), indexes=indexes.astype(np.int64))
+        return result
+    raise ValueError(f"Unknown frame type {kind}")